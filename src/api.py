@@ -0,0 +1,92 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+from endpoints import ApiHandler
+from search_engine import SearchEngine
+
+
+# Sent when every worker is busy and the queue is full
+BUSY_RESPONSE = (b'HTTP/1.0 503 Service Unavailable\r\n'
+                 b'Content-Type: application/json\r\n'
+                 b'Content-Length: 27\r\n'
+                 b'Retry-After: 1\r\n'
+                 b'\r\n'
+                 b'{"error": "server is busy"}')
+
+
+class ApiServer(HTTPServer):
+    """
+    A local HTTP server for the JSON API of the search engine (see
+    endpoints.py), meant to be put behind a load balancer.
+
+    Requests are handled by a pool of worker threads that all search the
+    same search engine. The segments, lexicons and document tables are only
+    read by searches, and the posting cache has its own lock, so the
+    searches run at the same time. At most queue_size requests wait for a
+    worker; more than that get a 503 right away instead of piling up. A
+    search that takes longer than request_timeout seconds gets a 504.
+    """
+
+    # Connections the OS keeps waiting to be accepted
+    request_queue_size = 128
+
+    def __init__(self, address, search_engine, workers=8, queue_size=64, request_timeout=5.0):
+        super().__init__(address, ApiHandler)
+        self.search_engine = search_engine
+        self.request_timeout = request_timeout
+
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # A slot for every request that is handled or waits for a worker
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+
+if __name__ == '__main__':
+    # python3 src/api.py [corpus] [--port 8000] [--workers 8] [--timeout 5]
+    args = sys.argv[1:]
+    options = {'--port': 8000, '--workers': 8, '--timeout': 5.0}
+    for option, default in options.items():
+        if option in args:
+            i = args.index(option)
+            options[option] = type(default)(args[i + 1])
+            del args[i:i + 2]
+
+    if args:
+        search_engine = SearchEngine(args[0])
+    else:
+        search_engine = SearchEngine()
+
+    server = ApiServer(('', options['--port']), search_engine,
+                       workers=options['--workers'], request_timeout=options['--timeout'])
+    print(f'Serving on port {options["--port"]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
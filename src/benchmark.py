@@ -0,0 +1,344 @@
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+from corpus_generator import CorpusGenerator
+from file_handler import FileHandler
+from indexer import Indexer
+from search_engine import SearchEngine
+from segments import save_manifest
+from tokenizer import Tokenizer
+from vector_top_k import VectorTopKRetriever
+
+
+def percentile(values: [float], p: float) -> float:
+    """
+    Returns the p-th percentile of values (nearest rank).
+    """
+    values = sorted(values)
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def latency_summary(latencies: [float]) -> dict:
+    """
+    Summarizes latencies in seconds as milliseconds.
+    """
+    return {
+        'count': len(latencies),
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000,
+    }
+
+
+class Benchmark:
+    """
+    Measures how long the search engine takes to index a corpus and to answer
+    queries, and returns the numbers as a dict (written as json) so that two
+    runs can be compared.
+
+    Everything runs in workdir, which gets its own ./db and
+    index_status.log, so the index of the real corpus is never touched. By
+    default the corpus is a synthetic one (see CorpusGenerator) of documents
+    pages, written to workdir/corpus_<seed>_<documents> the first time.
+
+    Indexing is measured stage by stage:
+    parse_file -> reading and parsing every json file of the corpus
+    tokenize -> tokenizing the parsed text (with a new tokenizer, so the
+                stem memo table starts empty)
+    index -> Indexer.index (parse, tokenize and write the partial indexes)
+    merge_indexes -> merging the partial indexes and the document lengths
+    finalize_index -> the tf-idf (lnc) pass, tiers, lexicon (file pointer
+                      locations) and document table
+
+    Queries are measured by replaying a query set (one query per line, or
+    made by CorpusGenerator) rounds times through SearchEngine.find, with
+    the result cache off unless result_cache is set.
+
+    Every page of the corpus is also parsed with BeautifulSoup, and the
+    pages whose text or weighted fields are not the same as with the lxml
+    extractor are counted (extractor_mismatches).
+
+    Every query is also run once with and once without the tiers, and the
+    queries whose top 10 are not the same are counted (tier_mismatches).
+    The same is done for the default ranking (tiers and MaxScore pruning)
+    against scoring every document of the full postings
+    (pruning_mismatches).
+    The index is built with tiers of tier_size postings, so the default
+    corpus has words with postings longer than a tier.
+    """
+
+    def __init__(self, workdir='./bench', corpus=None, documents=2000, seed=121, queries=None,
+                 query_count=500, rounds=3, workers=1, result_cache=False, tier_size=1000):
+        self.workdir = os.path.abspath(workdir)
+        self.corpus = os.path.abspath(corpus) if corpus is not None else None
+        self.documents = documents
+        self.seed = seed
+        self.queries = os.path.abspath(queries) if queries is not None else None
+        self.query_count = query_count
+        self.rounds = rounds
+        self.workers = workers
+        self.result_cache = result_cache
+        self.tier_size = tier_size
+
+    def run(self) -> dict:
+        nltk_data = os.path.abspath('./nltk_data')
+        os.makedirs(self.workdir + '/db', exist_ok=True)
+        os.chdir(self.workdir)
+
+        # The nltk data of the project is used instead of downloading it again
+        if os.path.isdir(nltk_data) and not os.path.exists('./nltk_data'):
+            os.symlink(nltk_data, './nltk_data')
+
+        generator = CorpusGenerator(self.seed)
+        corpus = self.corpus
+        if corpus is None:
+            corpus = self.workdir + f'/corpus_{self.seed}_{self.documents}'
+            if not os.path.isdir(corpus):
+                generator.write(corpus, self.documents)
+
+        if self.queries is not None:
+            with open(self.queries, 'r') as f:
+                queries = [line.strip() for line in f if line.strip()]
+        else:
+            queries = generator.queries(self.query_count)
+
+        # The progress messages of the engine go to stderr, so only the
+        # results are on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            index = self.benchmark_index(corpus)
+            query = self.benchmark_queries(corpus, queries)
+
+        return {
+            'time': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'corpus': corpus if self.corpus is not None else {
+                'seed': self.seed, 'documents': self.documents},
+            'workers': self.workers,
+            'index': index,
+            'query': query,
+        }
+
+    def benchmark_index(self, corpus: str) -> dict:
+        file_handler = FileHandler()
+        indexer = Indexer(file_handler, workers=self.workers, tier_size=self.tier_size)
+        stages = dict()
+        extractor_mismatches = 0
+
+        if os.path.isdir(corpus):
+            start_time = time.perf_counter()
+            parsed = [file_handler.parse_file(filename)
+                      for filename in file_handler.walk_files(corpus, '.json')]
+            stages['parse_file'] = time.perf_counter() - start_time
+
+            tokenizer = Tokenizer()
+            start_time = time.perf_counter()
+            for document in parsed:
+                for text in document[1:]:
+                    tokenizer.tokenize(text)
+            stages['tokenize'] = time.perf_counter() - start_time
+            del parsed
+
+            extractor_mismatches = self.check_extractor(file_handler, corpus)
+
+        file_handler.remove_segments()
+        file_handler.remove_partial_indexes()
+        file_handler.set_index_status(False, datetime.now())
+
+        start_time = time.perf_counter()
+        indexer.index(corpus)
+        stages['index'] = time.perf_counter() - start_time
+        documents = len(indexer.urls)
+
+        start_time = time.perf_counter()
+        normalizer = indexer.merge_indexes('./db', './db/index_merged.bin')
+        stages['merge_indexes'] = time.perf_counter() - start_time
+        file_handler.remove_partial_indexes()
+
+        folder = './db/seg_0'
+        os.mkdir(folder)
+        start_time = time.perf_counter()
+        indexer.finalize_index('./db/index_merged.bin', folder + '/index.bin',
+                               folder + '/tier.bin', folder + '/lexicon.bin',
+                               folder + '/doc_table.bin', normalizer)
+        stages['finalize_index'] = time.perf_counter() - start_time
+        file_handler.remove_merged_index('./db/index_merged.bin')
+
+        save_manifest(file_handler, {'next_doc_id': indexer.doc_id, 'next_segment': 1,
+                                     'segments': [{'name': 'seg_0', 'first_doc_id': 1}]})
+        file_handler.set_index_status(True, datetime.now())
+
+        total = stages['index'] + stages['merge_indexes'] + stages['finalize_index']
+        return {
+            'documents': documents,
+            'stages_s': stages,
+            'total_s': total,
+            'documents_per_s': documents / total,
+            'bytes': {file: os.path.getsize(folder + '/' + file) for file in sorted(os.listdir(folder))},
+            'extractor_mismatches': extractor_mismatches,
+        }
+
+    def check_extractor(self, file_handler, corpus: str) -> int:
+        """
+        Returns the number of pages whose text and weighted fields from the
+        lxml extractor are not the same as from BeautifulSoup (it should be
+        0).
+        """
+        mismatches = 0
+        for filename in file_handler.walk_files(corpus, '.json'):
+            with open(filename, 'r') as f:
+                content = json.load(f)['content']
+            if file_handler.parse_content(content) != file_handler.parse_content_soup(content):
+                mismatches += 1
+        return mismatches
+
+    def benchmark_queries(self, corpus: str, queries: [str]) -> dict:
+        start_time = time.perf_counter()
+        search_engine = SearchEngine(corpus)
+        startup = time.perf_counter() - start_time
+
+        if not self.result_cache:
+            search_engine.query.result_cache = None
+
+        latencies = []
+        rounds = []
+        for _ in range(self.rounds):
+            round_latencies = []
+            for query in queries:
+                start_time = time.perf_counter()
+                search_engine.find(query)
+                round_latencies.append(time.perf_counter() - start_time)
+            rounds.append(latency_summary(round_latencies))
+            latencies += round_latencies
+
+        results = latency_summary(latencies)
+        results['startup_s'] = startup
+        results['queries_per_s'] = len(latencies) / sum(latencies)
+        results['result_cache'] = self.result_cache
+        results['rounds'] = rounds
+        results['posting_cache'] = search_engine.posting_cache.stats()
+        results['tier_mismatches'] = self.check_tiers(search_engine, queries)
+        results['pruning_mismatches'] = self.check_pruning(search_engine, queries)
+        return results
+
+    def check_tiers(self, search_engine, queries: [str]) -> int:
+        """
+        Returns the number of queries whose results with the tiers are not
+        the same as with the full postings (it should be 0).
+        """
+        query = search_engine.query
+        result_cache = query.result_cache
+        query.result_cache = None
+
+        mismatches = 0
+        for text in queries:
+            query.use_tiers = True
+            tiered = query.search(text)
+            query.use_tiers = False
+            if query.search(text) != tiered:
+                mismatches += 1
+
+        query.use_tiers = True
+        query.result_cache = result_cache
+        return mismatches
+
+    def check_pruning(self, search_engine, queries: [str]) -> int:
+        """
+        Returns the number of queries whose results (with the tiers and
+        MaxScore pruning) are not the same as when every document of the
+        full postings is scored (it should be 0).
+        """
+        query = search_engine.query
+        result_cache = query.result_cache
+        query.result_cache = None
+        retrievers = (query.retriever, query.candidate_retriever)
+
+        mismatches = 0
+        for text in queries:
+            pruned = query.search(text)
+
+            # VectorTopKRetriever scores every document of the postings
+            query.use_tiers = False
+            query.retriever = VectorTopKRetriever(k=retrievers[0].k)
+            query.candidate_retriever = VectorTopKRetriever(k=retrievers[1].k)
+            if query.search(text) != pruned:
+                mismatches += 1
+            query.use_tiers = True
+            query.retriever, query.candidate_retriever = retrievers
+
+        query.result_cache = result_cache
+        return mismatches
+
+
+def compare(old: dict, new: dict, threshold: float) -> [str]:
+    """
+    Returns a line for every time of new that is more than threshold (i.e.
+    0.2 for 20%) slower than the same time of old.
+    """
+    times = [('index ' + stage, old['index']['stages_s'].get(stage), new_time)
+             for stage, new_time in new['index']['stages_s'].items()]
+    times += [('query ' + key, old['query'].get(key), new['query'][key])
+              for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+
+    regressions = []
+    for name, old_time, new_time in times:
+        if old_time and new_time > old_time * (1 + threshold):
+            regressions.append(f'{name}: {old_time:.4f} -> {new_time:.4f} '
+                               f'(+{(new_time / old_time - 1) * 100:.0f}%)')
+    return regressions
+
+
+if __name__ == '__main__':
+    # python3 src/benchmark.py [--out results.json] [--compare old.json]
+    #     [--threshold 0.2] [--workdir ./bench] [--corpus DEV] [--documents 2000]
+    #     [--seed 121] [--queries queries.txt] [--query-count 500] [--rounds 3]
+    #     [--workers 1] [--tier-size 1000] [--result-cache]
+    args = sys.argv[1:]
+    options = {'--out': None, '--compare': None, '--threshold': 0.2, '--workdir': './bench',
+               '--corpus': None, '--documents': 2000, '--seed': 121, '--queries': None,
+               '--query-count': 500, '--rounds': 3, '--workers': 1, '--tier-size': 1000}
+    for option, default in options.items():
+        if option in args:
+            i = args.index(option)
+            options[option] = args[i + 1] if default is None else type(default)(args[i + 1])
+            del args[i:i + 2]
+
+    out = os.path.abspath(options['--out']) if options['--out'] else None
+    old = None
+    if options['--compare']:
+        with open(options['--compare'], 'r') as f:
+            old = json.load(f)
+
+    benchmark = Benchmark(options['--workdir'], options['--corpus'], options['--documents'],
+                          options['--seed'], options['--queries'], options['--query-count'],
+                          options['--rounds'], options['--workers'], '--result-cache' in args,
+                          options['--tier-size'])
+    results = benchmark.run()
+
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+    # Exits with 1 if the extractor, the tiers or the pruning changed any
+    # results, or if anything got slower than the threshold
+    failed = False
+    for stage, check in (('index', 'extractor_mismatches'), ('query', 'tier_mismatches'),
+                         ('query', 'pruning_mismatches')):
+        if results[stage][check] > 0:
+            print(f'{check}: {results[stage][check]}', file=sys.stderr)
+            failed = True
+    if old is not None:
+        regressions = compare(old, results, options['--threshold'])
+        for regression in regressions:
+            print('Regression: ' + regression, file=sys.stderr)
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,196 @@
+import itertools
+import os
+from array import array
+
+
+# The checkpoint of the build that is running (or was stopped)
+CHECKPOINT = './db/build_checkpoint.json'
+# The urls of the documents indexed so far, one per line in doc id order
+URL_LOG = './db/build_urls.txt'
+# The fingerprints of the same documents, 8 bytes each in doc id order
+FINGERPRINT_LOG = './db/build_fingerprints.bin'
+# The length of every document, saved once the partial indexes are merged
+DOC_LENGTHS = './db/build_doc_lengths.bin'
+
+
+def sync(filename: str) -> None:
+    """
+    Makes sure a file is on disk, not only in the page cache.
+    """
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BuildCheckpoint:
+    """
+    Records how far an index build got, so that a build that was stopped
+    (crash, kill, preempted machine) starts again from its last checkpoint
+    instead of from scratch, and makes the same index.
+
+    The state is:
+    source -> the corpus (or crawl batch) being indexed
+    segment -> the segment folder the build makes
+    first_doc_id -> the first doc id of the build
+    stage -> 'index' (writing partial indexes), 'merged' (partial indexes
+             merged, doc lengths saved) or 'finalized' (segment written)
+    consumed -> how many documents of the source are in complete partial
+                indexes (duplicates included)
+    index_id -> the id of the next partial index (every one before it is
+                complete)
+    doc_id -> the next doc id after the consumed documents
+    duplicates -> the near-duplicate documents dropped by the merge, as
+                  [doc id, doc id of the document it duplicates] (once
+                  merged)
+
+    Partial indexes and other files are synced to disk before the
+    checkpoint that counts on them is written, and the checkpoint replaces
+    the old one in a single rename.
+    """
+
+    def __init__(self, file_handler):
+        self.file_handler = file_handler
+        self.state = None
+
+        # How many urls are in the url log
+        self.logged = 0
+
+    def load(self) -> bool:
+        """
+        Loads the checkpoint of a stopped build. Returns False if there is
+        none.
+        """
+        if not os.path.isfile(CHECKPOINT) or os.path.getsize(CHECKPOINT) == 0:
+            return False
+        self.state = self.file_handler.load_json(CHECKPOINT)
+        self.logged = self.state['doc_id'] - self.state['first_doc_id']
+        return True
+
+    def matches(self, source: str, segment: str, first_doc_id: int) -> bool:
+        """
+        Returns True if the loaded checkpoint is from a build of the same
+        source into the same segment.
+        """
+        return (self.state is not None
+                and self.state['source'] == source
+                and self.state['segment'] == segment
+                and self.state['first_doc_id'] == first_doc_id)
+
+    def start(self, source: str, segment: str, first_doc_id: int) -> None:
+        """
+        Starts the checkpoint of a new build.
+        """
+        self.state = {
+            'source': source,
+            'segment': segment,
+            'first_doc_id': first_doc_id,
+            'stage': 'index',
+            'consumed': 0,
+            'index_id': 0,
+            'doc_id': first_doc_id,
+        }
+        open(URL_LOG, 'w').close()
+        open(FINGERPRINT_LOG, 'w').close()
+        self.logged = 0
+        self.save()
+
+    def save(self, files=()) -> None:
+        """
+        Syncs files (the files the new state counts on) and then writes the
+        state.
+        """
+        for filename in files:
+            sync(filename)
+
+        self.file_handler.dump_json(self.state, CHECKPOINT + '.tmp')
+        sync(CHECKPOINT + '.tmp')
+        os.replace(CHECKPOINT + '.tmp', CHECKPOINT)
+
+    def index_done(self, consumed: int, doc_count: int, index_id: int, urls: [str],
+                   fingerprints: array, files=()) -> None:
+        """
+        Checkpoint of the indexing stage: every partial index before index_id
+        is complete, and they hold the first consumed documents of the
+        source, which are the first doc_count documents of urls (and
+        fingerprints). The urls and fingerprints that aren't in the logs yet
+        are added to them.
+        """
+        with open(URL_LOG, 'a') as log:
+            for url in itertools.islice(urls, self.logged, doc_count):
+                log.write(url + '\n')
+        with open(FINGERPRINT_LOG, 'ab') as log:
+            fingerprints[self.logged:doc_count].tofile(log)
+        self.logged = doc_count
+
+        self.state['consumed'] = consumed
+        self.state['index_id'] = index_id
+        self.state['doc_id'] = self.state['first_doc_id'] + doc_count
+        self.save(list(files) + [URL_LOG, FINGERPRINT_LOG])
+
+    def read_urls(self) -> [str]:
+        """
+        Returns the urls of the documents in complete partial indexes. Urls
+        logged after the checkpoint are cut off the log, so the next urls are
+        added after the right line.
+        """
+        urls = []
+        with open(URL_LOG, 'r+b') as log:
+            while len(urls) < self.logged:
+                urls.append(str(log.readline(), 'utf-8').rstrip('\n'))
+            log.truncate(log.tell())
+        return urls
+
+    def read_fingerprints(self) -> array:
+        """
+        Returns the fingerprints of the documents in complete partial
+        indexes, and cuts the ones logged after the checkpoint off the log.
+        """
+        fingerprints = array('Q')
+        with open(FINGERPRINT_LOG, 'r+b') as log:
+            fingerprints.frombytes(log.read(self.logged * fingerprints.itemsize))
+            log.truncate(log.tell())
+        return fingerprints
+
+    def merge_done(self, normalizer: {int: float}, duplicates: {int: int}, files=()) -> None:
+        """
+        Checkpoint of the merge stage. The document lengths are saved as
+        an array of doubles by doc id (0 for documents without words), and
+        the near-duplicates the merge dropped are kept in the state.
+        """
+        first_doc_id = self.state['first_doc_id']
+        lengths = array('d', bytes(8 * (self.state['doc_id'] - first_doc_id)))
+        for doc_id, length in normalizer.items():
+            lengths[doc_id - first_doc_id] = length
+
+        with open(DOC_LENGTHS, 'wb') as f:
+            lengths.tofile(f)
+
+        self.state['duplicates'] = sorted(duplicates.items())
+        self.state['stage'] = 'merged'
+        self.save(list(files) + [DOC_LENGTHS])
+
+    def read_doc_lengths(self) -> {int: float}:
+        lengths = array('d')
+        with open(DOC_LENGTHS, 'rb') as f:
+            lengths.frombytes(f.read())
+
+        first_doc_id = self.state['first_doc_id']
+        return {first_doc_id + i: length for i, length in enumerate(lengths) if length}
+
+    def read_duplicates(self) -> {int: int}:
+        return {doc_id: original for doc_id, original in self.state.get('duplicates', [])}
+
+    def finalize_done(self, files=()) -> None:
+        self.state['stage'] = 'finalized'
+        self.save(files)
+
+    def remove(self) -> None:
+        """
+        Removes the checkpoint once the build is done.
+        """
+        for filename in (CHECKPOINT, URL_LOG, FINGERPRINT_LOG, DOC_LENGTHS):
+            if os.path.isfile(filename):
+                os.remove(filename)
+        self.state = None
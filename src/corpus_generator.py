@@ -0,0 +1,112 @@
+import bisect
+import itertools
+import json
+import os
+import random
+import sys
+
+
+# Syllables the made up words are built from
+CONSONANTS = 'bcdfghjklmnprstvwz'
+VOWELS = 'aeiou'
+
+
+class CorpusGenerator:
+    """
+    Makes synthetic corpora in the format of ./DEV (one json file per page,
+    {"url": ..., "content": <html>, "encoding": "utf-8"}, in a folder per
+    site) to benchmark the search engine at any size.
+
+    The words follow Zipf's law like real text: the word of rank r is used in
+    proportion to 1 / r^zipf_exponent, so a few words are in almost every
+    page and most words are rare. Everything comes from seed, and every
+    document is made from its own number, so the same seed always gives the
+    same corpus and the first n documents of a big corpus are the same as a
+    corpus of n documents.
+    """
+
+    def __init__(self, seed=121, vocabulary_size=50000, zipf_exponent=1.1, sites=20,
+                 min_words=50, max_words=1500):
+        self.seed = seed
+        self.sites = sites
+        self.min_words = min_words
+        self.max_words = max_words
+
+        self.vocabulary = self.make_vocabulary(vocabulary_size)
+        # Cumulative weights of the words by rank, to pick words with bisect
+        self.cumulative_weights = list(itertools.accumulate(
+            1 / rank ** zipf_exponent for rank in range(1, vocabulary_size + 1)))
+
+    def make_vocabulary(self, size: int) -> [str]:
+        """
+        Makes size different words out of 1 to 4 syllables.
+        """
+        rng = random.Random(f'{self.seed}-vocabulary')
+        words = []
+        seen = set()
+        while len(words) < size:
+            word = ''.join(rng.choice(CONSONANTS) + rng.choice(VOWELS)
+                           for _ in range(rng.randint(1, 4)))
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+        return words
+
+    def words(self, rng: random.Random, count: int) -> str:
+        total = self.cumulative_weights[-1]
+        return ' '.join(self.vocabulary[bisect.bisect(self.cumulative_weights, rng.random() * total)]
+                        for _ in range(count))
+
+    def document(self, number: int) -> dict:
+        """
+        Returns document number of the corpus.
+        """
+        rng = random.Random(f'{self.seed}-{number}')
+
+        title = self.words(rng, rng.randint(2, 8))
+        headers = ''.join(f'<h2>{self.words(rng, rng.randint(2, 6))}</h2>'
+                          for _ in range(rng.randint(0, 3)))
+        paragraphs = []
+        for _ in range(rng.randint(1, 5)):
+            text = self.words(rng, rng.randint(self.min_words, self.max_words) // 3)
+            bold = self.words(rng, rng.randint(1, 4))
+            paragraphs.append(f'<p>{text} <b>{bold}</b></p>')
+
+        # Real pages have css and js, which must not be indexed. It doesn't use
+        # rng, so the words of the corpus are the same with or without it.
+        code = f'<style>p {{ margin: 0 }}</style><script>var page = {number};</script>'
+        content = (f'<html><head><title>{title}</title>{code}</head><body>'
+                   f'<h1>{title}</h1>{headers}{"".join(paragraphs)}</body></html>')
+        url = f'https://site{number % self.sites}.example.edu/page{number // self.sites}'
+        return {'url': url, 'content': content, 'encoding': 'utf-8'}
+
+    def write(self, folder: str, documents: int) -> None:
+        """
+        Writes the first documents documents of the corpus to folder, one
+        folder per site like ./DEV.
+        """
+        for number in range(documents):
+            site = f'{folder}/site{number % self.sites}'
+            if number < self.sites:
+                os.makedirs(site, exist_ok=True)
+            with open(f'{site}/{number // self.sites:06d}.json', 'w') as f:
+                json.dump(self.document(number), f)
+
+    def queries(self, count: int) -> [str]:
+        """
+        Returns count queries of 1 to 4 words drawn from the same vocabulary,
+        so they match the corpus. Popular queries come up many times, like
+        in a real query log.
+        """
+        rng = random.Random(f'{self.seed}-queries')
+        return [self.words(rng, rng.choice((1, 1, 2, 2, 2, 3, 3, 4))) for _ in range(count)]
+
+
+if __name__ == '__main__':
+    # python3 src/corpus_generator.py <folder> [documents] [seed]
+    folder = sys.argv[1]
+    documents = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 121
+
+    CorpusGenerator(seed).write(folder, documents)
+    print(f'Wrote {documents} documents to {folder}')
@@ -0,0 +1,89 @@
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+
+
+# Size of the reads done on archives. Large sequential reads are much faster
+# than opening hundreds of thousands of small files.
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+class CorpusReader:
+    """
+    Reads the documents of a corpus. The corpus can be a folder of json files
+    (like ./DEV), a zip or tar archive of that folder (.zip, .tar, .tar.gz,
+    .tgz, .tar.bz2, .tar.xz, .tar.zst) or a JSONL bundle with one json
+    document per line (.jsonl, .jsonl.gz, .jsonl.zst).
+
+    Documents always come out in the same order for the same corpus, so the
+    doc ids given by the indexer don't change between runs.
+    """
+
+    def __init__(self, file_handler):
+        self.file_handler = file_handler
+
+    def documents(self, source: str):
+        """
+        Yields (name, raw json bytes) for every document of the corpus.
+        """
+        if os.path.isdir(source):
+            return self.read_folder(source)
+        if source.endswith('.zip'):
+            return self.read_zip(source)
+        if source.endswith(('.jsonl', '.jsonl.gz', '.jsonl.zst')):
+            return self.read_jsonl(source)
+        if source.endswith(('.tar.zst', '.tzst')):
+            return self.read_tar(self.open_zstd(source))
+        if source.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')):
+            return self.read_tar(open(source, 'rb', buffering=READ_BUFFER_SIZE))
+
+        raise ValueError(f'{source} is not a folder or a supported corpus archive')
+
+    def read_folder(self, folder: str):
+        for filename in self.file_handler.walk_files(folder, '.json'):
+            with open(filename, 'rb') as f:
+                yield filename, f.read()
+
+    def read_zip(self, filename: str):
+        with open(filename, 'rb', buffering=READ_BUFFER_SIZE) as f, zipfile.ZipFile(f) as archive:
+            # Members are read in the order they are stored in the archive
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.endswith('.json'):
+                    yield info.filename, archive.read(info)
+
+    def read_tar(self, fileobj):
+        # 'r|*' reads the archive as a stream (no seeking) and detects the
+        # compression by itself.
+        with fileobj, tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith('.json'):
+                    yield member.name, archive.extractfile(member).read()
+
+    def read_jsonl(self, filename: str):
+        if filename.endswith('.gz'):
+            file = gzip.open(filename, 'rb')
+        elif filename.endswith('.zst'):
+            file = io.BufferedReader(self.open_zstd(filename), READ_BUFFER_SIZE)
+        else:
+            file = open(filename, 'rb', buffering=READ_BUFFER_SIZE)
+
+        with file:
+            for line_number, line in enumerate(file, 1):
+                if line.strip():
+                    yield f'{filename}:{line_number}', line
+
+    def open_zstd(self, filename: str):
+        """
+        Opens a zstandard compressed file as a stream.
+        """
+        # zstandard is only needed for .zst corpora
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError(
+                f'{filename} is compressed with zstandard. Install it with "pip install zstandard"')
+
+        file = open(filename, 'rb', buffering=READ_BUFFER_SIZE)
+        return zstandard.ZstdDecompressor().stream_reader(file, read_size=READ_BUFFER_SIZE, closefd=True)
@@ -0,0 +1,212 @@
+import hashlib
+import mmap
+import os
+import struct
+
+from posting_file import encode_varint, decode_varint, SCORE
+
+
+# Header: magic bytes, version, documents per block, number of documents,
+# byte offset of the block index, byte offset of the length norms and byte
+# offset of the url index.
+MAGIC = b'CSDT'
+VERSION = 2
+HEADER = struct.Struct('<4sBBIQQQ')
+
+# The block index is an array of the byte offsets of every block.
+BLOCK_OFFSET = struct.Struct('<Q')
+
+# An entry of the url index: the hash of a url and its doc id
+URL_ENTRY = struct.Struct('<QI')
+
+
+def url_hash(url: bytes) -> int:
+    """
+    Returns a 64 bit hash of a url (the same in every process, unlike
+    hash()).
+    """
+    return int.from_bytes(hashlib.blake2b(url, digest_size=8).digest(), 'little')
+
+
+class DocTableWriter:
+    """
+    Writes the document table: the url and the length norm of every
+    document, in doc id order. Doc ids start at 1.
+
+    The urls are front-coded in blocks of block_size like the lexicon (urls
+    of the same site share long prefixes). The first url of a block is
+    written in full and the others as the length of the prefix they share
+    with the previous url plus the rest of the url. The length norms (8 byte
+    floats) are written after the block index, one per document, so the norm
+    of a document is found without decoding anything.
+
+    The url index comes last: (8 byte hash of the url, 4 byte doc id) of
+    every document, sorted by hash, so the doc id of a url is found with a
+    binary search instead of decoding every url.
+    """
+
+    def __init__(self, filename: str, block_size=16):
+        self.block_size = block_size
+        self.file = open(filename, 'wb')
+        # The header is written again with the counts on close
+        self.file.write(HEADER.pack(MAGIC, VERSION, block_size, 0, 0, 0, 0))
+
+        self.block_offsets = []
+        self.norms = []
+        self.url_hashes = []
+        self.last_url = b''
+
+    def add(self, url: str, norm: float) -> None:
+        url = url.encode('utf-8')
+        buffer = bytearray()
+
+        if len(self.norms) % self.block_size == 0:
+            self.block_offsets.append(self.file.tell())
+            encode_varint(len(url), buffer)
+            buffer += url
+        else:
+            prefix = 0
+            limit = min(len(url), len(self.last_url))
+            while prefix < limit and url[prefix] == self.last_url[prefix]:
+                prefix += 1
+            encode_varint(prefix, buffer)
+            encode_varint(len(url) - prefix, buffer)
+            buffer += url[prefix:]
+
+        self.file.write(buffer)
+        self.norms.append(norm)
+        self.url_hashes.append(url_hash(url))
+        self.last_url = url
+
+    def close(self) -> None:
+        index_offset = self.file.tell()
+        for block_offset in self.block_offsets:
+            self.file.write(BLOCK_OFFSET.pack(block_offset))
+
+        norms_offset = self.file.tell()
+        for norm in self.norms:
+            self.file.write(SCORE.pack(norm))
+
+        urls_offset = self.file.tell()
+        for hash_value, doc_id in sorted(zip(self.url_hashes, range(1, len(self.url_hashes) + 1))):
+            self.file.write(URL_ENTRY.pack(hash_value, doc_id))
+
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.block_size, len(self.norms),
+                                    index_offset, norms_offset, urls_offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DocTable:
+    """
+    Looks documents up in a document table written by DocTableWriter through
+    mmap. The number of documents is read from the header, the norm of a
+    document is read straight from its position, and its url is decoded from
+    the start of its block (at most block_size urls).
+    """
+
+    def __init__(self, filename: str):
+        self.file = open(filename, 'rb')
+
+        if os.fstat(self.file.fileno()).st_size < HEADER.size:
+            self.file.close()
+            raise ValueError(f'{filename} is not a document table')
+
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.block_size, self.count, self.index_offset, self.norms_offset, self.urls_offset = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{filename} is not a document table')
+
+    def check(self, doc_id: int) -> None:
+        if not 1 <= doc_id <= self.count:
+            raise IndexError(f'doc id {doc_id} is not in the document table')
+
+    def url(self, doc_id: int) -> str:
+        """
+        Returns the url of a document.
+        """
+        self.check(doc_id)
+        data = self.data
+        block, position = divmod(doc_id - 1, self.block_size)
+        pos = BLOCK_OFFSET.unpack_from(data, self.index_offset + block * BLOCK_OFFSET.size)[0]
+
+        length, pos = decode_varint(data, pos)
+        url = data[pos:pos + length]
+        pos += length
+
+        for _ in range(position):
+            prefix, pos = decode_varint(data, pos)
+            length, pos = decode_varint(data, pos)
+            url = url[:prefix] + data[pos:pos + length]
+            pos += length
+
+        return str(url, 'utf-8')
+
+    def norm(self, doc_id: int) -> float:
+        """
+        Returns the length norm of a document (square root of the sum of its
+        lnc^2 scores, 0 if it has no words).
+        """
+        self.check(doc_id)
+        return SCORE.unpack_from(self.data, self.norms_offset + (doc_id - 1) * SCORE.size)[0]
+
+    def find(self, url: str) -> int or None:
+        """
+        Returns the doc id of a url, or None if it isn't in the table.
+        """
+        data = self.data
+        hash_value = url_hash(url.encode('utf-8'))
+
+        # The first entry with the hash or a larger one
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if URL_ENTRY.unpack_from(data, self.urls_offset + middle * URL_ENTRY.size)[0] < hash_value:
+                low = middle + 1
+            else:
+                high = middle
+
+        # Different urls can have the same hash, so the url is checked
+        while low < self.count:
+            entry_hash, doc_id = URL_ENTRY.unpack_from(data, self.urls_offset + low * URL_ENTRY.size)
+            if entry_hash != hash_value:
+                break
+            if self.url(doc_id) == url:
+                return doc_id
+            low += 1
+        return None
+
+    def urls(self):
+        """
+        Yields the url of every document in doc id order.
+        """
+        data = self.data
+        for block in range(0, self.count, self.block_size):
+            pos = BLOCK_OFFSET.unpack_from(data, self.index_offset + block // self.block_size * BLOCK_OFFSET.size)[0]
+            url = b''
+            for i in range(min(self.block_size, self.count - block)):
+                if i == 0:
+                    length, pos = decode_varint(data, pos)
+                    url = data[pos:pos + length]
+                else:
+                    prefix, pos = decode_varint(data, pos)
+                    length, pos = decode_varint(data, pos)
+                    url = url[:prefix] + data[pos:pos + length]
+                pos += length
+                yield str(url, 'utf-8')
+
+    def __len__(self):
+        return self.count
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
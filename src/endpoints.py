@@ -0,0 +1,135 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from metrics import METRICS, profile, summarize_trace
+
+
+class SearchEndpoint:
+    """
+    GET /search?q=<query>[&trace=1][&profile=1]
+
+    Returns the top 10 documents of the query:
+    {"query": ..., "results": [{"doc_id": ..., "url": ..., "score": ...}],
+     "time_ms": ...}
+
+    With trace=1, "trace" has the time of every stage of the query
+    ({stage: {"count": ..., "ms": ...}}). With profile=1, the query is run
+    under cProfile and "profile" has its slowest functions.
+    """
+
+    def get(self, server, params: dict) -> (int, dict):
+        query = params.get('q', [''])[0]
+        if not query.strip():
+            return 400, {'error': 'missing query parameter q'}
+        profiling = params.get('profile', ['0'])[0] == '1'
+
+        with METRICS.trace() as spans, profile(profiling) as profiled:
+            start_time = time.monotonic()
+            results = server.search_engine.find(query, server.request_timeout)
+            process_time = time.monotonic() - start_time
+
+        body = {
+            'query': query,
+            'results': [{'doc_id': doc_id, 'url': url, 'score': score}
+                        for doc_id, url, score in results],
+            'time_ms': process_time * 1000,
+        }
+        if params.get('trace', ['0'])[0] == '1':
+            body['trace'] = summarize_trace(spans)
+        if profiling:
+            body['profile'] = profiled['stats']
+        return 200, body
+
+
+class HealthEndpoint:
+    """
+    GET /health
+
+    Lets a load balancer check that the server is up and the index is
+    loaded.
+    """
+
+    def get(self, server, params: dict) -> (int, dict):
+        return 200, {'status': 'ok', 'documents': len(server.search_engine.query.segments)}
+
+
+class MetricsEndpoint:
+    """
+    GET /metrics[?format=json]
+
+    Returns the metrics of the server (counters, cache stats and the
+    histograms of every query stage) in the Prometheus text format, or as
+    json.
+    """
+
+    def get(self, server, params: dict) -> (int, dict or str):
+        search_engine = server.search_engine
+        for name, value in search_engine.posting_cache.stats().items():
+            METRICS.set_gauge('posting_cache.' + name, value)
+        for name, value in search_engine.result_cache.stats().items():
+            METRICS.set_gauge('result_cache.' + name, value)
+
+        if params.get('format', [''])[0] == 'json':
+            return 200, json.loads(METRICS.to_json())
+        return 200, METRICS.to_prometheus()
+
+
+# The endpoints of the API by path
+ENDPOINTS = {
+    '/search': SearchEndpoint(),
+    '/health': HealthEndpoint(),
+    '/metrics': MetricsEndpoint(),
+}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """
+    Handles one HTTP request of the API. Every response is JSON (except the
+    Prometheus metrics, which are plain text). A search that takes longer
+    than the request timeout of the server gets a 504.
+    """
+
+    # Socket timeout, so a client that stops sending can't hold a worker
+    timeout = 10
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        endpoint = ENDPOINTS.get(url.path)
+        if endpoint is None:
+            self.send_json(404, {'error': f'no endpoint {url.path}'})
+            return
+
+        try:
+            status, body = endpoint.get(self.server, parse_qs(url.query))
+        except TimeoutError:
+            status, body = 504, {'error': 'query timed out'}
+        except Exception as error:
+            self.log_error('%s failed: %r', self.path, error)
+            status, body = 500, {'error': 'internal error'}
+
+        if isinstance(body, str):
+            self.send_text(status, body)
+        else:
+            self.send_json(status, body)
+
+    def send_json(self, status: int, body: dict) -> None:
+        self.send_data(status, json.dumps(body).encode('utf-8'), 'application/json')
+
+    def send_text(self, status: int, body: str) -> None:
+        self.send_data(status, body.encode('utf-8'), 'text/plain; version=0.0.4')
+
+    def send_data(self, status: int, data: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Only errors are logged, not every request
+        pass
+
+    def log_error(self, format, *args):
+        super().log_message(format, *args)
@@ -1,7 +1,13 @@
 import os
+import shutil
 from bs4 import BeautifulSoup
+from lxml import etree
 
 import json
+import orjson
+
+from posting_file import PostingWriter
+from html_extractor import HTMLFieldExtractor
 
 
 class FileHandler:
@@ -9,10 +15,11 @@ class FileHandler:
         if not os.path.exists('./db'):
             os.mkdir('./db')
 
-        if not os.path.isfile('./db/fp_locations.json'):
-            open('./db/fp_locations.json', 'a').close()
         if not os.path.isfile('./index_status.log'):
             open('./index_status.log', 'w').close()
+
+        # Reads the text and weighted fields of a page in one pass
+        self.extractor = HTMLFieldExtractor()
  
     def walk_files(self, folder: str, file_extension=None) -> None:
         """
@@ -21,44 +28,85 @@ class FileHandler:
         Yields the path to a json file. 
         """
         for path, dirs, files in os.walk(folder, topdown=True):
-            for filename in files:
+            # Sorts the directories and files so that the corpus is always
+            # walked in the same order (and gets the same doc ids).
+            dirs.sort()
+            for filename in sorted(files):
                 if file_extension != None:
                     if filename.endswith(file_extension):
                         yield path + '/' + filename
                 else:
                     yield path + '/' + filename
 
-    def parse_file(self, filename: str) -> ({}, str, str, str, str):
+    def read_document(self, filename: str) -> (str, str):
         """
-        Truns json file into str text. 
-        Returns both regular text and important text.
+        Loads a json file of the corpus.
+        Returns the url and the html content.
         """
         # opens json file and uses orjson to load the file
-        with open(filename, 'r') as f:
-            file_info = json.load(f)
+        with open(filename, 'rb') as f:
+            return self.load_document(f.read())
+
+    def load_document(self, data: bytes) -> (str, str):
+        """
+        Loads the raw json of a document of the corpus.
+        Returns the url and the html content.
+        """
+        try:
+            file_info = orjson.loads(data)
+        # orjson is stricter than json (i.e. it refuses lone surrogates), so
+        # fall back to json for those few files.
+        except orjson.JSONDecodeError:
+            file_info = json.loads(data)
+
+        return (file_info['url'], file_info['content'])
 
-            # parses the content of the file useing BeautifulSoup
-            # uses lxml for better perfomance
-            content = file_info['content']
-            soup = BeautifulSoup(content, 'lxml')
+    def parse_content(self, content: str) -> (str, str, str, str):
+        """
+        Turns html content into str text.
+        Returns both regular text and important text.
+        """
+        try:
+            return self.extractor.extract(content)
+        # If lxml can't parse the page at all (i.e. it is empty), fall back to
+        # BeautifulSoup.
+        except etree.LxmlError:
+            return self.parse_content_soup(content)
 
-            text = soup.text
+    def parse_content_soup(self, content: str) -> (str, str, str, str):
+        """
+        Turns html content into str text with BeautifulSoup.
+        Returns both regular text and important text.
+        """
+        # parses the content of the file useing BeautifulSoup
+        # uses lxml for better perfomance
+        soup = BeautifulSoup(content, 'lxml')
 
-            # find all the important text from the specified tags
-            weighted1 = ''
-            weighted2 = ''
-            weighted3 = ''
+        text = soup.text
 
-            # weighted1 is bold/strong. weighted2 are headers. weighted3 is the
-            # title.
-            for s in soup.find_all(['b', 'strong']):
-                weighted1 += s.getText().strip() + ' '
-            for s in soup.find_all(['h1', 'h2', 'h3']):
-                weighted2 += s.getText().strip() + ' '
-            for s in soup.find_all(['title']):
-                weighted3 += s.getText().strip() + ' '
+        # find all the important text from the specified tags
+        weighted1 = ''
+        weighted2 = ''
+        weighted3 = ''
 
-        return (file_info['url'], text, weighted1, weighted2, weighted3)
+        # weighted1 is bold/strong. weighted2 are headers. weighted3 is the
+        # title.
+        for s in soup.find_all(['b', 'strong']):
+            weighted1 += s.getText().strip() + ' '
+        for s in soup.find_all(['h1', 'h2', 'h3']):
+            weighted2 += s.getText().strip() + ' '
+        for s in soup.find_all(['title']):
+            weighted3 += s.getText().strip() + ' '
+
+        return (text, weighted1, weighted2, weighted3)
+
+    def parse_file(self, filename: str) -> (str, str, str, str, str):
+        """
+        Truns json file into str text. 
+        Returns the url, regular text and important text.
+        """
+        url, content = self.read_document(filename)
+        return (url, *self.parse_content(content))
 
     # def write_doc_id(self, doc_id_dict):
     #     """
@@ -67,10 +115,13 @@ class FileHandler:
     #     with open('./db/doc_id.json', 'wb') as f:
     #         json.dump(doc_id_dict, f)
 
-    def write_to_file(self, index_id: int, index_dict: dict) -> None:
-        with open(f'./db/pi{index_id}.txt', 'w') as file:
-            for line in sorted(index_dict.items()):
-                file.write(str(line) + '\n')
+    def write_to_file(self, index_id, index_dict) -> None:
+        """
+        Writes a PostingAccumulator to the partial index pi{index_id}.
+        """
+        with PostingWriter(f'./db/pi{index_id}.bin', has_positions=index_dict.has_positions) as file:
+            for word, doc_ids, frequencies, importances, positions in index_dict.items():
+                file.write_columns(word, doc_ids, frequencies, importances, positions)
 
     def clear_files(self) -> None:
         # print("CLEARING INDEX FILES")
@@ -93,37 +144,48 @@ class FileHandler:
             elif status == 'False':
                 return False
 
-    def remove_merge_temp_files(self, current_temp):
-        if current_temp == 0:
-            os.remove('./db/temp1.txt')
-            os.rename('./db/temp0.txt', './db/index.txt')
-        else:
-            os.remove('./db/temp0.txt')
-            os.rename('./db/temp1.txt', './db/result.txt')
-
-    def clear_merge_temp_files(self):
-        with open('./db/temp0.txt', 'r+') as temp0, open('./db/temp1.txt', 'r+') as temp1:
-            temp0.truncate(0)
-            temp1.truncate(0)
-
-    def remove_partial_indexes(self):
-        for file in self.walk_files('./db', '.txt'):
-            if 'pi' in file:
-                os.remove(file)
-
-    def remove_tf_idf_indexes(self):
-        for file in self.walk_files('./db', '.txt'):
-            if 'tf_idf' in file:
-                os.remove(file)
+    def get_last_run(self):
+        """
+        Returns the last_run timestamp of the index. It changes every time
+        the index is built.
+        """
+        with open('index_status.log', 'r') as log:
+            log.readline()
+            return log.readline()[9:].strip('\n')
 
-    def count_number_of_line(self, filename):
-        count = 0
+    def partial_indexes(self, first_id=0, last_id=None) -> [str]:
+        """
+        Returns the paths of the partial indexes in ./db (pi{index_id}.bin or
+        pi{index_id}_{n}.bin) with an index_id from first_id to last_id.
+        """
+        found = []
+        for name in sorted(os.listdir('./db')):
+            if name.startswith('pi') and name.endswith('.bin'):
+                index_id = int(name[2:-4].split('_')[0])
+                if index_id >= first_id and (last_id is None or index_id <= last_id):
+                    found.append('./db/' + name)
+        return found
+
+    def remove_partial_indexes(self, first_id=0):
+        """
+        Removes the partial indexes, or only the ones from first_id on.
+        """
+        for file in self.partial_indexes(first_id):
+            os.remove(file)
 
-        with open(filename, 'r') as file:
-            for line in file:
-                count += 1
+    def remove_segments(self):
+        """
+        Removes every segment folder and the segment manifest.
+        """
+        for name in os.listdir('./db'):
+            if name.startswith('seg_') and os.path.isdir('./db/' + name):
+                shutil.rmtree('./db/' + name)
+        if os.path.isfile('./db/segments.json'):
+            os.remove('./db/segments.json')
 
-        return count
+    def remove_merged_index(self, filename):
+        if os.path.isfile(filename):
+            os.remove(filename)
 
     def dump_json(self, dict, filename):
         """
@@ -137,5 +199,5 @@ class FileHandler:
             json.dump(dict, filename)
 
     def load_json(self, filename):
-        with open(filename, 'r') as f:
-            return json.load(f)
+        with open(filename, 'rb') as f:
+            return orjson.loads(f.read())
@@ -0,0 +1,87 @@
+from lxml import etree
+
+
+# The tags of each weighted field. Field 0 is bold/strong text, field 1 are
+# headers and field 2 is the title.
+FIELD_TAGS = {
+    'b': 0,
+    'strong': 0,
+    'h1': 1,
+    'h2': 1,
+    'h3': 1,
+    'title': 2,
+}
+
+# BeautifulSoup leaves the text of these tags (code, not words of the page)
+# out of soup.text and getText(), so it isn't indexed here either.
+SKIPPED_TAGS = {'script', 'style', 'template'}
+
+
+class HTMLFieldExtractor:
+    """
+    Gets the text of a page and its weighted fields in one pass over the
+    html, without building a tree. It is used as the target of an lxml html
+    parser: lxml calls start, end and data as it reads the page.
+
+    The result has the same words as BeautifulSoup's soup.text and the
+    find_all loops in FileHandler.parse_content_soup: each element of a
+    weighted field adds its text followed by a space. The text inside
+    script, style and template tags is skipped, like BeautifulSoup does.
+    """
+
+    def __init__(self):
+        self.parser = etree.HTMLParser(target=self)
+        self.reset()
+
+    def reset(self) -> None:
+        # Every piece of text of the page
+        self.text = []
+        # The text of each weighted field
+        self.fields = ([], [], [])
+        # The elements of each weighted field that are currently open. Each
+        # one collects its own text, like getText() on a find_all result.
+        self.open_elements = ([], [], [])
+        # How many script/style/template tags are currently open
+        self.skipped_depth = 0
+
+    def start(self, tag, attrib) -> None:
+        if tag in SKIPPED_TAGS:
+            self.skipped_depth += 1
+        field = FIELD_TAGS.get(tag)
+        if field is not None:
+            self.open_elements[field].append([])
+
+    def end(self, tag) -> None:
+        if tag in SKIPPED_TAGS and self.skipped_depth > 0:
+            self.skipped_depth -= 1
+        field = FIELD_TAGS.get(tag)
+        if field is not None and self.open_elements[field]:
+            element_text = ''.join(self.open_elements[field].pop())
+            self.fields[field].append(element_text.strip() + ' ')
+
+    def data(self, data) -> None:
+        if self.skipped_depth > 0:
+            return
+        self.text.append(data)
+        for open_elements in self.open_elements:
+            for element in open_elements:
+                element.append(data)
+
+    def close(self) -> (str, str, str, str):
+        return (''.join(self.text), ''.join(self.fields[0]),
+                ''.join(self.fields[1]), ''.join(self.fields[2]))
+
+    def extract(self, content: str) -> (str, str, str, str):
+        """
+        Returns the text, bold/strong text, header text and title text of the
+        html content. Raises an lxml error if the content can't be parsed.
+        """
+        self.reset()
+        try:
+            self.parser.feed(content)
+            return self.parser.close()
+        except etree.LxmlError:
+            # The parser may be left in a bad state, so use a new one for the
+            # next page.
+            self.parser = etree.HTMLParser(target=self)
+            raise
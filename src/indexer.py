@@ -1,33 +1,71 @@
 import ssl
 import os
 import math
+import heapq
+import bisect
+import itertools
+import multiprocessing
+from array import array
+from collections import deque
 from pprint import pprint
-from datetime import datetime
 from file_handler import FileHandler
+from posting_file import PostingReader, PostingWriter
+from doc_table import DocTableWriter
+from lexicon import LexiconWriter
+from posting_accumulator import PostingAccumulator
+from positions import PositionWriter, encode_positions
+from near_duplicates import NearDuplicateDetector, simhash, write_fingerprints
+from tokenizer import Tokenizer
+from corpus_reader import CorpusReader
+from metrics import METRICS
 
 import nltk
 from nltk.corpus.reader import wordlist
-from nltk.tokenize import RegexpTokenizer
-from nltk.stem import SnowballStemmer
 
 from urllib.parse import urldefrag
 
 class Indexer:
-    def __init__(self, file_handler, file_count_offset):
+    def __init__(self, file_handler, memory_budget=256 * 1024 * 1024, workers=1,
+                 tier_size=1000, positions=False, near_duplicates=True):
         # Downloads the nltk library before indexing.
         self.download_nltk_library()
-        # This is a dict where the key is the doc id and its value is the URL
-        self.doc_id_dict = dict()
+        # The tokenizer is made once and reused for every document and query.
+        self.tokenizer = Tokenizer()
+        # This is the list of URLs in doc id order (the URL of doc id n is
+        # urls[n - 1]). It is written to the document table with the length
+        # of every document once the index is finalized.
+        self.urls = []
+        # The SimHash fingerprint of every document of urls (0 if it has no
+        # words or near_duplicates isn't set)
+        self.fingerprints = array('Q')
         # The doc id is defaulted to 1
         self.doc_id = 1
         # The file handler is an object from file_handler.py that handles all
         # the files.
         self.file_handler = file_handler
 
-        # file_count_offset is the number of documents to parse before
-        # offloading to a partial index. This number should be defaulted to
-        # 10,000 in search_engine.py
-        self.file_count_offset = file_count_offset
+        # memory_budget is the number of bytes the in-memory partial index
+        # may use before it is offloaded to a partial index file. With
+        # workers, the budget is shared between the worker processes.
+        self.memory_budget = memory_budget
+
+        # workers is the number of processes that parse and tokenize the
+        # documents. With 1 worker, everything is done in this process.
+        self.workers = workers
+
+        # tier_size is the number of postings in the high-impact tier of
+        # words that are in more documents than that.
+        self.tier_size = tier_size
+
+        # If positions is set, the position of every word in the text of
+        # each document is recorded too, for phrase and proximity queries.
+        # They end up in their own file of the segment (positions.bin).
+        self.positions = positions
+
+        # If near_duplicates is set, every document gets a fingerprint of its
+        # text, so that mirrored or almost identical pages can be dropped
+        # (see find_duplicates).
+        self.near_duplicates = near_duplicates
 
     def set_up_ssl(self) -> None:
         """
@@ -61,22 +99,16 @@ class Indexer:
         """
         Takes a string of text and tokenizes it using NLTK library.
         """
-        # Regex tokenizer. Checks for alphanumeric characters.
-        re_tokenizer = RegexpTokenizer('[a-zA-Z0-9]+')
-        re_tokens = re_tokenizer.tokenize(text.lower())
-
         # returns a stemmed list of tokens
-        stemmer = SnowballStemmer(language='english')
-        tokens = [stemmer.stem(token) for token in re_tokens]
-        return tokens
+        return self.tokenizer.tokenize(text)
 
     def add_doc_id(self, url: str):
         """
-        Appends a new url to the doc_id_list and increments the doc_id
-        If the list len is larger than ...., then call write_doc_id function
+        Appends a new url to the url list and increments the doc_id
         """
-        self.doc_id_dict[str(self.doc_id)] = url 
+        self.urls.append(url)
         self.doc_id += 1
+        METRICS.count('build.documents')
 
     def compute_word_frequencies(self, token_list: [str]) -> {str: int}:
         """
@@ -94,11 +126,80 @@ class Indexer:
 
         return frequencies
 
-    def index(self, folder_name: str, restart=False) -> None:
+    def add_document(self, index_dict: PostingAccumulator, doc_id: int, normalText: str,
+                     important1: str, important2: str, important3: str) -> int:
+        """
+        Tokenizes one document and adds the frequency and importance score of
+        each of its words to the partial index index_dict. Returns the
+        fingerprint of the document (0 if near_duplicates isn't set).
+        """
+        with METRICS.span('build.tokenize'):
+            # The contents of the document are tokenized into normalText
+            normalText = self.tokenize(normalText)
+            # The text considered important are tokenized and put into a
+            # set. (We don't count the frequency of important text since we
+            # already got the frequencies in normalText).
+            important1 = set(self.tokenize(important1))
+            important2 = set(self.tokenize(important2))
+            important3 = set(self.tokenize(important3))
+
+        # Find frequencies of each word and put it in a dict
+        frequencies = self.compute_word_frequencies(normalText)
+
+        # The positions of each word in the text (the number of the token)
+        positions = None
+        if self.positions:
+            positions = dict()
+            for position, token in enumerate(normalText):
+                if token in positions:
+                    positions[token].append(position)
+                else:
+                    positions[token] = [position]
+
+        # Loop through each word in the dict
+        for word, frequency in frequencies.items():
+
+            # Calculates the importance score. If the word appears in
+            # bold or strong text, add 1 to the importance. If the word
+            # is a header, add 2 and if the word is a title, add 3. The
+            # max importance score for a word is 6 (if it is all 3).
+            importance = 0
+            if word in important1:
+                importance += 1
+            if word in important2:
+                importance += 2
+            if word in important3:
+                importance += 3
+
+            # The frequency and importance score of the word (and its
+            # positions) are added to the postings of the word in the
+            # partial index.
+            # i.e. apple (word): 123 (doc_id), 2 (frequency), 1 (importance)
+            if positions is not None:
+                index_dict.add(word, doc_id, frequency, importance, encode_positions(positions[word]))
+            else:
+                index_dict.add(word, doc_id, frequency, importance)
+
+        if not self.near_duplicates:
+            return 0
+        with METRICS.span('build.fingerprint'):
+            return simhash(normalText)
+
+    def index(self, source: str, restart=False, checkpoint=None) -> None:
         """
         This is the main function that indexes the corpus. It writes every
         word, frequency per document, and importance score to multiple partial
         indexes.
+
+        source is the folder of the corpus or an archive of it (see
+        CorpusReader for the supported formats).
+
+        If a checkpoint (BuildCheckpoint) is given, the indexing starts where
+        it was at the checkpoint, and a new checkpoint is saved after every
+        partial index.
+
+        If the indexer was made with more than one worker, parsing and
+        tokenizing is done by a pool of processes (see index_parallel).
         """
         # Clears all relevant files if the restart boolean is set to true. Will
         # not happen if the corpus already exists unless the user manually
@@ -106,375 +207,642 @@ class Indexer:
         if restart:
             self.file_handler.clear_files()
 
+        if self.workers > 1:
+            self.index_parallel(source, checkpoint)
+            return
+
         # index_id is the id of the partial index. It goes up after every
         # offload.
-        index_id = 0
+        # consumed is the number of documents read from the corpus so far.
+        # This is the set of websites (defragged) travelled.
+        index_id, consumed, traversed = self.resume(checkpoint)
 
-        # This is the dict that stores the partial index. It is dumped and
-        # cleared each offload
-        index_dict = dict()
+        # This is the accumulator that stores the partial index. It is dumped
+        # and cleared each offload
+        index_dict = PostingAccumulator(self.positions)
 
-        # This is the set of websites (defragged) travelled.
-        traversed = set()
+        # Loops through each json document in the corpus (after the ones
+        # that are already done)
+        documents = CorpusReader(self.file_handler).documents(source)
+        for _, data in itertools.islice(documents, consumed, None):
+            consumed += 1
 
-        # Loops through each file that ends in '.json' in the corpus
-        for file in self.file_handler.walk_files(folder_name, '.json'):
-            # Gets the url, contents, and 3 tiers of important words from the
-            # file. important1 is bold/strong text, important2 are headers, and
-            # important3 is the title text.
-            url, normalText, important1, important2, important3 = self.file_handler.parse_file(file)
+            # Gets the url and the html content of the document.
+            url, content = self.file_handler.load_document(data)
 
             # Removes the fragments from the url.
             url = urldefrag(url)[0]
 
             # If the defragged url already exists in the traversed set, it is
-            # removed.
-            if url not in traversed:
-                # The contents of the document are tokenized into normalText
-                normalText = self.tokenize(normalText)
-                # The text considered important are tokenized and put into a
-                # set. (We don't count the frequency of important text since we
-                # already got the frequencies in normalText).
-                important1 = set(self.tokenize(important1))
-                important2 = set(self.tokenize(important2))
-                important3 = set(self.tokenize(important3))
-
-                # Find frequencies of each word and put it in a dict
-                frequencies = self.compute_word_frequencies(normalText)
-
-                # Loop through each word in the dict
-                for word, frequency in frequencies.items():
-
-                    # Calculates the importance score. If the word appears in
-                    # bold or strong text, add 1 to the importance. If the word
-                    # is a header, add 2 and if the word is a title, add 3. The
-                    # max importance score for a word is 6 (if it is all 3).
-                    importance = 0
-                    if word in important1:
-                        importance += 1
-                    if word in important2:
-                        importance += 2
-                    if word in important3:
-                        importance += 3
-
-                    # If the word is not in the partial index, add it. The word
-                    # is the key and its value is an empty dict.
-                    if word not in index_dict:
-                        index_dict[word] = dict()
-                    # The frequency and importance score of the word is added
-                    # to the dict within the partial index.
-                    # i.e. {apple (word): {123 (doc_id): 2 (frequency), 1 (importance}}
-                    index_dict[word][self.doc_id] = (frequency, importance)
-
-                # Keep record of doc id and url
-                self.add_doc_id(url)
+            # skipped.
+            if url in traversed:
+                continue
 
-                # Add url to the traversed set
-                traversed.add(url)
+            # Gets the contents, and 3 tiers of important words from the
+            # file. important1 is bold/strong text, important2 are headers, and
+            # important3 is the title text.
+            with METRICS.span('build.parse'):
+                normalText, important1, important2, important3 = self.file_handler.parse_content(content)
+            fingerprint = self.add_document(index_dict, self.doc_id, normalText,
+                                            important1, important2, important3)
+
+            # Keep record of doc id, url and fingerprint
+            self.add_doc_id(url)
+            self.fingerprints.append(fingerprint)
+
+            # Add url to the traversed set
+            traversed.add(url)
 
             # Print a message every 100 documents traversed (just a message for
             # the user to keep track).
             if self.doc_id % 100 == 0:
                 print(f'Looped through {self.doc_id} pages!')
 
-            # If enough pages have been traversed to reach the offset count
-            # (default 10,000), write the partial index to a txt file and clear
-            # it from memory.
-            if self.doc_id % self.file_count_offset == 0:
+            # If the partial index has reached the memory budget, write the
+            # partial index to a binary file and clear it from memory.
+            if index_dict.nbytes >= self.memory_budget:
                 print(
                     f'Looped through {self.doc_id} pages. Offloading to pi{index_id}')
-                self.file_handler.write_to_file(index_id, index_dict)
-                index_dict.clear()
+                self.spill(index_id, index_dict)
                 # Increments index_id to signify that the new dict will be part
                 # of the next partial index.
                 index_id += 1
+                if checkpoint is not None:
+                    checkpoint.index_done(consumed, len(self.urls), index_id, self.urls, self.fingerprints,
+                                          self.file_handler.partial_indexes(index_id - 1, index_id - 1))
                 print('Done with offloading, continuing.')
 
         # Final offload
         print(f'Looped through every page. Offloading to pi{index_id}')
-        self.file_handler.write_to_file(index_id, index_dict)
-        index_dict.clear()
+        self.spill(index_id, index_dict)
+        if checkpoint is not None:
+            checkpoint.index_done(consumed, len(self.urls), index_id + 1, self.urls, self.fingerprints,
+                                  self.file_handler.partial_indexes(index_id, index_id))
 
-        # Writes the doc_id list to a json file.
-        self.file_handler.dump_json(self.doc_id_dict, './db/doc_id.json')
-        self.doc_id_dict.clear()
+    def resume(self, checkpoint) -> (int, int, set):
+        """
+        Gets the indexer back to where it was at the checkpoint: the doc id,
+        the urls, their fingerprints and the partial indexes. Partial indexes
+        the checkpoint doesn't count (they may be incomplete) are removed.
 
-    def merge_indexes(self, folder_path: str) -> None:
+        Returns the next index_id, the number of documents consumed and the
+        set of urls traversed.
         """
-        Merges all partial indexes into one giant index. If the indexes contain
-        the same words, merge their results together.
+        if checkpoint is None:
+            return 0, 0, set()
+
+        self.doc_id = checkpoint.state['doc_id']
+        self.urls = checkpoint.read_urls()
+        self.fingerprints = checkpoint.read_fingerprints()
+        index_id = checkpoint.state['index_id']
+        self.file_handler.remove_partial_indexes(index_id)
+
+        return index_id, checkpoint.state['consumed'], set(self.urls)
+
+    def index_parallel(self, source: str, checkpoint=None) -> None:
         """
-        files_to_be_merged = []
+        Indexes the corpus with a pool of worker processes.
 
-        # For every partial index files in the folder,
-        # add to the list to be merged.
-        for file in self.file_handler.walk_files(folder_path, '.txt'):
-            if 'pi' in file:
-                files_to_be_merged.append(file)
-        
-        files_to_be_merged.sort(reverse=True)
-        current_temp = 0
+        The main process walks the corpus in a fixed order, drops duplicate
+        urls and hands out doc ids, so the doc ids and the traversed set are
+        the same as in a serial run. Batches of documents are then sent to a
+        worker, which parses and tokenizes the documents and writes the batch
+        to its own partial indexes, offloading whenever it reaches its share
+        of the memory budget.
 
-        # Create two temp files
-        try:
-            open('./db/temp0.txt', 'x')
-            open('./db/temp1.txt', 'x')
-        # If files already exist, clear the files
-        except FileExistsError:
-            self.file_handler.clear_merge_temp_files()
-
-        while files_to_be_merged:
-            print(f"{len(files_to_be_merged)} more files to merge!")
-
-            file = files_to_be_merged.pop()
-
-            # input_temp and output_temp will alternate between temp0 and temp.
-            if current_temp == 0:
-                file = open(file, 'r')
-                input_temp = open('./db/temp0.txt', 'r')
-                output_temp = open('./db/temp1.txt', 'w')
-
-            elif current_temp == 1:
-                file = open(file, 'r')
-                input_temp = open('./db/temp1.txt', 'r')
-                output_temp = open('./db/temp0.txt', 'w')
-
-            # Get each line
-            line1 = file.readline().strip('\n')
-            line2 = input_temp.readline().strip('\n')
-
-            while True:
-
-                # If the first file is empty, add the content of the
-                # second file to the output_temp
-                if line1 == '':
-                    while True:
-                        if line2 == '':
-                            break
-                        output_temp.write(line2 + '\n')
-                        line2 = input_temp.readline().strip('\n')
-                    break
+        The html of the batches is sent to the workers so that the corpus is
+        only read once, even from an archive.
 
-                # If the second file is empty, add the content of the
-                # first file to the output_temp
-                if line2 == '':
-                    while True:
-                        if line1 == '':
-                            break
-                        output_temp.write(line1 + '\n')
-                        line1 = file.readline().strip('\n')
-                    break
+        Batches are checkpointed in the order they were sent: a checkpoint
+        after a batch means every batch before it is done too.
+        """
+        # Every worker gets an equal share of the memory budget. A batch is
+        # sent once its documents add up to that much html, which usually
+        # makes a partial index of about the same size or smaller.
+        worker_budget = self.memory_budget // self.workers
+
+        # index_id is the id of the batch. Its partial indexes are named
+        # pi{index_id}_{n}.
+        # consumed is the number of documents read from the corpus so far.
+        # This is the set of websites (defragged) travelled.
+        index_id, consumed, traversed = self.resume(checkpoint)
+
+        # The batch of (doc_id, html content) that is being filled and the
+        # size of its html
+        batch = []
+        batch_size = 0
+
+        # Batches that were sent to the pool but are not done yet, as
+        # (result, index_id, documents consumed, number of urls). Only one
+        # batch more than there are workers is let in flight, so the html
+        # waiting for a worker stays around the memory budget.
+        pending = deque()
+
+        def wait_oldest():
+            # get() also raises any error from the worker. It returns the
+            # fingerprints of the documents of the batch (which come right
+            # after the ones of the batches before) and its metrics.
+            result, done_id, done_consumed, done_urls = pending.popleft()
+            fingerprints, metrics = result.get()
+            self.fingerprints.extend(fingerprints)
+            METRICS.merge(metrics)
+            if checkpoint is not None:
+                checkpoint.index_done(done_consumed, done_urls, done_id + 1, self.urls, self.fingerprints,
+                                      self.file_handler.partial_indexes(done_id, done_id))
+
+        with multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                  initargs=(worker_budget, self.positions, self.near_duplicates)) as pool:
+            documents = CorpusReader(self.file_handler).documents(source)
+            for _, data in itertools.islice(documents, consumed, None):
+                consumed += 1
+
+                # Only the url is needed here. The worker parses the content.
+                url, content = self.file_handler.load_document(data)
+                url = urldefrag(url)[0]
+
+                if url in traversed:
+                    continue
+
+                batch.append((self.doc_id, content))
+                batch_size += len(content)
+                self.add_doc_id(url)
+                traversed.add(url)
+
+                if batch_size >= worker_budget:
+                    print(f'Looped through {self.doc_id - 1} pages. Sending pi{index_id} to a worker')
+                    pending.append((pool.apply_async(_index_batch, (index_id, batch)),
+                                    index_id, consumed, len(self.urls)))
+                    batch = []
+                    batch_size = 0
+                    index_id += 1
+
+                    # Wait for the oldest batch if too many are in flight.
+                    if len(pending) > self.workers:
+                        wait_oldest()
+
+            # Final batch
+            print(f'Looped through every page. Sending pi{index_id} to a worker')
+            pending.append((pool.apply_async(_index_batch, (index_id, batch)),
+                            index_id, consumed, len(self.urls)))
 
-                # If the files are not empty, get the first word
-                # in each files to be merged
-                word1 = eval(line1)[0]
-                word2 = eval(line2)[0]
-
-                # Check for lexicographical order and add
-                # the words that comes first to the output_temp
-                while word1 > word2:
-                    output_temp.write(line2 + '\n')
-                    line2 = input_temp.readline().strip('\n')
-                    if line2 == '':
-                        break
-                    word2 = eval(line2)[0]
-
-                while word2 > word1:
-                    output_temp.write(line1 + '\n')
-                    line1 = file.readline().strip('\n')
-                    if line1 == '':
-                        break
-                    word1 = eval(line1)[0]
-
-                # If the words are exactly the same, add the indexes of
-                # both words and combine. Then add to the output_temp
-                if word1 == word2:
-                    temp_dict = self.merge_posting(eval(line1)[1], eval(line2)[1])
-                    output_temp.write(
-                        str((word1, temp_dict)) + '\n')
-                    line1 = file.readline().strip('\n')
-                    line2 = input_temp.readline().strip('\n')
-
-            file.close()
-            input_temp.close()
-            output_temp.close()
-
-            # Alternate between the temp files
-            if current_temp == 0:
-                current_temp = 1
+            while pending:
+                wait_oldest()
+
+        print('Done with every partial index.')
+
+    def index_batch(self, index_id: int, batch: [(int, str)]) -> array:
+        """
+        Parses and tokenizes a batch of (doc_id, html content) and writes it to
+        the partial indexes pi{index_id}_{n}. This runs inside a worker
+        process. Returns the fingerprints of the documents of the batch.
+        """
+        index_dict = PostingAccumulator(self.positions)
+        offload = 0
+        fingerprints = array('Q')
+
+        for doc_id, content in batch:
+            with METRICS.span('build.parse'):
+                normalText, important1, important2, important3 = self.file_handler.parse_content(content)
+            fingerprints.append(self.add_document(index_dict, doc_id, normalText,
+                                                  important1, important2, important3))
+
+            if index_dict.nbytes >= self.memory_budget:
+                self.spill(f'{index_id}_{offload}', index_dict)
+                offload += 1
+
+        self.spill(f'{index_id}_{offload}', index_dict)
+        return fingerprints
+
+    def find_duplicates(self, previous=None, skip=None) -> {int: int}:
+        """
+        Finds the near-duplicates among the documents indexed in this run
+        (the ones of urls), in doc id order: a document whose fingerprint
+        is within 3 bits of a document before it is a near-duplicate of that
+        document, and only the first document of each group is kept.
+
+        previous is a NearDuplicateDetector of the documents of the index
+        from before this run (it isn't changed), so new documents can also
+        be near-duplicates of them. The doc ids skip returns True for are
+        left out of it.
+
+        Return Value:
+        {doc id of a near-duplicate: doc id of the document it duplicates}
+        """
+        detector = NearDuplicateDetector()
+
+        duplicates = dict()
+        first_doc_id = self.doc_id - len(self.urls)
+        for doc_id, fingerprint in enumerate(self.fingerprints, start=first_doc_id):
+            # Documents without words have no fingerprint
+            if not fingerprint:
+                continue
+
+            # The documents from before this run have smaller doc ids
+            original = None
+            if previous is not None:
+                original = previous.find(fingerprint, skip)
+            if original is None:
+                original = detector.find(fingerprint)
+
+            if original is None:
+                detector.add(fingerprint, doc_id)
             else:
-                current_temp = 0
+                duplicates[doc_id] = original
 
-        # Last merged file will be the final index
-        # and remove the temp files
-        self.file_handler.remove_merge_temp_files(current_temp)
-        self.file_handler.remove_partial_indexes()
-        print("Index merge complete.")
+        return duplicates
 
+    def spill(self, index_id, index_dict: PostingAccumulator) -> None:
+        """
+        Writes the partial index in memory to the file pi{index_id} and
+        clears it.
+        """
+        with METRICS.span('build.spill'):
+            self.file_handler.write_to_file(index_id, index_dict)
+        METRICS.count('build.spills')
+        index_dict.clear()
 
-    def calculate_tf_idf(self, file, outputfile, size):
+    def merge_indexes(self, folder_path: str, outputfile: str, duplicates=()) -> dict:
         """
-        Calculates tf-idf lnc score. Stores the result
-        in the outputfile.
+        Merges all partial indexes into one giant index. If the indexes contain
+        the same words, merge their results together. The postings of the
+        documents in duplicates (near-duplicates, see find_duplicates) are
+        dropped.
 
-        Gets 1 + ln(term frequency)
-        Does not calculate idf (that is done with queries using ltc)
+        Every partial index is read at the same time and a heap keeps the
+        smallest word of each of them on top, so the merged index is written
+        once in a single pass (k-way merge).
+
+        While merging, the length of every document (square root of the sum
+        of its lnc^2 scores) is computed so finalize_index can normalize the
+        scores without another pass over the index.
 
         Input Parameter:
-        file -> the inverted index file
-        outputfile -> the file to store the tf_idf values
-        size -> the number of files in corpus
+        folder_path -> the folder with the partial indexes
+        outputfile -> the file to store the merged index
+        duplicates -> the doc ids of the documents to leave out
 
         Return Value:
-        A normalized dictionary contains doc_id and
-        its lenght (square root of all td-idf^2 scores)
+        A dictionary of doc_id and its length
         """
+        files_to_be_merged = []
 
-        inverted_index = open(file, 'r')
-        tf_idf_index = open(outputfile, 'w')
+        # For every partial index files in the folder,
+        # add to the list to be merged.
+        for file in self.file_handler.walk_files(folder_path, '.bin'):
+            if 'pi' in file:
+                files_to_be_merged.append(file)
 
+        files_to_be_merged.sort()
+        print(f"Merging {len(files_to_be_merged)} partial indexes!")
+
+        readers = [PostingReader(file) for file in files_to_be_merged]
+        records = [iter(reader) for reader in readers]
+
+        # The heap holds the next record of every partial index as
+        # (word, partial index number, posting). The partial index number
+        # breaks ties between equal words so postings are never compared.
+        heap = []
+        for i, partial_index in enumerate(records):
+            record = next(partial_index, None)
+            if record is not None:
+                heap.append((record[0], i, record[1]))
+        heapq.heapify(heap)
+
+        # The positions are kept if the partial indexes have them
+        merged_index = PostingWriter(outputfile,
+                                     has_positions=any(reader.has_positions for reader in readers))
         normalizers = dict()
-        temp_dict = dict()
         count = 1
 
-        for line in inverted_index:
-            # gets the tuple item from inverted index file
-            tup = eval(line.strip('\n'))
+        while heap:
+            word = heap[0][0]
+            postings = []
+
+            # Pop the word from every partial index that has it, and replace
+            # it with the next record of that partial index.
+            while heap and heap[0][0] == word:
+                _, i, posting = heap[0]
+                postings.append(posting)
 
-            for doc_id, tf_value in tup[1].items():
+                record = next(records[i], None)
+                if record is None:
+                    heapq.heappop(heap)
+                else:
+                    heapq.heapreplace(heap, (record[0], i, record[1]))
+
+            # If the words are exactly the same, add the indexes of
+            # all the words and combine. Then add to the merged index
+            posting = self.merge_posting(*postings)
+            if duplicates:
+                posting = {doc_id: value for doc_id, value in posting.items()
+                           if doc_id not in duplicates}
+                # A word that is only in near-duplicates is dropped
+                if not posting:
+                    continue
+            merged_index.write(word, posting)
+
+            # Adds the lnc^2 score of the word to the length of each document
+            for doc_id, tf_value in posting.items():
                 lnc_value = 1 + math.log(tf_value[0])
-                temp_dict[doc_id] = (lnc_value, tf_value[1])
 
                 if doc_id not in normalizers:
                     normalizers[doc_id] = lnc_value * lnc_value
                 else:
                     normalizers[doc_id] += (lnc_value * lnc_value)
 
-            # writes the lnc value to the output file and
-            # clears temp_dict for the next loop (next line)
-            tf_idf_index.write(str((tup[0], temp_dict)) + '\n')
-            temp_dict.clear()
-
             # keeps track of the current status while running this function
             count += 1
-            if count % 1000 == 0:
-                print(f'{count} words calculated!')
+            if count % 10000 == 0:
+                print(f'{count} words merged!')
+
+        merged_index.close()
+        for reader in readers:
+            reader.close()
 
-        inverted_index.close()
-        tf_idf_index.close()
+        # The partial indexes are removed by the caller once the merge is
+        # checkpointed
+        print("Index merge complete.")
 
         # square roots all of the values of normalizers
         for doc_id in normalizers.keys():
             normalizers[doc_id] = math.sqrt(normalizers[doc_id])
 
-        # returns the normalizers dict (we need this for the normalize function!)
+        # returns the normalizers dict (we need this for finalize_index!)
         return normalizers
-    
-    def normalize_tf_idf(self, file, outputfile, normalizer):
+
+    def finalize_index(self, file, outputfile, tier_file, lexicon_file, doc_table_file,
+                       normalizer, positions_file=None):
         """
-        Normalizes tf_idf value by dividing the old tf_idf value with its lenght
-        (square root of all td-idf^2 scores) from calculate_tf_idf function.
+        Turns the merged index into the final index in one pass. For each
+        word it calculates the tf-idf lnc score (1 + ln(term frequency)),
+        normalizes it by the document length from merge_indexes, writes it to
+        the final index and adds the file pointer location of the word to the
+        lexicon. The lexicon is written as the words go by (they are already
+        sorted), so it is never held in memory. At the end, the url and the
+        length of every document are written to the document table.
+
+        Words in more than tier_size documents also get a high-impact tier
+        (champion list) in tier_file: the tier_size postings with the highest
+        score plus importance. Queries look at the tiers first.
+
+        If the merged index has positions, they are written to
+        positions_file (see PositionWriter) and their offset is added to the
+        lexicon.
+
+        Does not calculate idf (that is done with queries using ltc)
 
         Input Parameter:
-        file -> the outputfile from the calculate_tf_idf function
-        outputfile -> the file to store the result of the normalized tf_idf value
-        normalizer -> the returned dictionary from the calculate_if_idf function
+        file -> the merged index from the merge_indexes function
+        outputfile -> the file to store the final index
+        tier_file -> the file to store the high-impact tiers
+        lexicon_file -> the file to store the lexicon (file pointer locations)
+        doc_table_file -> the file to store the urls and document lengths
+        normalizer -> the returned dictionary from the merge_indexes function
+        positions_file -> the file to store the positions (if there are any)
 
         Return Value:
         None
         """
-
-        tf_idf_index = open(file, 'r')
-        final_index = open(outputfile, 'w')
-
+        merged_index = PostingReader(file)
+        final_index = PostingWriter(outputfile, has_scores=True, has_skips=True)
+        tier_index = PostingWriter(tier_file, has_scores=True)
+        position_index = None
+        if merged_index.has_positions and positions_file is not None:
+            position_index = PositionWriter(positions_file)
+
+        # The lexicon stores the file pointer locations.
+        # key: token, element: (byte offset of the token's record, document
+        # frequency, highest score, highest importance score, byte offset of
+        # the token's tier (-1 if it has none), byte offset of the token's
+        # positions (-1 if there are none))
+        # The highest scores let the query skip documents that can't make it
+        # to the top results.
+        lexicon = LexiconWriter(lexicon_file)
         temp_dict = dict()
         count = 1
 
-        for line in tf_idf_index:
-            tup = eval(line.strip('\n'))
+        for word, posting in merged_index:
+            # calculates the lnc value, normalizes it and stores it inside the
+            # temp dictionary as (score, importance, frequency)
+            for doc_id, tf_value in posting.items():
+                lnc_value = 1 + math.log(tf_value[0])
+                score = lnc_value / normalizer[doc_id]
+                temp_dict[doc_id] = (score, tf_value[1], tf_value[0])
 
-            # normalizes the tf_idf value and stores it inside the temp dictionary
-            for doc_id, data in tup[1].items():
-                temp_dict[doc_id] = (data[0] / normalizer[doc_id], data[1])
+            # writes the positions of the word to their own file
+            positions_fp = -1
+            if position_index is not None:
+                positions_fp = position_index.write(
+                    {doc_id: tf_value[2] for doc_id, tf_value in posting.items()})
 
-            # writes the normalized tf_idf value to the output file and
-            # clears temp_dict for the next loop (next line)
-            final_index.write(str((tup[0], temp_dict)) + '\n')
+            # writes the word and clears temp_dict for the next word
+            self.write_word(word, temp_dict, final_index, tier_index, lexicon, positions_fp)
             temp_dict.clear()
 
-            # keeptracks of the current status while running this function
+            # keeps track of the current status while running this function
             count += 1
-            if count % 1000 == 0:
-                print(f'{count} words normalized!')
+            if count % 10000 == 0:
+                print(f'{count} words finalized!')
 
-        tf_idf_index.close()
+        merged_index.close()
         final_index.close()
-
-        self.file_handler.remove_tf_idf_indexes()
-
-    def get_fp_locations(self, index_file, fp_file):
+        tier_index.close()
+        lexicon.close()
+        if position_index is not None:
+            position_index.close()
+
+        # Writes the url and length of every document to the document table.
+        # Documents without any words have a length of 0.
+        # The urls are the ones indexed since the first doc id of this run.
+        print("Writing the document table...")
+        with DocTableWriter(doc_table_file) as doc_table:
+            for doc_id, url in enumerate(self.urls, start=self.doc_id - len(self.urls)):
+                doc_table.add(url, normalizer.get(doc_id, 0.0))
+        self.urls.clear()
+        self.fingerprints = array('Q')
+
+    def write_word(self, word, posting, final_index, tier_index, lexicon, positions_fp=-1):
         """
-        Gets the file pointer location of each word's line in the index using
-        the tell function and writes it to a dict. This dict is then dumped
-        as a json.
-        Input Parameter:
-        index_file -> the outputfile from the normalize_tf_idf function (the
-        final index)
-        fp_file -> the file to store the result of the file pointer locations
-        Return Value:
-        None
+        Writes the finalized posting of a word ({doc_id: (score, importance,
+        frequency)}) to the final index, its tier (if the posting is longer
+        than a tier) to the tier index, and its entry to the lexicon (with
+        the offset of its positions, if they were written).
         """
+        max_score = 0.0
+        max_importance = 0
+        for score, importance, _ in posting.values():
+            max_score = max(max_score, score)
+            max_importance = max(max_importance, importance)
+
+        # writes the normalized tf_idf value to the output file and keeps the
+        # file pointer location
+        fp = final_index.write(word, posting)
+
+        # writes the tier of the word, if its posting is longer than a tier
+        tier_fp = -1
+        if len(posting) > self.tier_size:
+            tier = heapq.nlargest(self.tier_size, posting.items(),
+                                  key=lambda item: item[1][0] + item[1][1])
+            tier_fp = tier_index.write(word, dict(tier))
+
+        lexicon.add(word, fp, len(posting), max_score, max_importance, tier_fp, positions_fp)
+
+    def compact_segments(self, segments, first_doc_id: int, folders: [str]) -> ([array], [int]):
+        """
+        Merges segments (in doc id order) into new segments, one in each of
+        folders. The deleted documents are dropped and the others get new doc
+        ids from first_doc_id on, in the same order. The new doc ids are then
+        split into len(folders) ranges of about the same size, so the new
+        segments can be used as shards. Scores are only divided by the length
+        of their own document, so they are copied as they are; only the
+        document frequencies, highest scores and tiers are redone. If every
+        segment has positions (or fingerprints), they are copied to the new
+        segments too.
+
+        Every segment's lexicon is read at the same time and a heap keeps the
+        smallest word on top, like merge_indexes.
 
-        # Update current status
-        last_ran_timestamp = datetime.now()
-        self.file_handler.set_index_status(False, last_ran_timestamp)
-
-        index = open(index_file, 'r')
-        fp_locations = open(fp_file, 'w')
-
-        # fp_dict is the dict that stores the file pointer locations.
-        # key: token, element: file pointer location int
-        fp_dict = dict()
-        count = 1
-
-        while True:
-            # check where the file pointer is at currently
-            fp = index.tell()
-
-            # then read the line
-            line = index.readline().strip('\n')
-
-            # end loop if the end of the file is reached
-            if line == '':
+        Return Value:
+        The new doc ids of each segment's documents (0 if deleted) and the
+        first doc id of each new segment
+        """
+        # new_ids[i][n] is the new doc id of the n-th document of segments[i]
+        # (0 if it is deleted)
+        new_ids = []
+        doc_id = first_doc_id
+        for segment in segments:
+            ids = array('I')
+            for n in range(len(segment)):
+                if n in segment.tombstones:
+                    ids.append(0)
+                else:
+                    ids.append(doc_id)
+                    doc_id += 1
+            new_ids.append(ids)
+
+        # The first doc id of each new segment
+        count = doc_id - first_doc_id
+        shards = len(folders)
+        first_doc_ids = [first_doc_id + count * k // shards for k in range(shards)]
+
+        final_indexes = [PostingWriter(folder + '/index.bin', has_scores=True, has_skips=True)
+                         for folder in folders]
+        tier_indexes = [PostingWriter(folder + '/tier.bin', has_scores=True) for folder in folders]
+        lexicons = [LexiconWriter(folder + '/lexicon.bin') for folder in folders]
+        temp_dicts = [dict() for _ in folders]
+
+        position_indexes = None
+        if all(segment.positions is not None for segment in segments):
+            position_indexes = [PositionWriter(folder + '/positions.bin') for folder in folders]
+            temp_positions = [dict() for _ in folders]
+
+        # heap of (word, segment number, lexicon entry, lexicon iterator)
+        heap = []
+        for i, segment in enumerate(segments):
+            words = segment.lexicon.items()
+            for word, entry in words:
+                heap.append((word, i, entry, words))
                 break
+        heapq.heapify(heap)
+
+        while heap:
+            word = heap[0][0]
+
+            # Copies the postings of the word from every segment that has it
+            # to the new segment of each document
+            while heap and heap[0][0] == word:
+                _, i, entry, words = heap[0]
+                segment = segments[i]
+                _, posting = segment.final_index.read(entry[0])
+                positions = None
+                if position_indexes is not None:
+                    positions = segment.positions.read_all(entry[5])
+                for old_id, value in posting.items():
+                    new_id = new_ids[i][old_id - segment.first_doc_id]
+                    if new_id:
+                        shard = bisect.bisect_right(first_doc_ids, new_id) - 1
+                        temp_dicts[shard][new_id] = value
+                        if positions is not None:
+                            temp_positions[shard][new_id] = positions[old_id]
+
+                for next_word, next_entry in words:
+                    heapq.heapreplace(heap, (next_word, i, next_entry, words))
+                    break
+                else:
+                    heapq.heappop(heap)
+
+            # A word that is only in deleted documents is dropped
+            for shard, temp_dict in enumerate(temp_dicts):
+                if temp_dict:
+                    positions_fp = -1
+                    if position_indexes is not None:
+                        positions_fp = position_indexes[shard].write(temp_positions[shard])
+                        temp_positions[shard].clear()
+                    self.write_word(word, temp_dict, final_indexes[shard],
+                                    tier_indexes[shard], lexicons[shard], positions_fp)
+                    temp_dict.clear()
+
+        for shard in range(shards):
+            final_indexes[shard].close()
+            tier_indexes[shard].close()
+            lexicons[shard].close()
+            if position_indexes is not None:
+                position_indexes[shard].close()
+
+        doc_tables = [DocTableWriter(folder + '/doc_table.bin') for folder in folders]
+        for segment, ids in zip(segments, new_ids):
+            for n, url in enumerate(segment.doc_table.urls()):
+                if ids[n]:
+                    shard = bisect.bisect_right(first_doc_ids, ids[n]) - 1
+                    doc_tables[shard].add(url, segment.doc_table.norm(n + 1))
+        for doc_table in doc_tables:
+            doc_table.close()
+
+        all_fingerprints = [segment.read_fingerprints() for segment in segments]
+        if all(fingerprints is not None for fingerprints in all_fingerprints):
+            new_fingerprints = [array('Q') for _ in folders]
+            for fingerprints, ids in zip(all_fingerprints, new_ids):
+                for n, fingerprint in enumerate(fingerprints):
+                    if ids[n]:
+                        shard = bisect.bisect_right(first_doc_ids, ids[n]) - 1
+                        new_fingerprints[shard].append(fingerprint)
+            for folder, fingerprints in zip(folders, new_fingerprints):
+                write_fingerprints(folder + '/fingerprints.bin', fingerprints)
+
+        return new_ids, first_doc_ids
+
+    def merge_posting(self, *postings):
+        if len(postings) == 1:
+            return postings[0]
+
+        # Partial indexes hold different documents so the doc ids never
+        # collide. The posting writer puts the doc ids in order.
+        d = dict()
+        for posting in postings:
+            d.update(posting)
+        return d
 
-            tup = eval(line)
-
-            # adds the file pointer location to fp_dict's token key
-            fp_dict[tup[0]] = fp
 
-            # keeptracks of the current status while running this function
-            count += 1
-            if count % 10000 == 0:
-                print(f"{count} words' file locations found!")
+# The indexer used by each worker process of Indexer.index_parallel. Workers
+# make their own instance so that nothing but the batches has to be pickled.
+_worker_indexer = None
 
-        # dumps the dict as a json
-        print("Dumping the file pointer dict...")
-        self.file_handler.dump_json(fp_dict, fp_locations)
 
-        index.close()
-        fp_locations.close()
+def _init_worker(memory_budget, positions, near_duplicates):
+    global _worker_indexer
+    # A forked worker starts with a copy of the metrics of the main process
+    METRICS.reset()
+    _worker_indexer = Indexer(FileHandler(), memory_budget=memory_budget, positions=positions,
+                              near_duplicates=near_duplicates)
 
-        # Set index status to True
-        self.file_handler.set_index_status(True, last_ran_timestamp)
 
-    def merge_posting(self, posting1, posting2):
-        d = {k : v for k, v in sorted({** posting1, **posting2}.items())}
-        return d
+def _index_batch(index_id, batch):
+    fingerprints = _worker_indexer.index_batch(index_id, batch)
+    return fingerprints, METRICS.drain()
 
 
 if __name__ == '__main__':
-    test = Indexer(FileHandler(), file_count_offset=10000)
+    test = Indexer(FileHandler())
     line1 = {14300: (1, 0), 14435: (1, 0), 14447: (4, 1), 14462: (8, 1), 14572: (1, 0), 14609: (1, 0), 14793: (1, 0), 14828: (46, 1), 14860: (1, 0), 14865: (2, 0), 14893: (3, 0)}
     line2 = {14301: (1, 0)}
     test.merge_posting(line1, line2)
\ No newline at end of file
@@ -0,0 +1,200 @@
+import mmap
+import os
+import struct
+
+from posting_file import encode_varint, decode_varint, SCORE
+
+
+# Header: magic bytes, version, terms per block, number of terms, number of
+# blocks and the byte offset of the block index.
+MAGIC = b'CSLX'
+VERSION = 2
+HEADER = struct.Struct('<4sBBIIQ')
+
+# The block index is an array of the byte offsets of every block.
+BLOCK_OFFSET = struct.Struct('<Q')
+
+
+class LexiconWriter:
+    """
+    Writes a sorted, front-coded lexicon. Terms have to be added in order.
+
+    Terms are grouped in blocks of block_size. The first term of a block is
+    written in full and the others only as the length of the prefix they
+    share with the previous term plus the rest of the term. After each term
+    comes its entry: varint posting offset, varint document frequency,
+    8 byte highest score, varint highest importance, varint tier offset
+    plus 1 (0 if the term has no tier) and varint positions offset plus 1
+    (0 if the segment has no positions).
+    """
+
+    def __init__(self, filename: str, block_size=16):
+        self.block_size = block_size
+        self.file = open(filename, 'wb')
+        # The header is written again with the counts on close
+        self.file.write(HEADER.pack(MAGIC, VERSION, block_size, 0, 0, 0))
+
+        self.block_offsets = []
+        self.count = 0
+        self.last_term = b''
+
+    def add(self, term: str, offset: int, df: int, max_score: float,
+            max_importance: int, tier_offset: int, positions_offset=-1) -> None:
+        term = term.encode('utf-8')
+        buffer = bytearray()
+
+        if self.count % self.block_size == 0:
+            self.block_offsets.append(self.file.tell())
+            encode_varint(len(term), buffer)
+            buffer += term
+        else:
+            prefix = 0
+            limit = min(len(term), len(self.last_term))
+            while prefix < limit and term[prefix] == self.last_term[prefix]:
+                prefix += 1
+            encode_varint(prefix, buffer)
+            encode_varint(len(term) - prefix, buffer)
+            buffer += term[prefix:]
+
+        encode_varint(offset, buffer)
+        encode_varint(df, buffer)
+        buffer += SCORE.pack(max_score)
+        encode_varint(max_importance, buffer)
+        encode_varint(tier_offset + 1, buffer)
+        encode_varint(positions_offset + 1, buffer)
+
+        self.file.write(buffer)
+        self.last_term = term
+        self.count += 1
+
+    def close(self) -> None:
+        index_offset = self.file.tell()
+        for block_offset in self.block_offsets:
+            self.file.write(BLOCK_OFFSET.pack(block_offset))
+
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.block_size, self.count,
+                                    len(self.block_offsets), index_offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Lexicon:
+    """
+    Looks terms up in a lexicon file written by LexiconWriter through mmap.
+
+    Only the block index (one offset per block) is needed to find a term: a
+    binary search on the first term of each block finds the block, and the
+    block is then decoded until the term is found. Entries are
+    (posting offset, document frequency, highest score, highest importance,
+    tier offset or -1, positions offset or -1).
+    """
+
+    def __init__(self, filename: str):
+        self.file = open(filename, 'rb')
+
+        if os.fstat(self.file.fileno()).st_size < HEADER.size:
+            self.file.close()
+            raise ValueError(f'{filename} is not a lexicon file')
+
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.block_size, self.count, self.blocks, self.index_offset = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{filename} is not a lexicon file')
+
+    def block_offset(self, block: int) -> int:
+        # The block offsets are read straight from the mmap
+        return BLOCK_OFFSET.unpack_from(self.data, self.index_offset + block * BLOCK_OFFSET.size)[0]
+
+    def first_term(self, block: int) -> bytes:
+        pos = self.block_offset(block)
+        length, pos = decode_varint(self.data, pos)
+        return self.data[pos:pos + length]
+
+    def find_block(self, term: bytes) -> int:
+        """
+        Returns the last block whose first term is not after term, or -1.
+        """
+        low = 0
+        high = self.blocks
+        while low < high:
+            middle = (low + high) // 2
+            if self.first_term(middle) <= term:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def read_block(self, block: int):
+        """
+        Yields (term as bytes, entry) for every term of a block.
+        """
+        data = self.data
+        pos = self.block_offset(block)
+        last = self.count - block * self.block_size
+        term = b''
+
+        for i in range(min(self.block_size, last)):
+            if i == 0:
+                length, pos = decode_varint(data, pos)
+                term = data[pos:pos + length]
+                pos += length
+            else:
+                prefix, pos = decode_varint(data, pos)
+                length, pos = decode_varint(data, pos)
+                term = term[:prefix] + data[pos:pos + length]
+                pos += length
+
+            offset, pos = decode_varint(data, pos)
+            df, pos = decode_varint(data, pos)
+            max_score = SCORE.unpack_from(data, pos)[0]
+            pos += SCORE.size
+            max_importance, pos = decode_varint(data, pos)
+            tier_offset, pos = decode_varint(data, pos)
+            positions_offset, pos = decode_varint(data, pos)
+
+            yield term, (offset, df, max_score, max_importance, tier_offset - 1, positions_offset - 1)
+
+    def get(self, term: str, default=None):
+        term = term.encode('utf-8')
+        block = self.find_block(term)
+        if block < 0:
+            return default
+
+        for block_term, entry in self.read_block(block):
+            if block_term == term:
+                return entry
+            if block_term > term:
+                break
+        return default
+
+    def __getitem__(self, term: str):
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term: str):
+        return self.get(term) is not None
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        """
+        Yields (term, entry) for every term in order.
+        """
+        for block in range(self.blocks):
+            for term, entry in self.read_block(block):
+                yield str(term, 'utf-8'), entry
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
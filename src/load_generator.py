@@ -0,0 +1,275 @@
+import contextlib
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import latency_summary
+from search_engine import SearchEngine
+
+
+def read_query_log(path: str) -> [str]:
+    """
+    Reads a query log, either one query per line or JSONL with the query in
+    "query" (or "q") of every line.
+    """
+    queries = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('{'):
+                record = json.loads(line)
+                line = record.get('query', record.get('q', '')).strip()
+            if line:
+                queries.append(line)
+    return queries
+
+
+class EngineTarget:
+    """
+    Sends the queries to a search engine in this process (SearchEngine.find
+    from many threads, like the worker threads of the HTTP API).
+    """
+
+    def __init__(self, search_engine, timeout=5.0):
+        self.search_engine = search_engine
+        self.timeout = timeout
+
+    def search(self, query: str) -> None:
+        self.search_engine.find(query, self.timeout)
+
+    def cache_stats(self) -> dict:
+        stats = {'posting_cache': self.search_engine.posting_cache.stats()}
+        if self.search_engine.query.result_cache is not None:
+            stats['result_cache'] = self.search_engine.query.result_cache.stats()
+        return stats
+
+
+class HttpTarget:
+    """
+    Sends the queries to a running API server (see api.py), i.e.
+    http://localhost:8000. The cache stats come from its /metrics.
+    """
+
+    def __init__(self, url: str, timeout=5.0):
+        self.url = url.rstrip('/')
+        # The server has its own timeout, so the client waits a bit longer
+        self.timeout = timeout + 5
+
+    def search(self, query: str) -> None:
+        url = self.url + '/search?' + urllib.parse.urlencode({'q': query})
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            response.read()
+
+    def cache_stats(self) -> dict:
+        with urllib.request.urlopen(self.url + '/metrics?format=json', timeout=self.timeout) as response:
+            gauges = json.load(response)['gauges']
+
+        # The gauges are named <cache>.<stat>
+        stats = dict()
+        for name, value in gauges.items():
+            cache, _, stat = name.partition('.')
+            if cache in ('posting_cache', 'result_cache'):
+                stats.setdefault(cache, dict())[stat] = value
+        return stats
+
+
+def error_kind(error: Exception) -> str:
+    """
+    Names the kind of a failed request for the report.
+    """
+    if isinstance(error, urllib.error.HTTPError):
+        if error.code == 503:
+            return 'busy'
+        if error.code == 504:
+            return 'timeout'
+        return f'http_{error.code}'
+    if isinstance(error, TimeoutError):
+        return 'timeout'
+    return type(error).__name__
+
+
+class LoadGenerator:
+    """
+    Replays a query log against a target (EngineTarget or HttpTarget) from
+    many threads at once, to measure the throughput and latency of the
+    search engine under load.
+
+    Closed loop (rate is None): concurrency clients each send a query, wait
+    for the answer and send the next one right away. This measures the most
+    queries per second the engine can do with that many clients.
+
+    Open loop (rate queries per second): queries arrive at random times
+    (a Poisson process) at the given rate whether or not the engine kept up,
+    and are sent by a pool of concurrency threads. The latency is counted
+    from the time a query arrived, so the time it waited for a free thread
+    counts too (a slow engine can't hide it by slowing the clients down).
+
+    The log is replayed in order (from the start again when it runs out)
+    until requests queries were sent or duration seconds passed. By default
+    it is replayed once.
+    """
+
+    def __init__(self, target, queries: [str], concurrency=8, rate=None, duration=None,
+                 requests=None, seed=121):
+        self.target = target
+        self.queries = queries
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.requests = requests
+        if requests is None and duration is None:
+            self.requests = len(queries)
+        self.rng = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = dict()
+
+    def query_stream(self, end_time: float):
+        """
+        Yields the queries to send, until requests of them were yielded or
+        end_time passed.
+        """
+        stream = itertools.cycle(self.queries)
+        if self.requests is not None:
+            stream = itertools.islice(stream, self.requests)
+        for query in stream:
+            if time.perf_counter() >= end_time:
+                return
+            yield query
+
+    def send(self, query: str, arrival_time: float) -> None:
+        try:
+            self.target.search(query)
+        except Exception as error:
+            kind = error_kind(error)
+            with self.lock:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+            return
+
+        latency = time.perf_counter() - arrival_time
+        with self.lock:
+            self.latencies.append(latency)
+
+    def run_closed(self, end_time: float) -> None:
+        stream = self.query_stream(end_time)
+        stream_lock = threading.Lock()
+
+        def client():
+            while True:
+                with stream_lock:
+                    query = next(stream, None)
+                if query is None:
+                    return
+                self.send(query, time.perf_counter())
+
+        clients = [threading.Thread(target=client) for _ in range(self.concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+
+    def run_open(self, end_time: float) -> None:
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            arrival_time = time.perf_counter()
+            for query in self.query_stream(end_time):
+                delay = arrival_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.send, query, arrival_time)
+                arrival_time += self.rng.expovariate(self.rate)
+
+    def run(self) -> dict:
+        before = self.target.cache_stats()
+        start_time = time.perf_counter()
+        end_time = start_time + self.duration if self.duration is not None else float('inf')
+
+        if self.rate is None:
+            self.run_closed(end_time)
+        else:
+            self.run_open(end_time)
+
+        elapsed = time.perf_counter() - start_time
+        after = self.target.cache_stats()
+
+        results = {
+            'mode': 'closed' if self.rate is None else 'open',
+            'concurrency': self.concurrency,
+            'offered_rate': self.rate,
+            'requests': len(self.latencies) + sum(self.errors.values()),
+            'completed': len(self.latencies),
+            'errors': dict(self.errors),
+            'duration_s': elapsed,
+            'qps': len(self.latencies) / elapsed if elapsed else 0.0,
+        }
+        if self.latencies:
+            results['latency'] = latency_summary(self.latencies)
+
+        # Hit ratios of the caches during the run only
+        results['caches'] = dict()
+        for cache, stats in after.items():
+            hits = stats['hits'] - before.get(cache, {}).get('hits', 0)
+            misses = stats['misses'] - before.get(cache, {}).get('misses', 0)
+            results['caches'][cache] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            }
+        return results
+
+
+if __name__ == '__main__':
+    # python3 src/load_generator.py <query_log> [corpus] [--url http://localhost:8000]
+    #     [--concurrency 8] [--rate 50] [--duration 30] [--requests 1000]
+    #     [--timeout 5] [--seed 121] [--out results.json] [--shards 1]
+    #     [--vectorized] [--no-result-cache]
+    # Without --url the queries are searched in this process (closed loop
+    # unless --rate is given).
+    args = sys.argv[1:]
+    options = {'--url': None, '--concurrency': 8, '--rate': None, '--duration': None,
+               '--requests': None, '--timeout': 5.0, '--seed': 121, '--out': None,
+               '--shards': 1}
+    types = {'--rate': float, '--duration': float, '--requests': int}
+    for option, default in options.items():
+        if option in args:
+            i = args.index(option)
+            value_type = types.get(option, str if default is None else type(default))
+            options[option] = value_type(args[i + 1])
+            del args[i:i + 2]
+
+    vectorized = '--vectorized' in args
+    if vectorized:
+        args.remove('--vectorized')
+    result_cache = '--no-result-cache' not in args
+    if not result_cache:
+        args.remove('--no-result-cache')
+
+    queries = read_query_log(args[0])
+
+    # The progress messages of the engine go to stderr, so only the results
+    # are on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        if options['--url'] is not None:
+            target = HttpTarget(options['--url'], options['--timeout'])
+        else:
+            corpus = args[1] if len(args) > 1 else './DEV'
+            search_engine = SearchEngine(corpus, shards=options['--shards'], vectorized=vectorized)
+            if not result_cache:
+                search_engine.query.result_cache = None
+            target = EngineTarget(search_engine, options['--timeout'])
+
+        load_generator = LoadGenerator(target, queries, options['--concurrency'], options['--rate'],
+                                       options['--duration'], options['--requests'], options['--seed'])
+        results = load_generator.run()
+
+    if options['--out'] is not None:
+        with open(options['--out'], 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,248 @@
+import bisect
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds (in seconds) of the buckets of every histogram. The last
+# bucket has no bound.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Prefix of every metric in the Prometheus text format
+PROMETHEUS_PREFIX = 'searchengine_'
+
+
+class Histogram:
+    """
+    Counts how many timings fell in each bucket of BUCKETS, with their number
+    and sum (like a Prometheus histogram).
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        # The first bucket whose bound is at least seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other: dict) -> None:
+        for i, count in enumerate(other['buckets']):
+            self.buckets[i] += count
+        self.count += other['count']
+        self.sum += other['sum']
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'sum': self.sum, 'buckets': list(self.buckets)}
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of timed spans of the search engine.
+
+    A span times a stage of the build (build.parse, build.tokenize,
+    build.spill, build.merge, build.finalize, ...) or of a query
+    (query.tokenize, query.lexicon, query.postings, query.decode,
+    query.score, ...) and adds the time to the histogram of its name.
+    A thread can also trace its spans (i.e. one query) to see where the time
+    of that one query went.
+
+    Worker processes have their own metrics. They send them back with
+    drain(), and the main process adds them with merge().
+
+    Everything can be exported as json or in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict()
+        self.gauges = dict()
+        self.histograms = dict()
+
+        # The spans of the trace of each thread (None if it isn't tracing)
+        self.local = threading.local()
+
+    def count(self, name: str, value=1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+        spans = getattr(self.local, 'spans', None)
+        if spans is not None:
+            spans.append((name, seconds))
+
+    @contextmanager
+    def span(self, name: str):
+        """
+        Times the with block and adds the time to the histogram name.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time)
+
+    @contextmanager
+    def trace(self):
+        """
+        Records every span of this thread in the with block. Yields the list
+        the spans are added to, as (name, seconds) in the order they ended.
+        """
+        previous = getattr(self.local, 'spans', None)
+        self.local.spans = []
+        try:
+            yield self.local.spans
+        finally:
+            self.local.spans = previous
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {name: histogram.to_dict()
+                               for name, histogram in self.histograms.items()},
+            }
+
+    def drain(self) -> dict:
+        """
+        Returns the snapshot of the metrics and starts from zero again (used
+        by worker processes to send their metrics back).
+        """
+        with self.lock:
+            snapshot = {
+                'counters': self.counters,
+                'gauges': self.gauges,
+                'histograms': {name: histogram.to_dict()
+                               for name, histogram in self.histograms.items()},
+            }
+            self.counters = dict()
+            self.gauges = dict()
+            self.histograms = dict()
+        return snapshot
+
+    def merge(self, snapshot: dict) -> None:
+        """
+        Adds the metrics of a snapshot (from drain) to these metrics.
+        """
+        with self.lock:
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.gauges.update(snapshot['gauges'])
+            for name, other in snapshot['histograms'].items():
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = Histogram()
+                histogram.merge(other)
+
+    def reset(self) -> None:
+        self.drain()
+
+    def summary(self, prefix='') -> {str: float}:
+        """
+        Returns the total seconds spent in every span whose name starts with
+        prefix.
+        """
+        with self.lock:
+            return {name: histogram.sum for name, histogram in self.histograms.items()
+                    if name.startswith(prefix)}
+
+    def to_json(self) -> str:
+        snapshot = self.snapshot()
+        snapshot['buckets'] = list(BUCKETS)
+        return json.dumps(snapshot, indent=2)
+
+    def to_prometheus(self) -> str:
+        """
+        Returns the metrics in the Prometheus text format. Names get the
+        searchengine_ prefix and dots become underscores, i.e. the span
+        query.score is the histogram searchengine_query_score_seconds.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = PROMETHEUS_PREFIX + name.replace('.', '_') + '_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+
+        for name, value in sorted(snapshot['gauges'].items()):
+            metric = PROMETHEUS_PREFIX + name.replace('.', '_')
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value}')
+
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            metric = PROMETHEUS_PREFIX + name.replace('.', '_') + '_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            # Prometheus buckets count every value up to their bound
+            total = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+                total += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {total}')
+            lines.append(f'{metric}_sum {histogram["sum"]}')
+            lines.append(f'{metric}_count {histogram["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def summarize_trace(spans: [(str, float)]) -> {str: dict}:
+    """
+    Adds up the spans of a trace by name: {name: {'count': ..., 'ms': ...}},
+    in the order the names first ended.
+    """
+    totals = dict()
+    for name, seconds in spans:
+        total = totals.setdefault(name, {'count': 0, 'ms': 0.0})
+        total['count'] += 1
+        total['ms'] += seconds * 1000
+    return totals
+
+
+# Only one thread can run cProfile at a time
+_profile_lock = threading.Lock()
+
+
+@contextmanager
+def profile(enabled=True, limit=30):
+    """
+    Runs cProfile over the with block if enabled. Yields a dict whose
+    'stats' is set to the limit slowest functions (by cumulative time) once
+    the block is done.
+    """
+    result = dict()
+    if not enabled:
+        yield result
+        return
+
+    with _profile_lock:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(limit)
+            result['stats'] = text.getvalue()
+
+
+# The metrics of this process
+METRICS = Metrics()
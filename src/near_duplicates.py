@@ -0,0 +1,121 @@
+import hashlib
+import os
+from array import array
+
+import numpy as np
+
+
+# The fingerprint is split into BANDS bands of BAND_BITS bits (see
+# NearDuplicateDetector)
+BANDS = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+# The number of words in a shingle (see simhash)
+SHINGLE_SIZE = 3
+
+
+def shingle_hash(shingle: str) -> int:
+    """
+    Returns a 64 bit hash of a shingle. Python's hash() is different in every
+    process, so a fixed hash is used to get the same fingerprints from every
+    worker and every build.
+    """
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def simhash(tokens: [str]) -> int:
+    """
+    Returns the 64 bit SimHash fingerprint of a document from its tokens (0
+    for a document without words).
+
+    The features of the document are its shingles: every run of
+    SHINGLE_SIZE words in a row (or the whole text if it is shorter). Pages
+    on the same site use mostly the same words, so the words alone make
+    different pages look alike; shingles also keep the order of the words.
+    Every shingle votes on each bit of the fingerprint: +1 if the bit is set
+    in the hash of the shingle, -1 if not. A bit of the fingerprint is set
+    if it gets more + votes than - votes. Documents with almost the same
+    shingles get fingerprints that differ in only a few bits.
+    """
+    if not tokens:
+        return 0
+
+    shingles = {' '.join(tokens[i:i + SHINGLE_SIZE])
+                for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((shingle_hash(shingle) for shingle in shingles), dtype='<u8',
+                         count=len(shingles))
+
+    # bits[i][j] is bit j of the hash of shingle i
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+
+    return int.from_bytes(np.packbits(votes > 0, bitorder='little').tobytes(), 'little')
+
+
+def write_fingerprints(filename: str, fingerprints: array) -> None:
+    """
+    Writes the fingerprints of a segment (one 8 byte fingerprint per
+    document, in doc id order).
+    """
+    with open(filename, 'wb') as f:
+        fingerprints.tofile(f)
+
+
+def read_fingerprints(filename: str) -> array or None:
+    """
+    Reads the fingerprints of a segment, or returns None if the segment has
+    none (it was built before near-duplicates were detected).
+    """
+    if not os.path.isfile(filename):
+        return None
+    fingerprints = array('Q')
+    with open(filename, 'rb') as f:
+        fingerprints.frombytes(f.read())
+    return fingerprints
+
+
+class NearDuplicateDetector:
+    """
+    Finds the documents a fingerprint is a near-duplicate of: the ones whose
+    fingerprint differs from it in at most max_distance bits.
+
+    Comparing with every document would be too slow, so the fingerprints are
+    split into 4 bands of 16 bits and kept in a table per band (LSH banding,
+    like Manku et al. do for web crawling). Two fingerprints that differ in
+    at most 3 bits can't differ in every band, so they are in the same
+    bucket of at least one table and only the fingerprints in those buckets
+    are compared.
+    """
+
+    def __init__(self, max_distance=3):
+        if max_distance >= BANDS:
+            raise ValueError(f'max_distance has to be less than {BANDS}')
+        self.max_distance = max_distance
+
+        # key: band value, element: [(fingerprint, doc id)]
+        self.tables = [dict() for _ in range(BANDS)]
+
+    def add(self, fingerprint: int, doc_id: int) -> None:
+        for band, table in enumerate(self.tables):
+            value = (fingerprint >> (band * BAND_BITS)) & BAND_MASK
+            if value in table:
+                table[value].append((fingerprint, doc_id))
+            else:
+                table[value] = [(fingerprint, doc_id)]
+
+    def find(self, fingerprint: int, skip=None) -> int or None:
+        """
+        Returns the smallest doc id that fingerprint is a near-duplicate of,
+        or None. If skip is given, the doc ids it returns True for are left
+        out (i.e. documents deleted since they were added).
+        """
+        found = None
+        for band, table in enumerate(self.tables):
+            value = (fingerprint >> (band * BAND_BITS)) & BAND_MASK
+            for other, doc_id in table.get(value, ()):
+                if ((found is None or doc_id < found) and bin(fingerprint ^ other).count('1') <= self.max_distance
+                        and (skip is None or not skip(doc_id))):
+                    found = doc_id
+        return found
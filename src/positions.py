@@ -0,0 +1,211 @@
+import mmap
+import os
+import struct
+from array import array
+
+from posting_file import encode_varint, decode_varint
+
+
+# Header: magic bytes and version
+MAGIC = b'CSPP'
+VERSION = 1
+HEADER = struct.Struct('<4sB')
+
+# An entry of the directory of a record: the doc id and the byte offset
+# where the positions of that document end
+DIRECTORY_ENTRY = struct.Struct('<II')
+
+
+def encode_positions(positions: [int]) -> bytes:
+    """
+    Encodes the positions of a word in a document (in order) as the varint
+    gap from the previous position.
+    """
+    buffer = bytearray()
+    last_position = 0
+    for position in positions:
+        encode_varint(position - last_position, buffer)
+        last_position = position
+    return bytes(buffer)
+
+
+def decode_positions(data, pos: int, end: int) -> array:
+    """
+    Decodes the positions written by encode_positions from pos to end.
+    """
+    positions = array('I')
+    position = 0
+    while pos < end:
+        gap, pos = decode_varint(data, pos)
+        position += gap
+        positions.append(position)
+    return positions
+
+
+def has_phrase(position_lists) -> bool:
+    """
+    Returns whether the words of a phrase are next to each other somewhere,
+    given the positions of each word of the phrase (in phrase order) in one
+    document.
+    """
+    # The positions where the phrase could start
+    starts = set(position_lists[0])
+    for offset, positions in enumerate(position_lists[1:], start=1):
+        starts.intersection_update(position - offset for position in positions)
+        if not starts:
+            return False
+    return True
+
+
+def min_window(position_lists) -> int:
+    """
+    Returns the length (in tokens) of the shortest part of a document that
+    has every word, given the positions of each word in the document.
+    """
+    # Every position of every word in order, as (position, word)
+    events = sorted((position, word) for word, positions in enumerate(position_lists)
+                    for position in positions)
+
+    # Sliding window: moves the right end one position at a time and the left
+    # end as far as it can while the window still has every word
+    counts = [0] * len(position_lists)
+    covered = 0
+    left = 0
+    best = events[-1][0] - events[0][0] + 1
+    for position, word in events:
+        if counts[word] == 0:
+            covered += 1
+        counts[word] += 1
+
+        while covered == len(position_lists):
+            best = min(best, position - events[left][0] + 1)
+            left_word = events[left][1]
+            counts[left_word] -= 1
+            if counts[left_word] == 0:
+                covered -= 1
+            left += 1
+
+    return best
+
+
+class PositionWriter:
+    """
+    Writes the positions file of a segment: for every word, where it is in
+    each document of its posting (the number of the token in the text of
+    the document). It is kept apart from the final index so queries that
+    don't need positions never read them.
+
+    Record layout:
+    varint document frequency, a directory of (4 byte doc id, 4 byte end
+    offset of the document's positions) in doc id order, then the encoded
+    positions (see encode_positions) of every document one after the other.
+    The directory has a fixed width so a query can binary search it for the
+    few documents it needs without decoding the rest.
+    """
+
+    def __init__(self, filename: str):
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION))
+
+    def write(self, positions: {int: bytes}) -> int:
+        """
+        Writes the encoded positions of a word by doc id and returns the byte
+        offset they were written at.
+        """
+        offset = self.file.tell()
+        buffer = bytearray()
+        encode_varint(len(positions), buffer)
+
+        end = 0
+        for doc_id in sorted(positions):
+            end += len(positions[doc_id])
+            buffer += DIRECTORY_ENTRY.pack(doc_id, end)
+        for doc_id in sorted(positions):
+            buffer += positions[doc_id]
+
+        self.file.write(buffer)
+        return offset
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PositionReader:
+    """
+    Reads a positions file written by PositionWriter through mmap.
+    """
+
+    def __init__(self, filename: str):
+        self.file = open(filename, 'rb')
+
+        if os.fstat(self.file.fileno()).st_size < HEADER.size:
+            self.file.close()
+            raise ValueError(f'{filename} is not a positions file')
+
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{filename} is not a positions file')
+
+    def read(self, offset: int, doc_ids) -> {int: array}:
+        """
+        Returns the positions of the word of the record at offset in every
+        document of doc_ids that has it. Only the directory entries and
+        positions of those documents are read.
+        """
+        data = self.data
+        df, directory = decode_varint(data, offset)
+        lists = directory + df * DIRECTORY_ENTRY.size
+        unpack_entry = DIRECTORY_ENTRY.unpack_from
+
+        found = dict()
+        # The doc ids are looked up in order, so every binary search starts
+        # where the last one ended
+        low = 0
+        for doc_id in sorted(doc_ids):
+            high = df
+            while low < high:
+                middle = (low + high) // 2
+                if unpack_entry(data, directory + middle * DIRECTORY_ENTRY.size)[0] < doc_id:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low == df:
+                break
+
+            entry_doc_id, end = unpack_entry(data, directory + low * DIRECTORY_ENTRY.size)
+            if entry_doc_id != doc_id:
+                continue
+            start = unpack_entry(data, directory + (low - 1) * DIRECTORY_ENTRY.size)[1] if low else 0
+            found[doc_id] = decode_positions(data, lists + start, lists + end)
+
+        return found
+
+    def read_all(self, offset: int) -> {int: bytes}:
+        """
+        Returns the encoded positions of every document of the record at
+        offset, without decoding them (used to copy them when compacting).
+        """
+        data = self.data
+        df, directory = decode_varint(data, offset)
+        lists = directory + df * DIRECTORY_ENTRY.size
+
+        found = dict()
+        start = 0
+        for i in range(df):
+            doc_id, end = DIRECTORY_ENTRY.unpack_from(data, directory + i * DIRECTORY_ENTRY.size)
+            found[doc_id] = bytes(data[lists + start:lists + end])
+            start = end
+        return found
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
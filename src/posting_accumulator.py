@@ -0,0 +1,90 @@
+from array import array
+
+
+# Rough number of bytes used by a new word besides its postings: the entry in
+# the term id dict, the str object and the three empty arrays.
+TERM_OVERHEAD = 300
+
+# Bytes used by one posting: a 4 byte doc id, a 4 byte frequency and a 1 byte
+# importance score. Arrays over-allocate by about 1/8 when they grow.
+POSTING_SIZE = (4 + 4 + 1) * 9 / 8
+
+# Bytes used by the encoded positions of one posting besides the positions:
+# the bytes object and its pointer in the list.
+POSITIONS_OVERHEAD = 33 + 8
+
+
+class PostingAccumulator:
+    """
+    The in-memory partial index. Words are interned to term ids and the
+    postings of each word are kept in growable typed arrays (doc ids,
+    frequencies and importance scores) instead of dicts of tuples. If
+    positions is set, every posting also has the encoded positions of the
+    word in the document (see positions.py).
+
+    nbytes is an estimate of the memory used, so the indexer can offload to a
+    partial index when it reaches its memory budget.
+    """
+
+    def __init__(self, positions=False):
+        # key: word, element: term id (index in the lists below)
+        self.term_ids = dict()
+        self.terms = []
+        self.doc_ids = []
+        self.frequencies = []
+        self.importances = []
+        self.has_positions = positions
+        self.positions = []
+        self.nbytes = 0
+
+    def add(self, word: str, doc_id: int, frequency: int, importance: int,
+            positions=None) -> None:
+        """
+        Adds the posting of a word. Documents have to be added in doc id
+        order so the arrays stay sorted.
+        """
+        term_id = self.term_ids.get(word)
+
+        # If the word is not in the partial index, give it a term id and
+        # empty arrays.
+        if term_id is None:
+            term_id = len(self.terms)
+            self.term_ids[word] = term_id
+            self.terms.append(word)
+            self.doc_ids.append(array('I'))
+            self.frequencies.append(array('I'))
+            self.importances.append(array('B'))
+            if self.has_positions:
+                self.positions.append([])
+            self.nbytes += TERM_OVERHEAD + len(word)
+
+        self.doc_ids[term_id].append(doc_id)
+        self.frequencies[term_id].append(frequency)
+        self.importances[term_id].append(importance)
+        self.nbytes += POSTING_SIZE
+        if self.has_positions:
+            self.positions[term_id].append(positions)
+            self.nbytes += POSITIONS_OVERHEAD + len(positions)
+
+    def items(self):
+        """
+        Yields (word, doc ids, frequencies, importance scores, encoded
+        positions or None) in word order.
+        """
+        for word in sorted(self.term_ids):
+            term_id = self.term_ids[word]
+            yield (word, self.doc_ids[term_id], self.frequencies[term_id],
+                   self.importances[term_id],
+                   self.positions[term_id] if self.has_positions else None)
+
+    def clear(self) -> None:
+        self.term_ids.clear()
+        self.terms.clear()
+        self.doc_ids.clear()
+        self.frequencies.clear()
+        self.importances.clear()
+        self.positions.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.terms)
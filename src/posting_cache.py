@@ -0,0 +1,204 @@
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+
+# Bytes used by a cache entry besides its arrays (key, tuple, array objects)
+ENTRY_OVERHEAD = 300
+
+# A snapshot starts with the magic bytes, the length of the index generation
+# it was made from (the last_run timestamp) and the number of entries. Each
+# entry is the token length, the tier flag, the posting length, the token and
+# then the raw doc id, score and importance arrays.
+SNAPSHOT_MAGIC = b'CSWC'
+SNAPSHOT_HEADER = struct.Struct('<4sHI')
+SNAPSHOT_ENTRY = struct.Struct('<HBI')
+
+
+class PostingCache:
+    """
+    Keeps decoded postings in memory, up to max_bytes.
+
+    Entries are evicted least recently used first. When the cache is full, a
+    new posting is only admitted if its word was looked up more often than
+    the word it would evict (TinyLFU-style admission), so one-off words don't
+    push popular words out. Lookup counts are halved every
+    aging_period lookups so that old popularity fades.
+
+    The cache is shared by every search thread, so it is changed under a
+    lock. The postings themselves are never changed once cached.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, aging_period=100000):
+        self.max_bytes = max_bytes
+        self.aging_period = aging_period
+
+        # key: (token, tier), element: (posting arrays, size in bytes)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+        # How many times each key was looked up recently
+        self.frequencies = dict()
+        self.lookups = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached posting of key, or None if it isn't cached.
+        """
+        with self.lock:
+            self.record_lookup(key)
+
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, posting) -> bool:
+        """
+        Adds a posting (a tuple of arrays) to the cache if there is room or
+        if it is more popular than the entries it would evict. Returns True if
+        it was added.
+        """
+        with self.lock:
+            if key in self.entries:
+                return True
+
+            nbytes = ENTRY_OVERHEAD + sum(len(column) * column.itemsize for column in posting)
+            if nbytes > self.max_bytes:
+                self.rejections += 1
+                return False
+
+            # Finds the least recently used entries that have to go to make room.
+            # If any of them is more popular than the new posting, keep them.
+            victims = []
+            freed = 0
+            frequency = self.frequencies.get(key, 0)
+            for victim in self.entries:
+                if self.nbytes - freed + nbytes <= self.max_bytes:
+                    break
+                if self.frequencies.get(victim, 0) > frequency:
+                    self.rejections += 1
+                    return False
+                victims.append(victim)
+                freed += self.entries[victim][1]
+
+            for victim in victims:
+                del self.entries[victim]
+                self.evictions += 1
+            self.nbytes -= freed
+
+            self.entries[key] = (posting, nbytes)
+            self.nbytes += nbytes
+            return True
+
+    def record_lookup(self, key) -> None:
+        self.frequencies[key] = self.frequencies.get(key, 0) + 1
+        self.lookups += 1
+
+        # Halves every count once in a while, forgetting the keys at 0
+        if self.lookups >= self.aging_period:
+            self.frequencies = {k: count // 2 for k, count in self.frequencies.items() if count > 1}
+            self.lookups = 0
+
+    def save(self, filename: str, generation: str) -> None:
+        """
+        Writes every cached posting to a snapshot file, least recently used
+        first, so that a new process can load them without decoding the
+        index. generation identifies the index the postings come from.
+        """
+        with self.lock:
+            generation = generation.encode('utf-8')
+
+            with open(filename + '.tmp', 'wb') as f:
+                f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(generation), len(self.entries)))
+                f.write(generation)
+
+                for (token, tier), (posting, _) in self.entries.items():
+                    token = token.encode('utf-8')
+                    doc_ids, scores, importances = posting
+                    f.write(SNAPSHOT_ENTRY.pack(len(token), tier, len(doc_ids)))
+                    f.write(token)
+                    f.write(doc_ids.tobytes())
+                    f.write(scores.tobytes())
+                    f.write(importances.tobytes())
+
+            # The snapshot only replaces the old one once it is complete
+            os.replace(filename + '.tmp', filename)
+
+    def load(self, filename: str, generation: str) -> bool:
+        """
+        Fills the cache from a snapshot made by save. The arrays are copied
+        straight from the file. Returns False (and loads nothing) if there is
+        no snapshot or if it was made from another index generation.
+        """
+        if not os.path.isfile(filename):
+            return False
+
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+        if len(data) < SNAPSHOT_HEADER.size:
+            return False
+
+        magic, length, count = SNAPSHOT_HEADER.unpack_from(data, 0)
+        pos = SNAPSHOT_HEADER.size
+        if magic != SNAPSHOT_MAGIC or data[pos:pos + length] != generation.encode('utf-8'):
+            return False
+        pos += length
+
+        for _ in range(count):
+            token_length, tier, size = SNAPSHOT_ENTRY.unpack_from(data, pos)
+            pos += SNAPSHOT_ENTRY.size
+            token = str(data[pos:pos + token_length], 'utf-8')
+            pos += token_length
+
+            posting = (array('I'), array('d'), array('B'))
+            for column in posting:
+                end = pos + size * column.itemsize
+                column.frombytes(data[pos:end])
+                pos = end
+
+            self.put((token, bool(tier)), posting)
+
+        return True
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the hit rate and size of the cache.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'rejections': self.rejections,
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
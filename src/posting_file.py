@@ -0,0 +1,409 @@
+import mmap
+import os
+import struct
+from array import array
+
+
+# Every posting file starts with a small header: the magic bytes, the format
+# version and a flags byte. The flags tell the reader whether the postings
+# carry a fixed-width score (the final index) or not (partial and merged
+# indexes, which only have frequencies and importance), and whether the
+# postings of partial and merged indexes carry the token positions (only if
+# the indexer records positions, see positions.py). In the final index, the
+# records can also start with a skip directory (HAS_SKIPS).
+MAGIC = b'CSPF'
+VERSION = 1
+HAS_SCORES = 1
+HAS_POSITIONS = 2
+HAS_SKIPS = 4
+HEADER = struct.Struct('<4sBB')
+
+# Scores are stored as little endian doubles so that the ranking is exactly
+# the same as the one computed from the old text index.
+SCORE = struct.Struct('<d')
+
+# A posting of more than SKIP_INTERVAL documents in a file with skips is cut
+# into blocks of SKIP_INTERVAL postings, and its skip directory has an entry
+# for every block: the doc id before the block (the gaps of the block start
+# from it) and the byte offset of the block after the directory. The entries
+# have a fixed width, so a query can binary search them and only decode the
+# blocks of the few documents it needs (see find_postings).
+SKIP_INTERVAL = 16
+SKIP_ENTRY = struct.Struct('<II')
+
+
+def encode_varint(value: int, buffer: bytearray) -> None:
+    """
+    Appends an unsigned integer to the buffer using 7 bits per byte. The high
+    bit of each byte is set when more bytes follow.
+    """
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def decode_varint(data, pos: int) -> (int, int):
+    """
+    Reads an unsigned integer written by encode_varint starting at pos.
+    Returns the value and the position right after it.
+    """
+    byte = data[pos]
+    pos += 1
+    # Most frequencies, importance scores and doc id gaps fit in one byte
+    if byte < 0x80:
+        return byte, pos
+
+    value = byte & 0x7f
+    shift = 7
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_record(term: str, posting: dict, has_scores: bool, has_positions=False,
+                  has_skips=False) -> bytearray:
+    """
+    Encodes one term and its posting into bytes.
+
+    Record layout:
+    varint term length, term (utf-8), varint document frequency, if
+    has_skips is set (only with scores) the varint number of blocks and the
+    skip directory (none for short postings), then for every posting in doc
+    id order: varint doc id gap, varint frequency, varint importance and, if
+    has_scores is set, an 8 byte score. If has_positions is set (only
+    without scores), every posting ends with the varint length of its
+    encoded positions and the positions.
+
+    Posting values are (frequency, importance) without scores,
+    (frequency, importance, encoded positions) with positions and
+    (score, importance, frequency) with scores.
+    """
+    buffer = bytearray()
+    term_bytes = term.encode('utf-8')
+    encode_varint(len(term_bytes), buffer)
+    buffer += term_bytes
+    encode_varint(len(posting), buffer)
+
+    # The postings are written apart first, so the offsets of the blocks
+    # are known before the skip directory is written
+    postings = bytearray()
+    skips = []
+
+    # doc ids are stored as the gap from the previous doc id
+    last_doc_id = 0
+    for i, doc_id in enumerate(sorted(posting)):
+        if has_skips and len(posting) > SKIP_INTERVAL and i % SKIP_INTERVAL == 0:
+            skips.append(SKIP_ENTRY.pack(last_doc_id, len(postings)))
+
+        value = posting[doc_id]
+        encode_varint(doc_id - last_doc_id, postings)
+        last_doc_id = doc_id
+
+        if has_scores:
+            encode_varint(value[2], postings)
+            encode_varint(value[1], postings)
+            postings += SCORE.pack(value[0])
+        else:
+            encode_varint(value[0], postings)
+            encode_varint(value[1], postings)
+            if has_positions:
+                encode_varint(len(value[2]), postings)
+                postings += value[2]
+
+    if has_skips:
+        encode_varint(len(skips), buffer)
+        buffer += b''.join(skips)
+    buffer += postings
+    return buffer
+
+
+def encode_columns(term: str, doc_ids, frequencies, importances, positions=None) -> bytearray:
+    """
+    Encodes one term and its posting given as parallel sequences of doc ids
+    (in order), frequencies, importance scores and, if given, encoded
+    positions. Gives the same bytes as encode_record without scores.
+    """
+    buffer = bytearray()
+    term_bytes = term.encode('utf-8')
+    encode_varint(len(term_bytes), buffer)
+    buffer += term_bytes
+    encode_varint(len(doc_ids), buffer)
+
+    last_doc_id = 0
+    for i, (doc_id, frequency, importance) in enumerate(zip(doc_ids, frequencies, importances)):
+        encode_varint(doc_id - last_doc_id, buffer)
+        last_doc_id = doc_id
+        encode_varint(frequency, buffer)
+        encode_varint(importance, buffer)
+        if positions is not None:
+            encode_varint(len(positions[i]), buffer)
+            buffer += positions[i]
+
+    return buffer
+
+
+def skip_directory(data, pos: int, has_skips: bool) -> (int, int):
+    """
+    Reads the number of blocks of the skip directory starting at pos (0 if
+    the file has no skips). Returns it and the position of the directory.
+    """
+    if not has_skips:
+        return 0, pos
+    return decode_varint(data, pos)
+
+
+def decode_record(data, pos: int, has_scores: bool, has_positions=False,
+                  has_skips=False) -> (str, dict, int):
+    """
+    Decodes the record starting at pos. Returns the term, its posting and the
+    position of the next record.
+    """
+    length, pos = decode_varint(data, pos)
+    term = str(data[pos:pos + length], 'utf-8')
+    pos += length
+    df, pos = decode_varint(data, pos)
+    blocks, pos = skip_directory(data, pos, has_skips)
+    pos += blocks * SKIP_ENTRY.size
+
+    posting = dict()
+    doc_id = 0
+    for _ in range(df):
+        gap, pos = decode_varint(data, pos)
+        doc_id += gap
+        frequency, pos = decode_varint(data, pos)
+        importance, pos = decode_varint(data, pos)
+
+        if has_scores:
+            score = SCORE.unpack_from(data, pos)[0]
+            pos += SCORE.size
+            posting[doc_id] = (score, importance, frequency)
+        elif has_positions:
+            length, pos = decode_varint(data, pos)
+            posting[doc_id] = (frequency, importance, bytes(data[pos:pos + length]))
+            pos += length
+        else:
+            posting[doc_id] = (frequency, importance)
+
+    return term, posting, pos
+
+
+def decode_columns(data, pos: int, has_skips=False) -> (str, array, array, array):
+    """
+    Decodes the record of a file with scores starting at pos into parallel
+    arrays: doc ids, scores and importance scores. This is what the query
+    uses, since it doesn't need a dict or the frequencies.
+    """
+    length, pos = decode_varint(data, pos)
+    term = str(data[pos:pos + length], 'utf-8')
+    pos += length
+    df, pos = decode_varint(data, pos)
+    blocks, pos = skip_directory(data, pos, has_skips)
+    pos += blocks * SKIP_ENTRY.size
+
+    doc_ids = array('I')
+    scores = array('d')
+    importances = array('B')
+    unpack_score = SCORE.unpack_from
+
+    doc_id = 0
+    for _ in range(df):
+        gap, pos = decode_varint(data, pos)
+        doc_id += gap
+        doc_ids.append(doc_id)
+        # skips the frequency
+        _, pos = decode_varint(data, pos)
+        importance, pos = decode_varint(data, pos)
+        importances.append(importance)
+        scores.append(unpack_score(data, pos)[0])
+        pos += 8
+
+    return term, doc_ids, scores, importances
+
+
+def find_postings(data, pos: int, doc_ids: [int], has_skips: bool) -> ({int: (float, int)}, int):
+    """
+    Finds the documents of doc_ids (in order) in the record of a file with
+    scores starting at pos. Only the blocks that could hold them are decoded
+    (the whole posting if it has no skip directory).
+
+    Returns {doc id: (score, importance)} for the documents that are in the
+    posting and the number of postings that were decoded.
+    """
+    length, pos = decode_varint(data, pos)
+    pos += length
+    df, pos = decode_varint(data, pos)
+    blocks, directory = skip_directory(data, pos, has_skips)
+    start = directory + blocks * SKIP_ENTRY.size
+    unpack_entry = SKIP_ENTRY.unpack_from
+    unpack_score = SCORE.unpack_from
+
+    found = dict()
+    decoded = 0
+    i = 0
+    while i < len(doc_ids):
+        # The last block that starts before doc_ids[i] (the blocks after the
+        # ones already decoded, since doc_ids are in order)
+        block = 0
+        count = df
+        doc_id = 0
+        pos = start
+        if blocks:
+            low = 0
+            high = blocks
+            while low < high:
+                middle = (low + high) // 2
+                if unpack_entry(data, directory + middle * SKIP_ENTRY.size)[0] < doc_ids[i]:
+                    low = middle + 1
+                else:
+                    high = middle
+            block = max(low - 1, 0)
+            doc_id, offset = unpack_entry(data, directory + block * SKIP_ENTRY.size)
+            count = min(SKIP_INTERVAL, df - block * SKIP_INTERVAL)
+            pos = start + offset
+
+        for _ in range(count):
+            gap, pos = decode_varint(data, pos)
+            doc_id += gap
+            # skips the frequency
+            _, pos = decode_varint(data, pos)
+            importance, pos = decode_varint(data, pos)
+            decoded += 1
+
+            # The doc ids before this one aren't in the posting
+            while i < len(doc_ids) and doc_ids[i] < doc_id:
+                i += 1
+            if i == len(doc_ids):
+                break
+            if doc_ids[i] == doc_id:
+                found[doc_id] = (unpack_score(data, pos)[0], importance)
+                i += 1
+            pos += 8
+
+        # The doc ids after the last block aren't in the posting either
+        if block >= blocks - 1:
+            break
+
+    return found, decoded
+
+
+class PostingWriter:
+    """
+    Writes (term, posting) records to a binary posting file. Records have to
+    be written in term order for the merge to work.
+
+    has_positions is only for partial and merged indexes (without scores),
+    and has_skips only for the final index (with scores).
+    """
+
+    def __init__(self, filename: str, has_scores=False, has_positions=False, has_skips=False):
+        self.has_scores = has_scores
+        self.has_positions = has_positions
+        self.has_skips = has_skips
+        flags = ((HAS_SCORES if has_scores else 0) | (HAS_POSITIONS if has_positions else 0)
+                 | (HAS_SKIPS if has_skips else 0))
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, flags))
+
+    def write(self, term: str, posting: dict) -> int:
+        """
+        Writes one record and returns the byte offset it was written at.
+        """
+        offset = self.file.tell()
+        self.file.write(encode_record(term, posting, self.has_scores, self.has_positions,
+                                      self.has_skips))
+        return offset
+
+    def write_columns(self, term: str, doc_ids, frequencies, importances, positions=None) -> int:
+        """
+        Writes one record from parallel sequences (see encode_columns) and
+        returns the byte offset it was written at.
+        """
+        offset = self.file.tell()
+        self.file.write(encode_columns(term, doc_ids, frequencies, importances, positions))
+        return offset
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PostingReader:
+    """
+    Reads a binary posting file through mmap. Iterating the reader yields
+    (term, posting) records in file order, and read() decodes the record at
+    a byte offset taken from the lexicon.
+    """
+
+    def __init__(self, filename: str):
+        self.file = open(filename, 'rb')
+
+        if os.fstat(self.file.fileno()).st_size < HEADER.size:
+            self.file.close()
+            raise ValueError(f'{filename} is not a posting file')
+
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, flags = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{filename} is not a posting file')
+
+        self.has_scores = bool(flags & HAS_SCORES)
+        self.has_positions = bool(flags & HAS_POSITIONS)
+        self.has_skips = bool(flags & HAS_SKIPS)
+
+    def read(self, offset: int) -> (str, dict):
+        term, posting, _ = decode_record(self.data, offset, self.has_scores, self.has_positions,
+                                         self.has_skips)
+        return term, posting
+
+    def read_columns(self, offset: int) -> (array, array, array):
+        """
+        Decodes the record at a byte offset of a final index into arrays of
+        doc ids, scores and importance scores.
+        """
+        return decode_columns(self.data, offset, self.has_skips)[1:]
+
+    def find(self, offset: int, doc_ids: [int]) -> ({int: (float, int)}, int):
+        """
+        Returns the score and importance of every document of doc_ids (in
+        order) that is in the record at a byte offset of a final index, and
+        the number of postings decoded to find them (see find_postings).
+        """
+        return find_postings(self.data, offset, doc_ids, self.has_skips)
+
+    def records(self):
+        """
+        Yields (offset, term, posting) for every record in the file.
+        """
+        pos = HEADER.size
+        end = len(self.data)
+        while pos < end:
+            offset = pos
+            term, posting, pos = decode_record(
+                self.data, pos, self.has_scores, self.has_positions, self.has_skips)
+            yield offset, term, posting
+
+    def __iter__(self):
+        for _, term, posting in self.records():
+            yield term, posting
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
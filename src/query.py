@@ -1,29 +1,104 @@
 import math
 import re
+import time
 import nltk
+from array import array
+from bisect import bisect_left
 from datetime import datetime
 from nltk.corpus import stopwords
 
+from metrics import METRICS
+from positions import has_phrase, min_window
+from segments import SegmentSet
+from top_k import BOUND_SLACK, PostingCursor, TopKRetriever
+from vector_top_k import VectorTopKRetriever
+
+
+# A phrase of the query is the text between two double quotes
+PHRASE = re.compile('"([^"]*)"')
+
+# With proximity, the best PROXIMITY_CANDIDATES documents are found first,
+# and each one gets PROXIMITY_WEIGHT * (words - 1) / (window - words + 1)
+# more score, where window is the length of the shortest part of the
+# document with every query word it has (so words right next to each other
+# get PROXIMITY_WEIGHT for every word after the first one).
+PROXIMITY_CANDIDATES = 50
+PROXIMITY_WEIGHT = 1.0
+
 class Query:
-    def __init__(self, file_handler, indexer, cached_words):
-        self.fp_dict = file_handler.load_json('./db/fp_locations.json')
-        self.doc_id_dict = file_handler.load_json('./db/doc_id.json')
-        self.final_index = open('./db/index.txt')
+    def __init__(self, file_handler, indexer, posting_cache, use_tiers=True, segments=None,
+                 vectorized=False, result_cache=None, proximity=True):
+        # The segments of the index (or only the given segments of the
+        # manifest). Their lexicons and document tables are looked up through
+        # mmap, so only the pages of the words and documents that are
+        # searched are read.
+        self.file_handler = file_handler
+        self.segment_list = segments
+        self.segments = SegmentSet(file_handler, segments)
+
+        # If use_tiers is set, the high-impact tiers of long postings are
+        # used to find the candidates first (see retrieve_tiers). The results
+        # are the same as with the full postings. (Not with vectorized:
+        # NumPy scores the full postings faster than the candidates can be
+        # checked.)
+        self.use_tiers = use_tiers
 
         self.indexer = indexer
         self.query_tokens = dict()
-        self.posting = dict()
+        self.query_phrases = []
+        self.posting = []
+
+        # Finds the top 10 documents of each query. If vectorized is set, the
+        # documents are scored with NumPy (same results, faster for long
+        # postings) instead of the MaxScore loop.
+        self.vectorized = vectorized
+        if vectorized:
+            self.retriever = VectorTopKRetriever(k=10)
+            self.candidate_retriever = VectorTopKRetriever(k=PROXIMITY_CANDIDATES)
+        else:
+            self.retriever = TopKRetriever(k=10)
+            self.candidate_retriever = TopKRetriever(k=PROXIMITY_CANDIDATES)
+
+        # If proximity is set and the index has positions, documents where
+        # the query words are close together are moved up (see
+        # proximity_rerank). Quoted phrases also need the positions.
+        self.proximity = proximity
 
         self.stop_words = set(stopwords.words('english'))
-        self.cached_words = cached_words
+        # Decoded postings of popular words are kept in the posting cache
+        self.posting_cache = posting_cache
+
+        # The top 10 of recent queries are kept in the result cache (if one
+        # is given). Its entries are only used for this generation of the
+        # index (the last_run timestamp).
+        self.result_cache = result_cache
+        self.generation = file_handler.get_last_run()
+        if result_cache is not None:
+            result_cache.set_generation(self.generation)
 
+    def open_segments(self):
+        """
+        Opens the segments again after the manifest changed (new segment,
+        deletions or compaction). Cached postings are from the old segments,
+        so the posting cache is cleared, and cached results are dropped once
+        the last_run timestamp of the index changed.
+        """
+        self.segments.close()
+        self.segments = SegmentSet(self.file_handler, self.segment_list)
+        self.posting_cache.clear()
+
+        self.generation = self.file_handler.get_last_run()
+        if self.result_cache is not None:
+            self.result_cache.set_generation(self.generation)
 
     def get_query(self):
         query = input("\nPlease enter the query: ")
 
         # As soon as the query is recieved, get the timestamp
         start_time = datetime.now()
-        self.query_tokens = self.indexer.tokenize(query)
+        with METRICS.span('query.tokenize'):
+            self.query_tokens = self.indexer.tokenize(query)
+            self.query_phrases = self.get_phrases(query)
 
         # Removes stop words if it is less than 80% of the query
         # filtered_tokens = [t for t in self.query_tokens if t not in self.stop_words]
@@ -41,119 +116,447 @@ class Query:
         """
         # Check if the tokens list is empty. If it is, don't continue.
         if self.query_tokens:
-            # Gets the frequencies of the tokens in the query
-            token_freq = self.indexer.compute_word_frequencies(self.query_tokens)
-
-            # Gets all the tf-idf scores for each word in the query
-            query_scores = dict()
-            # Gets all the tf-idf scores for each word for each document.
-            # The format is {doc_id: {token: score}}
-            document_term_scores = dict()
-            # Gets the square root of the sum of squares of the query's scores
-            normalizer = 0
-
-            # Loop through each token in the query
-            for token, tf in token_freq.items():
-                try:
-
-                    # Check if the word is already cached. If so, load that word
-                    if token in self.cached_words:
-                        token_posting = self.cached_words[token]
-
-                    # Look for the word in the index if the word is not already cached.
-                    else:
-                        # Get the postings for the token from the index
-                        fp = self.fp_dict[token]
-                        self.final_index.seek(fp)
-                        token_posting = Query.fast_eval(self.final_index.readline())[1]
-
-                    # Get the scores and put them into document_term_scores
-                    for doc_id, score in token_posting.items():
-                        if doc_id not in document_term_scores:
-                            document_term_scores[doc_id] = dict()
-                        document_term_scores[doc_id][token] = score
-
-                    # get the log tf score multiplied by the idf
-                    query_scores[token] = (1 + math.log(tf)) * math.log(len(self.doc_id_dict) / len(token_posting))
-                    # Add the square of that to normalizer
-                    normalizer += query_scores[token] * query_scores[token]
-
-                # If the token doesn't exist, ignore it
-                except KeyError:
+            # If the token doesn't exist, it is ignored
+            for token in dict.fromkeys(self.query_tokens):
+                if token not in self.segments:
                     print(f'No token {token} found.')
+            if self.query_phrases and not self.segments.has_positions:
+                print('The index has no positions, so phrases are searched as words.')
+
+            # The posting's format is: [(doc id, final score, how many query
+            # terms it has)]
+            self.posting = self.top_documents(self.query_tokens, phrases=self.query_phrases)
 
-            # Square root the sum of squares to get the final normalizer
-            normalizer = math.sqrt(normalizer)
+    def get_phrases(self, query: str) -> [[str]]:
+        """
+        Returns the tokens of every quoted phrase of the query with more than
+        one word, i.e. [['machin', 'learn']] for "machine learning" robots.
+        """
+        phrases = []
+        for text in PHRASE.findall(query):
+            tokens = self.indexer.tokenize(text)
+            if len(tokens) > 1:
+                phrases.append(tokens)
+        return phrases
+
+    def search(self, query: str, deadline=None) -> [(int, str, float)]:
+        """
+        Searches a query string and returns the top 10 documents as
+        [(doc id, url, final score)], best first. Only documents that have
+        the quoted phrases of the query are returned.
+
+        Unlike get_query / process_query / get_result, nothing is kept on the
+        instance, so many threads can search at the same time (as long as the
+        segments don't change while they do). If deadline (a time.monotonic()
+        time) is given, TimeoutError is raised once it is passed.
+        """
+        with METRICS.span('query.tokenize'):
+            tokens = self.indexer.tokenize(query)
+            phrases = self.get_phrases(query)
+        if not tokens:
+            return []
+
+        return [(doc_id, self.segments.url(doc_id), score)
+                for doc_id, score, count in self.top_documents(tokens, deadline, phrases)]
+
+    def top_documents(self, tokens: [str], deadline=None, phrases=()) -> [(int, float, int)]:
+        """
+        Returns the top 10 documents of the query tokens (that have every
+        phrase of phrases) as [(doc id, final score, how many query terms it
+        has)], from the result cache if the same words were searched before.
+        """
+        # Gets the frequencies of the tokens in the query
+        token_freq = self.indexer.compute_word_frequencies(tokens)
+        METRICS.count('query.searches')
+
+        # Phrases can only be matched with positions, otherwise they are
+        # just words of the query
+        if not self.segments.has_positions:
+            phrases = ()
+
+        if self.result_cache is None:
+            return self.rank(*self.score_query(token_freq), deadline, phrases)
+
+        key = self.result_cache.key(token_freq, phrases)
+        results = self.result_cache.get(key)
+        if results is not None:
+            METRICS.count('query.result_cache_hits')
+        else:
+            generation = self.generation
+            results = self.rank(*self.score_query(token_freq), deadline, phrases)
+            self.result_cache.put(key, results, generation)
+        return results
 
-            # Normalizes the query scores by dividing it by the square root of
-            # the sum of squares
+    def score_query(self, token_freq: {str: int}) -> ({str: float}, dict):
+        """
+        Computes the normalized ltc score of every word of the query that is
+        in the index. Returns the scores and the lexicon entry of each of
+        those words: (entries of the segments, document frequency, highest
+        score, highest importance score, 0 if it has a tier or -1).
+
+        The words are scored in alphabetical order, so the scores are added
+        up in the same order (and come out exactly the same) whatever the
+        order of the words in the query is.
+        """
+        # Gets all the tf-idf scores for each word in the query
+        query_scores = dict()
+        entries = dict()
+        # Gets the square root of the sum of squares of the query's scores
+        normalizer = 0
+
+        # Loop through each token in the query
+        for token, tf in sorted(token_freq.items()):
+            with METRICS.span('query.lexicon'):
+                entry = self.segments.get(token)
+            if entry is None:
+                continue
+            entries[token] = entry
+
+            # get the log tf score multiplied by the idf
+            query_scores[token] = (1 + math.log(tf)) * math.log(len(self.segments) / entry[1])
+            # Add the square of that to normalizer
+            normalizer += query_scores[token] * query_scores[token]
+
+        # Square root the sum of squares to get the final normalizer
+        normalizer = math.sqrt(normalizer)
+
+        # Normalizes the query scores by dividing it by the square root of
+        # the sum of squares (unless every word is in every document)
+        if normalizer > 0:
             for token in query_scores.keys():
                 query_scores[token] = query_scores[token] / normalizer
 
-            # Loops from the number of query terms to 0 (for soft conjunction
-            # check)
-            for i in range(len(query_scores), 0, -1):
-                # Loops through each document in document_term_scores
-                for doc_id, term_scores in document_term_scores.items():
-                    # This is the score that decides the rank
-                    final_score = 0.0
-
-                    # Only gets documents that have the same number of query
-                    # terms as i (for soft conjunction check)
-                    if len(term_scores) == i:
-                        # Add all the query scores multiplied by their
-                        # respective document scores (lnc.ltc)
-                        for token, score in query_scores.items():
-                            try:
-                                final_score += (score * term_scores[token][0])
-                                final_score += term_scores[token][1]
-                            # If the query term doesn't exist in the document,
-                            # ignore it.
-                            except KeyError:
-                                pass
-                        # Adds the result to the final posting. The posting's
-                        # format is: {doc id: (final score, how many query
-                        # terms it has)}
-                        self.posting[doc_id] = (final_score, len(term_scores))
-
-                # If there are more than 10 documents found, end. Otherwise,
-                # check for documents that have 1 fewer query term and repeat.
-                # (for soft conjunction check).
-                if len(self.posting) >= 10:
+        return query_scores, entries
+
+    def rank(self, query_scores, entries, deadline=None, phrases=()) -> [(int, float, int)]:
+        """
+        Gets the top 10 documents, prioritizing docs containing the most
+        query terms, then cosine similarity plus importance, as
+        [(doc id, final score, how many query terms it has)].
+        """
+        # The tiers are only used if a word of the query has one
+        has_tiers = (self.use_tiers and not self.vectorized
+                     and any(entry[4] >= 0 for entry in entries.values()))
+
+        # With proximity, the best PROXIMITY_CANDIDATES documents are found
+        # and reranked by how close together their query words are
+        words = sum(1 for token in query_scores if token in entries)
+        proximity = self.proximity and words > 1 and self.segments.has_positions
+
+        results = self.retrieve(query_scores, entries, has_tiers, deadline, phrases, proximity)
+        if proximity:
+            with METRICS.span('query.proximity'):
+                results = self.proximity_rerank(results, entries, deadline)
+        return results
+
+    def retrieve(self, query_scores, entries, tiers, deadline=None, phrases=(), proximity=False):
+        """
+        Returns the top 10 documents (the top PROXIMITY_CANDIDATES if
+        proximity is set) for the normalized query scores as
+        [(doc id, final score, how many query terms it has)], best first.
+
+        If tiers is set, the candidates are found in the tiers first (see
+        retrieve_tiers), and the full postings are only searched if the
+        tiers can't tell the top 10 apart. If there are phrases, only the
+        documents that have every phrase are scored.
+        """
+        only = None
+        if phrases:
+            with METRICS.span('query.phrases'):
+                only = self.match_phrases(phrases, entries, deadline)
+
+        retriever = self.candidate_retriever if proximity else self.retriever
+
+        results = None
+        if tiers:
+            with METRICS.span('query.tiers'):
+                results = self.retrieve_tiers(query_scores, entries, retriever.k, deadline, only)
+            METRICS.count('query.tier_hits' if results is not None else 'query.tier_misses')
+
+        if results is None:
+            cursors = self.get_cursors(query_scores, entries, False, deadline, only)
+            # Scoring and keeping the top 10 (the MaxScore loop does both at
+            # once)
+            with METRICS.span('query.score'):
+                results = retriever.retrieve(cursors, deadline)
+        return results
+
+    def retrieve_tiers(self, query_scores, entries, k, deadline=None, only=None):
+        """
+        Returns the top k documents found through the tiers, exactly as the
+        full postings would rank them, or None if the tiers can't prove it.
+
+        A tier holds the documents with the highest score plus importance of
+        a long posting, so a document that isn't in the tier of a word gets
+        at most the lowest score plus importance of the tier from that word
+        (see tier_bound). The candidates are the documents in the postings
+        (tiers for the words that have one), and each gets a lower bound
+        (what it has in those postings) and an upper bound (plus the tier
+        bound of every tier it isn't in). A document that isn't a candidate
+        can only have the words with tiers, with at most their tier bounds.
+        If k candidates have a lower bound better than that, the top k are
+        all candidates: those that can still reach the k-th lower bound are
+        scored exactly with the full postings (in query term order, like
+        the retrievers, so the scores are exactly the same). Only the blocks
+        of the full postings that hold those candidates are decoded (see
+        find_postings), so the full postings of the words with tiers are
+        never decoded whole.
+        """
+        # bounds[doc id] is [terms, score, terms with a tier, their bounds]
+        # of a candidate
+        bounds = dict()
+        # The best (terms, score) a document that isn't a candidate can get
+        outside_count = 0
+        outside_score = 0.0
+        # The postings of the words, in query term order
+        postings = []
+
+        for token, weight in query_scores.items():
+            entry = entries.get(token)
+            if entry is None:
+                continue
+
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError('query timed out')
+
+            tier = entry[4] >= 0
+            with METRICS.span('query.postings'):
+                doc_ids, scores, importances = self.get_posting(token, entry, tier)
+
+            bound = 0.0
+            if tier:
+                # Scores are normalized, so weight is at most 1
+                bound = max(weight, 1.0) * self.tier_bound(entry, doc_ids, scores, importances)
+                bound = min(bound, weight * entry[2] + entry[3]) * BOUND_SLACK
+                outside_count += 1
+                outside_score += bound
+            postings.append((token, entry, weight))
+
+            for i, doc_id in enumerate(doc_ids):
+                if only is not None and doc_id not in only:
+                    continue
+                candidate = bounds.get(doc_id)
+                if candidate is None:
+                    candidate = bounds[doc_id] = [0, 0.0, 0, 0.0]
+                candidate[0] += 1
+                candidate[1] += weight * scores[i] + importances[i]
+                if tier:
+                    candidate[2] += 1
+                    candidate[3] += bound
+
+        # The k-th best lower bound has to beat every document that isn't a
+        # candidate (lower bounds are a little smaller than the exact sums
+        # at most, BOUND_SLACK covers that)
+        lower = sorted(((count, score) for count, score, _, _ in bounds.values()), reverse=True)
+        if len(lower) < k or lower[k - 1] <= (outside_count, outside_score):
+            return None
+        threshold = (lower[k - 1][0], lower[k - 1][1] / BOUND_SLACK)
+
+        # The candidates that can still be in the top k
+        candidates = sorted(
+            doc_id for doc_id, (count, score, tier_count, tier_score) in bounds.items()
+            if (count + outside_count - tier_count, score + outside_score - tier_score) >= threshold)
+
+        # are scored exactly with the full postings, one word at a time
+        exact = {doc_id: [0, 0.0] for doc_id in candidates}
+        for token, entry, weight in postings:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError('query timed out')
+
+            for doc_id, (score, importance) in self.find_postings(token, entry, candidates).items():
+                result = exact[doc_id]
+                result[0] += 1
+                result[1] += weight * score
+                result[1] += importance
+        results = [(doc_id, score, count) for doc_id, (count, score) in exact.items()]
+
+        # Same order as TopKRetriever: most query terms, then score, then the
+        # smallest doc id
+        results.sort(key=lambda result: (result[2], result[1], -result[0]), reverse=True)
+        return results[:k]
+
+    def tier_bound(self, entry, doc_ids, scores, importances) -> float:
+        """
+        Returns the most score plus importance a document that isn't in the
+        tier of a word (doc_ids, scores and importances) can have: the
+        lowest one in the tier of each segment, and the highest of those.
+        Segments without a tier of the word have the full posting in it.
+        """
+        bound = 0.0
+        for segment, segment_entry in entry[0]:
+            if segment_entry[4] < 0:
+                continue
+            start = bisect_left(doc_ids, segment.first_doc_id)
+            end = bisect_left(doc_ids, segment.first_doc_id + len(segment))
+            # Every document of the tier is deleted
+            if start == end:
+                return entry[2] + entry[3]
+            bound = max(bound, min(scores[i] + importances[i] for i in range(start, end)))
+        return bound
+
+    def match_phrases(self, phrases: [[str]], entries, deadline=None) -> set:
+        """
+        Returns the doc ids of the documents that have every phrase.
+
+        The candidates are the documents with every word of the phrases (an
+        intersection of the full postings, from the cache if they are
+        there). Positions are then only read for the candidates.
+        """
+        matches = None
+        for phrase in phrases:
+            words = list(dict.fromkeys(phrase))
+            if any(word not in entries for word in words):
+                return set()
+
+            # The shortest postings first, so the set stays small
+            postings = sorted((self.get_posting(word, entries[word], False)[0] for word in words),
+                              key=len)
+            candidates = set(postings[0]) if matches is None else matches.intersection(postings[0])
+            for doc_ids in postings[1:]:
+                if not candidates:
                     break
+                candidates.intersection_update(doc_ids)
+
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError('query timed out')
+
+            positions = {word: self.segments.read_positions(entries[word], candidates)
+                         for word in words}
+            matches = {doc_id for doc_id in candidates
+                       if has_phrase([positions[word][doc_id] for word in phrase])}
+            if not matches:
+                break
+
+        return matches
+
+    def proximity_rerank(self, results, entries, deadline=None) -> [(int, float, int)]:
+        """
+        Adds the proximity boost (see PROXIMITY_WEIGHT) to the score of each
+        result with more than one query word, sorts the results again and
+        returns the top 10. Only the positions of the results are read.
+        """
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError('query timed out')
+
+        candidates = [doc_id for doc_id, score, count in results if count > 1]
+        positions = [self.segments.read_positions(entry, candidates) for entry in entries.values()]
+
+        reranked = []
+        for doc_id, score, count in results:
+            if count > 1:
+                position_lists = [word_positions[doc_id] for word_positions in positions
+                                  if doc_id in word_positions]
+                words = len(position_lists)
+                score += PROXIMITY_WEIGHT * (words - 1) / (min_window(position_lists) - words + 1)
+            reranked.append((doc_id, score, count))
+
+        # Same order as TopKRetriever: most query terms, then score, then the
+        # smallest doc id
+        reranked.sort(key=lambda result: (result[2], result[1], -result[0]), reverse=True)
+        return reranked[:self.retriever.k]
+
+    def get_cursors(self, query_scores, entries, tiers, deadline=None, only=None):
+        """
+        Makes a cursor over the posting of each word of the query. If tiers
+        is set, the high-impact tier is used for words that have one. The
+        order of the words is kept so the scores are added up the same way.
+        Words without an entry (not in these segments) are skipped. If only
+        (a set of doc ids) is given, the postings only keep those documents.
+        """
+        cursors = []
+
+        for order, (token, score) in enumerate(query_scores.items()):
+            entry = entries.get(token)
+            if entry is None:
+                continue
+
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError('query timed out')
+
+            with METRICS.span('query.postings'):
+                doc_ids, scores, importances = self.get_posting(token, entry, tiers)
+            if only is not None:
+                doc_ids, scores, importances = self.restrict_posting(doc_ids, scores, importances, only)
+
+            cursors.append(PostingCursor(order, doc_ids, scores, importances,
+                                         score, entry[2], entry[3]))
+
+        return cursors
+
+    def restrict_posting(self, doc_ids, scores, importances, only) -> (array, array, array):
+        """
+        Returns the part of a posting whose documents are in only.
+        """
+        restricted = (array('I'), array('d'), array('B'))
+        for i, doc_id in enumerate(doc_ids):
+            if doc_id in only:
+                restricted[0].append(doc_id)
+                restricted[1].append(scores[i])
+                restricted[2].append(importances[i])
+        return restricted
+
+    def get_posting(self, token, entry, tiers):
+        """
+        Returns the posting of a token as arrays of doc ids, scores and
+        importance scores. If tiers is set and the token has a tier, the tier
+        is returned instead of the full posting.
+        """
+        tier = tiers and entry[4] >= 0
+
+        # Check if the word is already cached. If so, load that word
+        posting = self.posting_cache.get((token, tier))
+        if posting is not None:
+            return posting
+
+        # Look for the word in the index if the word is not already cached.
+        # Decoding is timed on its own since it is the part that reads the
+        # disk.
+        with METRICS.span('query.decode'):
+            posting = self.read_posting(entry, tier)
+        METRICS.count('query.postings_decoded', len(posting[0]))
+        self.posting_cache.put((token, tier), posting)
+        return posting
+
+    def find_postings(self, token, entry, doc_ids) -> {int: (float, int)}:
+        """
+        Returns the score and importance of a token in every document of
+        doc_ids (in order) that has it. If the full posting is cached, it is
+        searched there. Otherwise only the blocks of the full posting that
+        could hold those documents are decoded.
+        """
+        posting = self.posting_cache.get((token, False))
+        if posting is not None:
+            posting_doc_ids, scores, importances = posting
+            found = dict()
+            for doc_id in doc_ids:
+                i = bisect_left(posting_doc_ids, doc_id)
+                if i < len(posting_doc_ids) and posting_doc_ids[i] == doc_id:
+                    found[doc_id] = (scores[i], importances[i])
+            return found
+
+        with METRICS.span('query.decode'):
+            found, decoded = self.segments.find_postings(entry, doc_ids)
+        METRICS.count('query.postings_decoded', decoded)
+        return found
+
+    def read_posting(self, entry, tier):
+        """
+        Decodes the posting (or the tier, if tier is set) of a lexicon entry
+        from the segments, without going through the cache.
+        """
+        return self.segments.read_posting(entry, tier)
 
     def get_result(self):
         if self.posting:
-            # prioritize docs containing the most query terms, then prioritize importance, then cosine similarity
-            sorted_tup = sorted(self.posting.items(),
-                                key=lambda item: (item[1][1], item[1][0]), reverse=True)
-
+            # The results are already sorted (most query terms first, then
+            # cosine similarity plus importance)
             print('\n\n===== Top 10 Results =====\n\n')
-            for i in range(10):
-                try:
-                    found_doc_id = sorted_tup[i][0]
-                    # print the url of the found doc id
-                    # print(self.doc_id_dict[str(found_doc_id)], found_doc_id, sorted_tup[i][1])
-                    print(self.doc_id_dict[str(found_doc_id)])
-
-                except IndexError:
-                    break
+            for found_doc_id, score, count in self.posting[:10]:
+                # print the url of the found doc id
+                # print(self.segments.url(found_doc_id), found_doc_id, score)
+                print(self.segments.url(found_doc_id))
 
-            self.posting.clear()
+            self.posting = []
 
         else:
             print('No results found')
-
-    @staticmethod
-    def fast_eval(line):
-        # fast_eval is tailored specifically to the index so it is faster than
-        # the normal eval function
-        new_str = re.sub("'|,|{|:|}|\(|\)", "", line.strip())
-        str_list = new_str.split()
-        token = str_list[0]
-        scores_dict = dict()
-        for i in range(1, len(str_list), 3):
-            scores_dict[int(str_list[i])] = (float(str_list[i + 1]), int(str_list[i + 2]))
-
-        return (token, scores_dict)
-
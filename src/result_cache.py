@@ -0,0 +1,117 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+
+# Bytes used by a cache entry besides its words and results (key, list and
+# tuple objects)
+ENTRY_OVERHEAD = 300
+# Bytes used by one result (doc id, score, number of query terms)
+RESULT_SIZE = 120
+
+
+class ResultCache:
+    """
+    Keeps the top 10 results of recent queries, up to max_bytes.
+
+    The key of a query is the multiset of its stemmed words (the
+    word -> frequency map of Indexer.compute_word_frequencies) and its
+    quoted phrases, so queries that tokenize the same (i.e. machine learning
+    and learning machines) share an entry. Entries are evicted least recently used first.
+
+    The results are only right for the index they were computed from, so
+    every entry belongs to a generation of the index (the last_run
+    timestamp, which changes whenever the index is built or its segments
+    change). Changing the generation empties the cache.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+
+        # key: frozenset of (word, frequency), element: (results, size in bytes)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.generation = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Shared by every search thread
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(token_freq: {str: int}, phrases=()) -> frozenset:
+        # Quoted phrases only keep the documents that have them, so they are
+        # part of the key too, as ('"word word"', 0). Words never have quotes
+        # or a frequency of 0.
+        return frozenset(itertools.chain(
+            token_freq.items(), (('"' + ' '.join(phrase) + '"', 0) for phrase in phrases)))
+
+    def set_generation(self, generation: str) -> None:
+        """
+        Empties the cache if the index changed since the entries were added.
+        """
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.nbytes = 0
+                self.generation = generation
+
+    def get(self, key):
+        """
+        Returns the cached results of key, or None if they aren't cached.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, results, generation: str) -> None:
+        """
+        Adds the results of a query, unless they were computed from another
+        generation of the index than the cache holds.
+        """
+        nbytes = (ENTRY_OVERHEAD + sum(len(token) for token, _ in key)
+                  + len(results) * RESULT_SIZE)
+
+        with self.lock:
+            if generation != self.generation or key in self.entries or nbytes > self.max_bytes:
+                return
+
+            while self.nbytes + nbytes > self.max_bytes:
+                _, (_, freed) = self.entries.popitem(last=False)
+                self.nbytes -= freed
+                self.evictions += 1
+
+            self.entries[key] = (results, nbytes)
+            self.nbytes += nbytes
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the hit rate and size of the cache.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,96 +1,608 @@
+import os
+import sys
+import bisect
+import shutil
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Type
+from urllib.parse import urldefrag
 
 from indexer import Indexer
 from file_handler import FileHandler
 from query import Query
+from shards import ShardedQuery
+from posting_cache import PostingCache
+from result_cache import ResultCache
+from segments import Segment, SegmentSet, Tombstones, load_manifest, save_manifest
+from near_duplicates import NearDuplicateDetector, write_fingerprints
+from checkpoint import BuildCheckpoint
+from metrics import METRICS, profile, summarize_trace
 
 from nltk.corpus import stopwords
+from readerwriterlock import rwlock
 
 
 class SearchEngine:
     """
     If need to reindex, please change the 
     status to False in "index_status.log" file
+
+    New crawl batches don't need a full rebuild: add_documents indexes them
+    into a new segment, delete_documents marks documents as deleted, and
+    once there are more than max_segments segments they are compacted into
+    one in the background.
+
+    With shards > 1, the index is split by doc id range into that many
+    segments and every query is run on each of them in its own process
+    (see ShardedQuery).
+
+    With vectorized set, queries are scored with NumPy (see
+    VectorTopKRetriever) instead of the MaxScore loop. The results are the
+    same.
+
+    Every stage of builds and queries is timed (see Metrics). The times of
+    the last build are saved to ./db/build_metrics.json, and search() prints
+    where the time of each query went.
+
+    The top 10 of recent queries are kept in a result cache of
+    result_cache_size bytes (see ResultCache). It is emptied whenever the
+    index changes.
+
+    With positions set, new segments also record where every word is in
+    each document, so queries can have quoted phrases ("machine learning")
+    and documents whose query words are close together rank higher. An
+    index built without positions has to be rebuilt to get them.
+
+    Near-duplicates (mirrored pages, the same page under other urls or with
+    a different date or counter) are dropped while indexing, unless
+    near_duplicates is False: only the first document of each group is
+    kept, also across crawl batches (see Indexer.find_duplicates). The ones
+    dropped are listed in duplicates.json of their segment.
     """
 
-    def __init__(self):
+    def __init__(self, corpus='./DEV', cache_size=256 * 1024 * 1024, query_log=None,
+                 max_segments=8, shards=1, vectorized=False, result_cache_size=16 * 1024 * 1024,
+                 profile=False, positions=False, near_duplicates=True):
+        # The corpus to index. It can be a folder or an archive of the
+        # corpus (i.e. DEV.zip, DEV.tar.gz or a JSONL bundle).
+        self.corpus = corpus
+
         # Make an instance of file handler
         self.file_handler = FileHandler()
-        # Make an instance of indexer
-        self.indexer = Indexer(self.file_handler, file_count_offset=10000)
+        # Make an instance of indexer. Parsing and tokenizing is spread over
+        # every core of the machine. If positions is set, it records the
+        # positions of the words for phrase and proximity queries. If
+        # near_duplicates is set, it fingerprints every document to find
+        # the near-duplicates.
+        self.indexer = Indexer(self.file_handler, memory_budget=1024 * 1024 * 1024,
+                               workers=os.cpu_count(), positions=positions,
+                               near_duplicates=near_duplicates)
+
+        # Searches hold lock as readers, so they run at the same time.
+        # Deletions and changes of the segments hold it as the writer. Adding
+        # a batch and compacting hold build_lock, so only one of them runs at
+        # a time (they take lock only to switch to the new segments).
+        # Writers go first: once one is waiting, new searches wait too, so a
+        # steady stream of searches can't keep it out forever.
+        self.lock = rwlock.RWLockWrite()
+        self.build_lock = threading.Lock()
+        self.max_segments = max_segments
+        self.compaction = None
+        self.shards = shards
+
+        # If profile is set, every query of search() is run under cProfile
+        # and the slowest functions are printed
+        self.profile = profile
+
+        # The fingerprints of the documents of the index, kept between
+        # crawl batches so they are only read from the segments once (see
+        # find_near_duplicates). It is built again after a compaction.
+        self.detector = None
 
         # Check if the indexing is completed. If not, index the documents
         if not self.file_handler.get_index_status():
             self.index()
 
-        # Open files 
-        self.fp_dict = self.file_handler.load_json('./db/fp_locations.json')
-        self.doc_id_dict = self.file_handler.load_json('./db/doc_id.json')
-        self.final_index = open('./db/index.txt')
+        # The posting cache is added to the query instance to check during
+        # query time. It can hold cache_size bytes of postings.
+        self.posting_cache = PostingCache(max_bytes=cache_size)
+        # The results of recent queries are kept in the result cache, up to
+        # result_cache_size bytes
+        self.result_cache = ResultCache(max_bytes=result_cache_size)
+        if shards > 1:
+            # Every shard process gets its share of the cache
+            self.query = ShardedQuery(self.file_handler, self.indexer, self.posting_cache,
+                                      shards, cache_size // shards, vectorized=vectorized,
+                                      result_cache=self.result_cache)
+
+            # Splits the index into shards if it has fewer segments
+            if len(self.query.segments.segments) < shards:
+                self.compact()
+            return
+
+        self.query = Query(self.file_handler, self.indexer, self.posting_cache,
+                           vectorized=vectorized, result_cache=self.result_cache)
 
-        cached_words = self.cache_stop_words()
-        # Cached words are added to the query instance to check during query time
-        self.query = Query(self.file_handler, self.indexer, cached_words)
+        # Loads the cache snapshot of this index if there is one. Otherwise
+        # (or if a query log is given) the cache is warmed up from the index
+        # and a new snapshot is saved for the next start.
+        generation = self.file_handler.get_last_run()
+        if query_log is not None or not self.posting_cache.load('./db/warm_cache.bin', generation):
+            self.warm_up_cache(query_log)
+            self.save_cache_snapshot()
 
+    def warm_up_cache(self, query_log=None):
+        """
+        Fills the posting cache before the first query. If a query log (one
+        query per line) is given, the words that are the most common in it
+        are loaded first. The stop words are loaded after that, since they
+        are in most queries.
+        """
+        words = []
 
-    def cache_stop_words(self):
-        cached_words = {}
-        stop_words = set(stopwords.words('english'))
+        if query_log is not None:
+            with open(query_log, 'r') as log:
+                frequencies = dict()
+                for line in log:
+                    for token in self.indexer.tokenize(line):
+                        frequencies[token] = frequencies.get(token, 0) + 1
 
-        # For every index, cache the stop words
-        for line in self.final_index:
-            index = Query.fast_eval(line)
+            words = sorted(frequencies, key=frequencies.get, reverse=True)
 
-            if index[0] in stop_words:
-                cached_words[index[0]] = index[1]
+        words += sorted(set(stopwords.words('english')) - set(words))
 
-        return cached_words
+        for word in words:
+            entry = self.query.segments.get(word)
+            if entry is not None:
+                tier = self.query.use_tiers and entry[4] >= 0
+                self.posting_cache.put((word, tier), self.query.read_posting(entry, tier))
 
+            # Stops when the cache is full
+            if self.posting_cache.nbytes >= self.posting_cache.max_bytes * 0.9:
+                break
+
+
+    def save_cache_snapshot(self):
+        """
+        Saves the postings in the cache so the next search engine process
+        starts with them. Can be called again later so the snapshot follows
+        the words that are actually searched.
+        """
+        self.posting_cache.save('./db/warm_cache.bin', self.file_handler.get_last_run())
 
     def index(self):
+        """
+        Rebuilds the whole index from the corpus into a single segment. If a
+        rebuild was stopped, it goes on from its last checkpoint.
+        """
         start_time = datetime.now()
+        # Update current status
+        self.file_handler.set_index_status(False, start_time)
+        # The documents of the old index don't count for the rebuild
+        self.detector = None
 
-        # Index the webpages into partial indexes
-        self.indexer.index('./DEV', restart=True)
-        # Merge partial indexes to one single index
-        self.indexer.merge_indexes('./db')
-        # Calculate the tf_idf scores for each index
-        normalizer = self.indexer.calculate_tf_idf(
-            './db/index.txt', './db/index_tf_idf.txt', self.file_handler.count_number_of_line('./db/index.txt'))
-        # Normalize the tf_idf scores
-        self.indexer.normalize_tf_idf(
-            './db/index_tf_idf.txt', './db/index.txt', normalizer)
-        # Get file pointer locations for each index
-        self.indexer.get_fp_locations(
-            './db/index.txt', './db/fp_locations.json')
+        # The doc ids start from 1 again in the first segment
+        manifest = {'next_doc_id': 1, 'next_segment': 0, 'segments': []}
+        manifest = self.build_segment(self.corpus, manifest, restart=True)
+        save_manifest(self.file_handler, manifest)
+        BuildCheckpoint(self.file_handler).remove()
+
+        # The detector was made while the index had no segments, so it is
+        # built again (with the new segment) at the next crawl batch
+        self.detector = None
 
         end_time = datetime.now()
+        # Set index status to True
+        self.file_handler.set_index_status(True, end_time)
         process_time = end_time - start_time
 
+        # Saves the time of every stage of the build
+        with open('./db/build_metrics.json', 'w') as f:
+            f.write(METRICS.to_json())
+        for stage, seconds in METRICS.summary('build.').items():
+            print(f'{stage}: {seconds:.2f} s')
+
         print("\nStart Time : {}\nEnd Time : {}\nTime elapsed : {}\n".format(
             start_time, end_time, process_time))
 
+    def build_segment(self, source, manifest, restart=False):
+        """
+        Indexes source into a new segment and adds it to the manifest (the
+        manifest isn't saved). Nothing is added if source has no new
+        documents.
+
+        A checkpoint is saved after every partial index, after the merge and
+        after the segment is written. If the last build of the same source
+        into the same segment was stopped, it goes on from its checkpoint and
+        makes the same segment. Otherwise, if restart is set, the old
+        segments and files are removed first. The caller removes the
+        checkpoint once the manifest is saved.
+        """
+        name = f'seg_{manifest["next_segment"]}'
+        folder = './db/' + name
+        first_doc_id = manifest['next_doc_id']
+
+        checkpoint = BuildCheckpoint(self.file_handler)
+        if checkpoint.load() and checkpoint.matches(source, name, first_doc_id):
+            print(f'Resuming the build of {name} from the {checkpoint.state["stage"]} stage')
+        else:
+            if restart:
+                self.file_handler.remove_segments()
+                self.file_handler.clear_files()
+            self.file_handler.remove_partial_indexes()
+            checkpoint.start(source, name, first_doc_id)
+
+        stage = checkpoint.state['stage']
+
+        if stage == 'index':
+            # Index the webpages into partial indexes
+            with METRICS.span('build.index'):
+                self.indexer.index(source, checkpoint=checkpoint)
+            if checkpoint.state['doc_id'] == first_doc_id:
+                self.file_handler.remove_partial_indexes()
+                return manifest
+
+            # Find the near-duplicates of this batch, among its own
+            # documents and the ones already in the index
+            duplicates = dict()
+            if self.indexer.near_duplicates:
+                with METRICS.span('build.near_duplicates'):
+                    duplicates = self.find_near_duplicates(manifest)
+
+            # Merge partial indexes to one single index (without the
+            # near-duplicates) and get the length of every document
+            with METRICS.span('build.merge'):
+                normalizer = self.indexer.merge_indexes('./db', './db/index_merged.bin', duplicates)
+            checkpoint.merge_done(normalizer, duplicates, ['./db/index_merged.bin'])
+            self.file_handler.remove_partial_indexes()
+        elif stage == 'merged':
+            normalizer = checkpoint.read_doc_lengths()
+            duplicates = checkpoint.read_duplicates()
+
+        if stage != 'finalized':
+            self.indexer.doc_id = checkpoint.state['doc_id']
+            self.indexer.urls = checkpoint.read_urls()
+            fingerprints = checkpoint.read_fingerprints()
+            urls = list(self.indexer.urls)
+
+            # Calculate and normalize the tf_idf scores for each index and get
+            # file pointer locations for each index
+            if os.path.isdir(folder):
+                shutil.rmtree(folder)
+            os.mkdir(folder)
+            with METRICS.span('build.finalize'):
+                self.indexer.finalize_index(
+                    './db/index_merged.bin', folder + '/index.bin', folder + '/tier.bin',
+                    folder + '/lexicon.bin', folder + '/doc_table.bin', normalizer,
+                    folder + '/positions.bin')
+            if self.indexer.near_duplicates:
+                write_fingerprints(folder + '/fingerprints.bin', fingerprints)
+            if duplicates:
+                self.save_duplicates(folder, first_doc_id, urls, duplicates, manifest)
+                print(f'Dropped {len(duplicates)} near-duplicate documents')
+            checkpoint.finalize_done([folder + '/' + file for file in os.listdir(folder)])
+            self.file_handler.remove_merged_index('./db/index_merged.bin')
+
+        manifest['next_doc_id'] = checkpoint.state['doc_id']
+        manifest['next_segment'] += 1
+        manifest['segments'].append({'name': name, 'first_doc_id': first_doc_id})
+        return manifest
+
+    def find_near_duplicates(self, manifest) -> {int: int}:
+        """
+        Returns the near-duplicates of the documents the indexer just
+        indexed, as {doc id: doc id of the document it duplicates}. The
+        documents of the segments of manifest count too, except the deleted
+        ones and the old versions of the new urls (they will be deleted).
+
+        The fingerprints of the segments are read into the detector the first
+        time. After that, add_documents adds the documents of every new
+        segment to it, and deleted documents are skipped when they match.
+        """
+        segments = SegmentSet(self.file_handler, manifest['segments'])
+        try:
+            if self.detector is None:
+                self.detector = NearDuplicateDetector()
+                for doc_id, fingerprint in segments.live_fingerprints():
+                    if fingerprint:
+                        self.detector.add(fingerprint, doc_id)
+
+            old_versions = set(segments.find_urls(self.indexer.urls).values())
+            return self.indexer.find_duplicates(
+                self.detector, lambda doc_id: doc_id in old_versions or segments.is_deleted(doc_id))
+        finally:
+            segments.close()
+
+    def add_to_detector(self, segment) -> None:
+        """
+        Adds the documents of a new segment that are not deleted (not
+        near-duplicates) to the detector, if it is built.
+        """
+        fingerprints = segment.read_fingerprints()
+        if self.detector is None or fingerprints is None:
+            return
+        for n, fingerprint in enumerate(fingerprints):
+            if fingerprint and n not in segment.tombstones:
+                self.detector.add(fingerprint, segment.first_doc_id + n)
+
+    def save_duplicates(self, folder, first_doc_id, urls, duplicates, manifest):
+        """
+        Marks the near-duplicates of the segment in folder as deleted, so
+        they are dropped at the next compaction, and writes duplicates.json:
+        {url of a near-duplicate: url of the document that was kept}.
+        urls are the urls of the segment in doc id order.
+        """
+        tombstones = Tombstones(folder + '/tombstones.bin', len(urls))
+        for doc_id in duplicates:
+            tombstones.add(doc_id - first_doc_id)
+        tombstones.save()
+
+        segments = SegmentSet(self.file_handler, manifest['segments'])
+        try:
+            kept = dict()
+            for doc_id, original in sorted(duplicates.items()):
+                if original >= first_doc_id:
+                    kept[urls[doc_id - first_doc_id]] = urls[original - first_doc_id]
+                else:
+                    kept[urls[doc_id - first_doc_id]] = segments.url(original)
+        finally:
+            segments.close()
+        self.file_handler.dump_json(kept, folder + '/duplicates.json')
+
+    def add_documents(self, source):
+        """
+        Indexes the documents of source (a folder or an archive, like the
+        corpus) into a new segment. If a url is already in the index, the
+        document is a new version of it and the old one is deleted. Starts a
+        compaction in the background if there are too many segments.
+
+        If adding the same source was stopped, it goes on from its last
+        checkpoint.
+
+        Returns the number of documents added (without the near-duplicates
+        that were dropped).
+        """
+        with self.build_lock:
+            manifest = load_manifest(self.file_handler)
+            segments = len(manifest['segments'])
+            first_doc_id = manifest['next_doc_id']
+
+            manifest = self.build_segment(source, manifest)
+            if len(manifest['segments']) == segments:
+                BuildCheckpoint(self.file_handler).remove()
+                return 0
+
+            segment = Segment('./db/' + manifest['segments'][-1]['name'], first_doc_id)
+            urls = list(segment.doc_table.urls())
+            # The only deleted documents of a new segment are its
+            # near-duplicates
+            duplicates = len(segment.tombstones)
+            self.add_to_detector(segment)
+            segment.close()
+
+            with self.lock.gen_wlock():
+                # The old versions of the new documents (the new segment isn't
+                # opened yet, so only older documents are found)
+                old_versions = self.query.segments.find_urls(urls)
+
+                # The manifest is saved before the old versions are deleted:
+                # if it stops in between, both versions are kept instead of
+                # none.
+                save_manifest(self.file_handler, manifest)
+                BuildCheckpoint(self.file_handler).remove()
+                self.query.segments.delete(old_versions.values())
+                self.file_handler.set_index_status(True, datetime.now())
+                self.query.open_segments()
+
+            print(f'Added {len(urls) - duplicates} documents ({len(old_versions)} new versions, '
+                  f'{duplicates} near-duplicates dropped) to {segment.folder}')
+
+        if len(manifest['segments']) > max(self.max_segments, self.shards):
+            self.start_compaction()
+
+        return len(urls) - duplicates
+
+    def delete_documents(self, urls):
+        """
+        Deletes the documents with these urls from the index. They are only
+        marked as deleted (tombstones) until the next compaction.
+
+        Returns the number of documents deleted.
+        """
+        with self.lock.gen_wlock():
+            doc_ids = self.query.segments.find_urls(urldefrag(url)[0] for url in urls)
+            self.query.segments.delete(doc_ids.values())
+            self.file_handler.set_index_status(True, datetime.now())
+            # Cached postings (and shard processes) still have the deleted
+            # documents
+            self.query.open_segments()
+
+        return len(doc_ids)
+
+    def start_compaction(self):
+        """
+        Runs compact in a background thread, unless one is running already.
+        """
+        if self.compaction is None or not self.compaction.is_alive():
+            self.compaction = threading.Thread(target=self.compact, daemon=True)
+            self.compaction.start()
+
+    def compact(self):
+        """
+        Merges every segment into one (or one per shard, split by doc id
+        range) and drops the deleted documents. The doc ids are given again
+        from 1 in the same order, so the new segments are the same as a full
+        rebuild of the documents that are left, without parsing them again.
+        Searches keep using the old segments until the new ones are done.
+        """
+        with self.build_lock:
+            manifest = load_manifest(self.file_handler)
+
+            # Opens its own copy of the segments, so the tombstones of the
+            # documents deleted while compacting can be told apart.
+            segments = [Segment('./db/' + segment['name'], segment['first_doc_id'])
+                        for segment in manifest['segments']]
+            live = sum(len(segment) - len(segment.tombstones) for segment in segments)
+            shards = max(1, min(self.shards, live))
+            if len(segments) == shards and not any(len(segment.tombstones) for segment in segments):
+                for segment in segments:
+                    segment.close()
+                return
+
+            next_segment = manifest['next_segment']
+            names = [f'seg_{next_segment + shard}' for shard in range(shards)]
+            for name in names:
+                os.mkdir('./db/' + name)
+            with METRICS.span('build.compact'):
+                new_ids, first_doc_ids = self.indexer.compact_segments(
+                    segments, 1, ['./db/' + name for name in names])
+            first_doc_ids.append(live + 1)
+
+            # The near-duplicates dropped so far are kept in the first new
+            # segment
+            duplicates = dict()
+            for segment in segments:
+                if os.path.isfile(segment.folder + '/duplicates.json'):
+                    duplicates.update(self.file_handler.load_json(segment.folder + '/duplicates.json'))
+            if duplicates:
+                self.file_handler.dump_json(duplicates, f'./db/{names[0]}/duplicates.json')
+
+            with self.lock.gen_wlock():
+                # Deletes the documents that were deleted while compacting
+                tombstones = [Tombstones(f'./db/{name}/tombstones.bin',
+                                         first_doc_ids[shard + 1] - first_doc_ids[shard])
+                              for shard, name in enumerate(names)]
+                for old, current, ids in zip(segments, self.query.segments.segments, new_ids):
+                    for n in range(len(old)):
+                        if n in current.tombstones and n not in old.tombstones:
+                            shard = bisect.bisect_right(first_doc_ids, ids[n]) - 1
+                            tombstones[shard].add(ids[n] - first_doc_ids[shard])
+                for shard_tombstones in tombstones:
+                    if len(shard_tombstones):
+                        shard_tombstones.save()
+
+                save_manifest(self.file_handler, {
+                    'next_doc_id': live + 1,
+                    'next_segment': next_segment + shards,
+                    'segments': [{'name': name, 'first_doc_id': first_doc_ids[shard]}
+                                 for shard, name in enumerate(names)],
+                })
+                self.file_handler.set_index_status(True, datetime.now())
+                self.query.open_segments()
+
+            # The doc ids changed
+            self.detector = None
+
+            for segment in segments:
+                segment.close()
+                shutil.rmtree(segment.folder)
+
+            print(f'Compacted {len(segments)} segments into {shards} ({live} documents)')
+
+    @contextmanager
+    def read_lock(self, timeout=None):
+        """
+        Holds lock as a reader in a with block. Raises TimeoutError if it
+        can't get it within timeout seconds.
+        """
+        read_lock = self.lock.gen_rlock()
+        # A timeout of -1 waits as long as it takes
+        if not read_lock.acquire(blocking=True, timeout=-1 if timeout is None else timeout):
+            raise TimeoutError('timed out waiting for the index')
+        try:
+            yield
+        finally:
+            read_lock.release()
+
     def search(self):
 
-        # Gets query from the user
-        # Start time is calculated as soon as the query is received.
-        start_time = self.query.get_query()
-        # Process the query
-        self.query.process_query()
-        # Get result of the query
-        result = self.query.get_result()
+        # Every span of the query is traced to show where its time went
+        with METRICS.trace() as spans:
+            # Gets query from the user
+            # Start time is calculated as soon as the query is received.
+            start_time = self.query.get_query()
+            with self.read_lock(), profile(self.profile) as profiled:
+                # Process the query
+                with METRICS.span('query'):
+                    self.query.process_query()
+                # Get result of the query
+                result = self.query.get_result()
 
         end_time = datetime.now()
         process_time = end_time - start_time
 
         print("\nStart Time : {}\nEnd Time : {}\nTime elapsed : {} ms\n".format(
             start_time, end_time, process_time.total_seconds() * 1000))
+        for stage, total in summarize_trace(spans).items():
+            print(f'{stage}: {total["ms"]:.3f} ms ({total["count"]}x)')
+        if self.profile:
+            print(profiled['stats'])
     
+    def find(self, query: str, timeout=None) -> [(int, str, float)]:
+        """
+        Searches a query string and returns the top 10 documents as
+        [(doc id, url, final score)]. Safe to call from many threads at the
+        same time (used by the HTTP API). If timeout is given, TimeoutError is
+        raised once the search took that many seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.read_lock(timeout), METRICS.span('query'):
+            return self.query.search(query, deadline)
+
     def run(self):
         while True:
             self.search()
 
 if __name__ == '__main__':
-    search_engine = SearchEngine()
+    # The corpus can be given as an argument, i.e. python3 src/search_engine.py DEV.zip
+    # A crawl batch can be added to the index with --add, i.e.
+    # python3 src/search_engine.py --add crawl_batch.zip
+    # The index can be searched in shards (one process each) with --shards, i.e.
+    # python3 src/search_engine.py --shards 4
+    # Queries are scored with NumPy with --vectorized
+    # Every query is profiled with cProfile with --profile
+    # Positions are recorded (for phrase and proximity queries) with
+    # --positions
+    # Near-duplicate documents are kept with --keep-duplicates
+    args = sys.argv[1:]
+    batch = None
+    if '--add' in args:
+        i = args.index('--add')
+        batch = args[i + 1]
+        del args[i:i + 2]
+
+    shards = 1
+    if '--shards' in args:
+        i = args.index('--shards')
+        shards = int(args[i + 1])
+        del args[i:i + 2]
+
+    vectorized = '--vectorized' in args
+    if vectorized:
+        args.remove('--vectorized')
+
+    profiling = '--profile' in args
+    if profiling:
+        args.remove('--profile')
+
+    positions = '--positions' in args
+    if positions:
+        args.remove('--positions')
+
+    near_duplicates = '--keep-duplicates' not in args
+    if not near_duplicates:
+        args.remove('--keep-duplicates')
+
+    if args:
+        search_engine = SearchEngine(args[0], shards=shards, vectorized=vectorized,
+                                     profile=profiling, positions=positions,
+                                     near_duplicates=near_duplicates)
+    else:
+        search_engine = SearchEngine(shards=shards, vectorized=vectorized, profile=profiling,
+                                     positions=positions, near_duplicates=near_duplicates)
+
+    if batch is not None:
+        search_engine.add_documents(batch)
     search_engine.run()
\ No newline at end of file
@@ -0,0 +1,307 @@
+import bisect
+import os
+from array import array
+
+from doc_table import DocTable
+from lexicon import Lexicon
+from near_duplicates import read_fingerprints
+from positions import PositionReader
+from posting_file import PostingReader
+
+
+# The manifest lists the segments of the index in doc id order, the next doc
+# id to hand out and the number of the next segment folder.
+MANIFEST = './db/segments.json'
+
+
+def load_manifest(file_handler) -> dict:
+    if not os.path.isfile(MANIFEST):
+        return {'next_doc_id': 1, 'next_segment': 0, 'segments': []}
+    return file_handler.load_json(MANIFEST)
+
+
+def save_manifest(file_handler, manifest: dict) -> None:
+    # The manifest only replaces the old one once it is complete, so a crash
+    # never leaves the index half-changed.
+    file_handler.dump_json(manifest, MANIFEST + '.tmp')
+    os.replace(MANIFEST + '.tmp', MANIFEST)
+
+
+class Tombstones:
+    """
+    The deleted documents of a segment as a bitmap (one bit per document,
+    by position in the segment). The file is only the raw bitmap; it does
+    not exist until a document of the segment is deleted.
+    """
+
+    def __init__(self, filename: str, count: int):
+        self.filename = filename
+        self.bits = bytearray((count + 7) // 8)
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as f:
+                self.bits[:] = f.read()
+
+        self.count = sum(bin(byte).count('1') for byte in self.bits)
+
+    def add(self, position: int) -> None:
+        if position not in self:
+            self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def save(self) -> None:
+        with open(self.filename + '.tmp', 'wb') as f:
+            f.write(self.bits)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def __contains__(self, position: int):
+        return bool(self.bits[position >> 3] & (1 << (position & 7)))
+
+    def __len__(self):
+        return self.count
+
+
+class Segment:
+    """
+    One segment of the index: the final index, tiers, lexicon, document table,
+    tombstones and positions (if the indexer recorded them) written by
+    Indexer.finalize_index (or compact_segments) to their own folder.
+
+    The postings hold global doc ids, from first_doc_id to first_doc_id +
+    len(segment) - 1. Scores are only normalized by the length of their own
+    document, so a segment never has to change when other segments are
+    added.
+    """
+
+    def __init__(self, folder: str, first_doc_id: int):
+        self.folder = folder
+        self.first_doc_id = first_doc_id
+
+        self.final_index = PostingReader(folder + '/index.bin')
+        self.tier_index = PostingReader(folder + '/tier.bin')
+        self.lexicon = Lexicon(folder + '/lexicon.bin')
+        self.doc_table = DocTable(folder + '/doc_table.bin')
+        self.tombstones = Tombstones(folder + '/tombstones.bin', len(self.doc_table))
+        self.positions = None
+        if os.path.isfile(folder + '/positions.bin'):
+            self.positions = PositionReader(folder + '/positions.bin')
+
+    def url(self, doc_id: int) -> str:
+        return self.doc_table.url(doc_id - self.first_doc_id + 1)
+
+    def delete(self, doc_id: int) -> None:
+        self.tombstones.add(doc_id - self.first_doc_id)
+
+    def is_deleted(self, doc_id: int) -> bool:
+        return doc_id - self.first_doc_id in self.tombstones
+
+    def read_fingerprints(self) -> array or None:
+        """
+        Returns the fingerprint of every document of the segment (in doc id
+        order), or None if the segment was built without them.
+        """
+        return read_fingerprints(self.folder + '/fingerprints.bin')
+
+    def read_posting(self, entry, tier) -> (array, array, array):
+        """
+        Decodes the posting (or the tier) of a lexicon entry of this segment,
+        without the deleted documents.
+        """
+        if tier and entry[4] >= 0:
+            posting = self.tier_index.read_columns(entry[4])
+        else:
+            posting = self.final_index.read_columns(entry[0])
+
+        if not self.tombstones.count:
+            return posting
+
+        doc_ids, scores, importances = posting
+        live = (array('I'), array('d'), array('B'))
+        for i, doc_id in enumerate(doc_ids):
+            if doc_id - self.first_doc_id not in self.tombstones:
+                live[0].append(doc_id)
+                live[1].append(scores[i])
+                live[2].append(importances[i])
+        return live
+
+    def __len__(self):
+        return len(self.doc_table)
+
+    def close(self) -> None:
+        self.final_index.close()
+        self.tier_index.close()
+        self.lexicon.close()
+        self.doc_table.close()
+        if self.positions is not None:
+            self.positions.close()
+
+
+class SegmentSet:
+    """
+    The segments of the index listed in the manifest, searched as if they
+    were one index.
+
+    A lexicon entry of the set is (the entries of the segments that have the
+    word, document frequency, highest score, highest importance, 0 if any
+    segment has a tier of the word or -1). The document frequency is the sum
+    over the segments and the number of documents (len) counts every
+    segment, both with the deleted documents, like Lucene does: the idf of a
+    word stays consistent until a compaction drops the deleted documents.
+    """
+
+    def __init__(self, file_handler, segments=None):
+        # segments are the manifest entries of the segments to open (all of
+        # them by default)
+        if segments is None:
+            segments = load_manifest(file_handler)['segments']
+        self.segments = [Segment('./db/' + segment['name'], segment['first_doc_id'])
+                         for segment in segments]
+        self.first_doc_ids = [segment.first_doc_id for segment in self.segments]
+        self.doc_count = sum(len(segment) for segment in self.segments)
+        # Phrase and proximity queries need the positions of every segment
+        self.has_positions = bool(self.segments) and all(
+            segment.positions is not None for segment in self.segments)
+
+    def get(self, term: str, default=None):
+        parts = []
+        df = 0
+        max_score = 0.0
+        max_importance = 0
+        tier = -1
+
+        for segment in self.segments:
+            entry = segment.lexicon.get(term)
+            if entry is not None:
+                parts.append((segment, entry))
+                df += entry[1]
+                max_score = max(max_score, entry[2])
+                max_importance = max(max_importance, entry[3])
+                if entry[4] >= 0:
+                    tier = 0
+
+        if not parts:
+            return default
+        return (parts, df, max_score, max_importance, tier)
+
+    def __getitem__(self, term: str):
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term: str):
+        return any(term in segment.lexicon for segment in self.segments)
+
+    def read_posting(self, entry, tier) -> (array, array, array):
+        """
+        Decodes the posting of a word from every segment that has it and
+        puts them one after the other (segments are in doc id order). If
+        tier is set, the tier is used in the segments that have one.
+        """
+        parts = entry[0]
+        if len(parts) == 1:
+            segment, segment_entry = parts[0]
+            return segment.read_posting(segment_entry, tier)
+
+        posting = (array('I'), array('d'), array('B'))
+        for segment, segment_entry in parts:
+            for column, part in zip(posting, segment.read_posting(segment_entry, tier)):
+                column.extend(part)
+        return posting
+
+    def read_positions(self, entry, doc_ids) -> {int: array}:
+        """
+        Returns the positions of the word of a lexicon entry in every
+        document of doc_ids that has it. Only the positions of those
+        documents are read.
+        """
+        positions = dict()
+        for segment, segment_entry in entry[0]:
+            if segment.positions is None or segment_entry[5] < 0:
+                continue
+            last_doc_id = segment.first_doc_id + len(segment)
+            found = [doc_id for doc_id in doc_ids if segment.first_doc_id <= doc_id < last_doc_id]
+            if found:
+                positions.update(segment.positions.read(segment_entry[5], found))
+        return positions
+
+    def find_postings(self, entry, doc_ids) -> ({int: (float, int)}, int):
+        """
+        Returns the score and importance of the word of a lexicon entry in
+        every document of doc_ids (in order) that has it, and the number of
+        postings decoded to find them. Only the blocks of the full postings
+        that could hold those documents are decoded (see PostingReader.find).
+        """
+        found = dict()
+        decoded = 0
+        for segment, segment_entry in entry[0]:
+            last_doc_id = segment.first_doc_id + len(segment)
+            part = [doc_id for doc_id in doc_ids if segment.first_doc_id <= doc_id < last_doc_id]
+            if part:
+                segment_found, segment_decoded = segment.final_index.find(segment_entry[0], part)
+                found.update(segment_found)
+                decoded += segment_decoded
+        return found, decoded
+
+    def find_segment(self, doc_id: int) -> Segment:
+        i = bisect.bisect_right(self.first_doc_ids, doc_id) - 1
+        if i < 0 or doc_id - self.segments[i].first_doc_id >= len(self.segments[i]):
+            raise IndexError(f'doc id {doc_id} is not in the index')
+        return self.segments[i]
+
+    def url(self, doc_id: int) -> str:
+        return self.find_segment(doc_id).url(doc_id)
+
+    def is_deleted(self, doc_id: int) -> bool:
+        return self.find_segment(doc_id).is_deleted(doc_id)
+
+    def live_fingerprints(self) -> [(int, int)]:
+        """
+        Returns (doc id, fingerprint) of every document that is not deleted,
+        in the segments that have fingerprints. This reads every segment, so
+        it is only used to build the near-duplicate detector once (see
+        SearchEngine.find_near_duplicates).
+        """
+        found = []
+        for segment in self.segments:
+            fingerprints = segment.read_fingerprints()
+            if fingerprints is None:
+                continue
+            for n, fingerprint in enumerate(fingerprints):
+                if n not in segment.tombstones:
+                    found.append((segment.first_doc_id + n, fingerprint))
+        return found
+
+    def find_urls(self, urls) -> {str: int}:
+        """
+        Returns the doc id of every url of urls that is in the index and is
+        not deleted. Each url is looked up in the url index of the document
+        table of every segment.
+        """
+        found = dict()
+        for url in set(urls):
+            for segment in self.segments:
+                n = segment.doc_table.find(url)
+                if n is not None and n - 1 not in segment.tombstones:
+                    found[url] = segment.first_doc_id + n - 1
+        return found
+
+    def delete(self, doc_ids) -> None:
+        """
+        Marks documents as deleted and saves the tombstones of the segments
+        that changed.
+        """
+        changed = set()
+        for doc_id in doc_ids:
+            segment = self.find_segment(doc_id)
+            segment.delete(doc_id)
+            changed.add(segment)
+
+        for segment in changed:
+            segment.tombstones.save()
+
+    def __len__(self):
+        return self.doc_count
+
+    def close(self) -> None:
+        for segment in self.segments:
+            segment.close()
@@ -0,0 +1,168 @@
+import multiprocessing
+import threading
+
+from file_handler import FileHandler
+from posting_cache import PostingCache
+from query import Query
+from segments import load_manifest
+
+
+def split_segments(segments, shards: int):
+    """
+    Splits the manifest entries of the segments (in doc id order) into at
+    most shards groups of neighbouring segments.
+    """
+    shards = min(shards, len(segments))
+    return [segments[len(segments) * k // shards:len(segments) * (k + 1) // shards]
+            for k in range(shards)]
+
+
+def _serve_shard(connection, segments, cache_size, vectorized):
+    """
+    Runs in the process of one shard. Answers requests of
+    (query scores, tiers, deadline, phrases, proximity) with the local top
+    10 (or top PROXIMITY_CANDIDATES) of its segments (phrases use the
+    positions of its segments), until it gets None. If the query fails, the
+    exception is sent back instead and the shard goes on with the next
+    request. That is a TimeoutError if the deadline passes (time.monotonic()
+    is the same clock in every process).
+    """
+    query = Query(FileHandler(), None, PostingCache(max_bytes=cache_size),
+                  segments=segments, vectorized=vectorized)
+
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+
+        query_scores, tiers, deadline, phrases, proximity = request
+        try:
+            entries = dict()
+            for token in query_scores:
+                entry = query.segments.get(token)
+                if entry is not None:
+                    entries[token] = entry
+            answer = query.retrieve(query_scores, entries, tiers, deadline, phrases, proximity)
+        except Exception as error:
+            # The coordinator raises it again. If the shard process died
+            # instead, every later query would fail with an EOFError.
+            answer = error
+        connection.send(answer)
+
+    connection.close()
+
+
+class ShardedQuery(Query):
+    """
+    A query that is run on shards, each in its own process (scatter-gather).
+
+    The index is split by doc id range: every shard process opens only its
+    own segments and keeps its own posting cache of cache_size bytes. This
+    process (the coordinator) still looks up the lexicon of every segment,
+    so the idf and the query scores are computed from the global document
+    frequencies and number of documents, exactly like the unsharded query.
+    The query scores are sent to every shard, each shard finds its own top
+    10, and the coordinator keeps the best 10 of them. Since a document's
+    score only depends on its own postings, this gives the same ranking as
+    the unsharded engine. With proximity, every shard sends its best
+    PROXIMITY_CANDIDATES documents and the coordinator reranks the best
+    PROXIMITY_CANDIDATES of all of them (it reads their positions from its
+    own segments), like the unsharded engine does.
+    """
+
+    def __init__(self, file_handler, indexer, posting_cache, shards: int,
+                 cache_size=64 * 1024 * 1024, use_tiers=True, vectorized=False, result_cache=None):
+        super().__init__(file_handler, indexer, posting_cache, use_tiers, vectorized=vectorized,
+                         result_cache=result_cache)
+        self.shards = shards
+        self.cache_size = cache_size
+        self.connections = []
+        self.processes = []
+        # One lock per pipe, so a request and its answer go through each pipe
+        # one query at a time, but different queries can be in different
+        # shards at the same time
+        self.pipe_locks = []
+        self.start_shards()
+
+    def start_shards(self):
+        """
+        Starts one process for each group of segments.
+        """
+        for segments in split_segments(load_manifest(self.file_handler)['segments'], self.shards):
+            connection, shard_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve_shard, daemon=True,
+                                              args=(shard_connection, segments, self.cache_size,
+                                                    self.vectorized))
+            process.start()
+            shard_connection.close()
+
+            self.connections.append(connection)
+            self.processes.append(process)
+            self.pipe_locks.append(threading.Lock())
+
+    def stop_shards(self):
+        for connection in self.connections:
+            connection.send(None)
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+        self.connections = []
+        self.processes = []
+        self.pipe_locks = []
+
+    def open_segments(self):
+        """
+        Opens the segments again and restarts the shards with the new
+        segments (after a new segment, deletions or compaction).
+        """
+        super().open_segments()
+        self.stop_shards()
+        self.start_shards()
+
+    def retrieve(self, query_scores, entries, tiers, deadline=None, phrases=(), proximity=False):
+        """
+        Sends the query scores (and phrases) to every shard, then merges the
+        local top 10 of the shards into the global top 10 (the top
+        PROXIMITY_CANDIDATES if proximity is set).
+
+        The pipes are locked in shard order (so two queries can't wait for
+        each other), and each one is unlocked as soon as its answer is read,
+        so the next query can already use the shards that are done with this
+        one.
+        """
+        # The requests are all sent first so the shards work at the same
+        # time
+        locked = 0
+        answers = []
+        try:
+            for lock, connection in zip(self.pipe_locks, self.connections):
+                lock.acquire()
+                locked += 1
+                connection.send((query_scores, tiers, deadline, phrases, proximity))
+
+            # Every answer is read (even after an error) so the pipes are
+            # ready for the next query
+            for lock, connection in zip(self.pipe_locks, self.connections):
+                answers.append(connection.recv())
+                lock.release()
+                locked -= 1
+        finally:
+            # Only if sending or reading failed
+            for lock in self.pipe_locks[len(answers):len(answers) + locked]:
+                lock.release()
+
+        results = []
+        for answer in answers:
+            if isinstance(answer, Exception):
+                raise answer
+            results.extend(answer)
+
+        # Same order as TopKRetriever: most query terms, then score, then the
+        # smallest doc id
+        results.sort(key=lambda result: (result[2], result[1], -result[0]), reverse=True)
+        retriever = self.candidate_retriever if proximity else self.retriever
+        return results[:retriever.k]
+
+    def close(self):
+        self.stop_shards()
@@ -0,0 +1,42 @@
+import re
+from functools import lru_cache
+
+from nltk.stem import SnowballStemmer
+
+
+class Tokenizer:
+    """
+    Splits text into alphanumeric tokens and stems them with the Snowball
+    stemmer. The pattern and the stemmer are made once, and the stems of
+    recently seen words are kept in a bounded memo table so common words are
+    only stemmed once.
+    """
+
+    def __init__(self, memo_size=100000):
+        # Checks for alphanumeric characters (same as the RegexpTokenizer
+        # pattern used before).
+        self.pattern = re.compile('[a-zA-Z0-9]+')
+        self.stemmer = SnowballStemmer(language='english')
+
+        # lru_cache keeps the memo_size most recently used words and counts
+        # hits and misses for us.
+        self.stem = lru_cache(maxsize=memo_size)(self.stemmer.stem)
+
+    def tokenize(self, text: str) -> [str]:
+        """
+        Takes a string of text and returns the stemmed list of tokens.
+        """
+        stem = self.stem
+        return [stem(token) for token in self.pattern.findall(text.lower())]
+
+    def memo_info(self) -> dict:
+        """
+        Returns the hits, misses and size of the stem memo table.
+        """
+        info = self.stem.cache_info()
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'max_size': info.maxsize,
+        }
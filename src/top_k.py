@@ -0,0 +1,174 @@
+import heapq
+import sys
+import time
+from bisect import bisect_left
+
+
+# doc_id of a cursor that went past the end of its posting list
+END = sys.maxsize
+
+# Upper bounds are made slightly larger so that rounding differences between
+# the sum of the bounds and the actual score can never prune a document that
+# should be in the results.
+BOUND_SLACK = 1 + 1e-9
+
+# How many documents are scored between two checks of the deadline
+DEADLINE_CHECK = 1024
+
+
+class PostingCursor:
+    """
+    Walks the posting list of one query term in doc id order.
+
+    weight is the normalized ltc score of the term in the query, and
+    upper_bound is the most a single document can get from this term
+    (weight * highest lnc score + highest importance score).
+    """
+
+    def __init__(self, order: int, doc_ids, scores, importances, weight: float,
+                 max_score: float, max_importance: int):
+        # order is the position of the term in the query. Scores are always
+        # added up in that order so they are exactly the same as before.
+        self.order = order
+        self.doc_ids = doc_ids
+        self.scores = scores
+        self.importances = importances
+        self.weight = weight
+        self.upper_bound = (weight * max_score + max_importance) * BOUND_SLACK
+
+        self.pos = 0
+        self.doc_id = doc_ids[0] if doc_ids else END
+
+    def next(self) -> None:
+        """
+        Moves to the next document of the posting list.
+        """
+        self.pos += 1
+        self.doc_id = self.doc_ids[self.pos] if self.pos < len(self.doc_ids) else END
+
+    def next_geq(self, doc_id: int) -> None:
+        """
+        Moves to the first document whose doc id is doc_id or larger.
+        """
+        if self.doc_id >= doc_id:
+            return
+        self.pos = bisect_left(self.doc_ids, doc_id, self.pos)
+        self.doc_id = self.doc_ids[self.pos] if self.pos < len(self.doc_ids) else END
+
+
+class TopKRetriever:
+    """
+    Finds the k best documents for a query document-at-a-time with MaxScore
+    pruning.
+
+    Documents are ranked by the number of query terms they contain, then by
+    the sum of cosine similarity (lnc.ltc) and importance scores. This is
+    the same order as the soft conjunction loop the query used to do, but
+    only k documents are kept in a heap, and documents that can't beat the
+    k-th best one are skipped without being scored.
+    """
+
+    def __init__(self, k=10):
+        self.k = k
+
+    def retrieve(self, cursors: [PostingCursor], deadline=None) -> [(int, float, int)]:
+        """
+        Returns the k best results as (doc_id, score, number of query terms
+        in the document), best first. If deadline (a time.monotonic() time)
+        is given, TimeoutError is raised once it is passed.
+        """
+        if not cursors:
+            return []
+
+        # Terms with the smallest upper bounds come first. bound_sums[i] is
+        # the most a document can get from the first i terms.
+        cursors = sorted(cursors, key=lambda cursor: cursor.upper_bound)
+        bound_sums = [0.0]
+        for cursor in cursors:
+            bound_sums.append(bound_sums[-1] + cursor.upper_bound)
+
+        terms = len(cursors)
+        # contributions[order] is what the document gets from the query term
+        # at that position (orders may skip terms that have no cursor)
+        slots = max(cursor.order for cursor in cursors) + 1
+        contributions = [None] * slots
+
+        # Min heap of the best results so far as (count, score, -doc_id), so
+        # the worst result is on top.
+        heap = []
+
+        # The first non_essential terms can't get a document into the results
+        # on their own. Only documents from the other (essential) terms are
+        # candidates.
+        non_essential = 0
+        scored = 0
+
+        while non_essential < terms:
+            scored += 1
+            if deadline is not None and scored % DEADLINE_CHECK == 0 and time.monotonic() > deadline:
+                raise TimeoutError('query timed out')
+
+            essential = cursors[non_essential:]
+            doc_id = min(cursor.doc_id for cursor in essential)
+            if doc_id == END:
+                break
+
+            for i in range(slots):
+                contributions[i] = None
+
+            # Scores the document with the essential terms
+            count = 0
+            score = 0.0
+            for cursor in essential:
+                if cursor.doc_id == doc_id:
+                    contribution = (cursor.weight * cursor.scores[cursor.pos],
+                                    cursor.importances[cursor.pos])
+                    contributions[cursor.order] = contribution
+                    count += 1
+                    score += contribution[0] + contribution[1]
+                    cursor.next()
+
+            # Adds the non-essential terms, the largest bounds first, unless
+            # the document can't beat the k-th result anymore.
+            pruned = False
+            for i in range(non_essential - 1, -1, -1):
+                if len(heap) == self.k and (count + i + 1, score + bound_sums[i + 1]) <= heap[0][:2]:
+                    pruned = True
+                    break
+
+                cursor = cursors[i]
+                cursor.next_geq(doc_id)
+                if cursor.doc_id == doc_id:
+                    contribution = (cursor.weight * cursor.scores[cursor.pos],
+                                    cursor.importances[cursor.pos])
+                    contributions[cursor.order] = contribution
+                    count += 1
+                    score += contribution[0] + contribution[1]
+
+            if pruned:
+                continue
+
+            # The exact score, added up in query term order
+            score = 0.0
+            for contribution in contributions:
+                if contribution is not None:
+                    score += contribution[0]
+                    score += contribution[1]
+
+            result = (count, score, -doc_id)
+            if len(heap) < self.k:
+                heapq.heappush(heap, result)
+            elif result > heap[0]:
+                heapq.heapreplace(heap, result)
+            else:
+                continue
+
+            # The k-th result got better, so more terms may be non-essential
+            if len(heap) == self.k:
+                threshold = heap[0][:2]
+                while (non_essential < terms
+                       and (non_essential + 1, bound_sums[non_essential + 1]) <= threshold):
+                    non_essential += 1
+
+        return [(-doc_id, score, count)
+                for count, score, doc_id in sorted(heap, reverse=True)]
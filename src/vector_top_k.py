@@ -0,0 +1,102 @@
+import time
+
+import numpy as np
+
+from metrics import METRICS
+from top_k import PostingCursor
+
+
+class VectorTopKRetriever:
+    """
+    Finds the k best documents for a query term-at-a-time with NumPy, instead
+    of one document at a time in Python like TopKRetriever.
+
+    The posting of every query term is looked at as NumPy arrays (doc ids,
+    lnc scores and importance scores, without copying the cached arrays).
+    Scores and the number of query terms of every document are added up
+    with a scatter-add into arrays that cover the doc id range of the
+    postings. Every term is added in query term order, first weight * lnc
+    score and then the importance score, which is the same order of float
+    additions as TopKRetriever, so the scores are exactly the same. The top k
+    is picked with argpartition and only those k documents are sorted.
+
+    This is faster for queries with several long postings, where the Python
+    loop of TopKRetriever has to visit most of the documents anyway.
+    """
+
+    def __init__(self, k=10):
+        self.k = k
+
+    def retrieve(self, cursors: [PostingCursor], deadline=None) -> [(int, float, int)]:
+        """
+        Returns the k best results as (doc_id, score, number of query terms
+        in the document), best first. If deadline (a time.monotonic() time)
+        is given, TimeoutError is raised once it is passed.
+        """
+        postings = []
+        for cursor in sorted(cursors, key=lambda cursor: cursor.order):
+            if len(cursor.doc_ids) == 0:
+                continue
+            # frombuffer uses the memory of the arrays, the type codes of
+            # array ('I', 'd', 'B') are also NumPy type codes
+            doc_ids = np.frombuffer(cursor.doc_ids, dtype=cursor.doc_ids.typecode)
+            scores = np.frombuffer(cursor.scores, dtype=cursor.scores.typecode)
+            importances = np.frombuffer(cursor.importances, dtype=cursor.importances.typecode)
+            postings.append((doc_ids, scores, importances, cursor.weight))
+
+        if not postings:
+            return []
+
+        # The postings are sorted by doc id, so the range is from the
+        # smallest first doc id to the largest last doc id
+        first_doc_id = min(int(posting[0][0]) for posting in postings)
+        last_doc_id = max(int(posting[0][-1]) for posting in postings)
+        size = last_doc_id - first_doc_id + 1
+
+        totals = np.zeros(size, dtype=np.float64)
+        counts = np.zeros(size, dtype=np.int64)
+
+        for doc_ids, scores, importances, weight in postings:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError('query timed out')
+
+            positions = doc_ids.astype(np.int64) - first_doc_id
+            # A doc id is only once in a posting, so fancy indexing adds every
+            # posting exactly once (no need for np.add.at)
+            totals[positions] += weight * scores
+            totals[positions] += importances
+            counts[positions] += 1
+
+        with METRICS.span('query.top_k'):
+            found = np.flatnonzero(counts)
+            return self.top_k(found + first_doc_id, totals[found], counts[found])
+
+    def top_k(self, doc_ids, scores, counts) -> [(int, float, int)]:
+        """
+        Picks the k best documents by (count, score, smallest doc id). doc_ids
+        must be sorted.
+        """
+        if len(doc_ids) > self.k:
+            # Every document with more query terms than the k-th best count
+            # is in the results
+            kth_count = np.partition(counts, len(counts) - self.k)[len(counts) - self.k]
+            chosen = np.flatnonzero(counts > kth_count)
+
+            # The rest are the best scores among the documents with the k-th
+            # best count, and the smallest doc ids among equal scores
+            tied = np.flatnonzero(counts == kth_count)
+            needed = self.k - len(chosen)
+            if len(tied) > needed:
+                tied_scores = scores[tied]
+                kth_score = tied_scores[np.argpartition(-tied_scores, needed - 1)[needed - 1]]
+                better = tied[tied_scores > kth_score]
+                equal = tied[tied_scores == kth_score]
+                tied = np.concatenate((better, equal[:needed - len(better)]))
+
+            chosen = np.concatenate((chosen, tied))
+            doc_ids, scores, counts = doc_ids[chosen], scores[chosen], counts[chosen]
+
+        # Most query terms first, then the highest score, then the smallest
+        # doc id (lexsort sorts by the last key first)
+        order = np.lexsort((doc_ids, -scores, -counts))
+        return list(zip(doc_ids[order].tolist(), scores[order].tolist(), counts[order].tolist()))